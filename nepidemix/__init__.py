@@ -30,6 +30,8 @@ from process import *
 import simulation
 from simulation import *
 
+import engines
+
 import cluster
 
 import version
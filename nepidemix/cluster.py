@@ -13,6 +13,9 @@ parameter ranges.
 This module is in a very early stage, but may still be useful for other 
 clusters.
 
+Projects created by ClusterSimulation may also be run without a queue, on the
+cores of the local machine, using runProject.
+
 """
 
 __author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
@@ -26,6 +29,8 @@ import numpy
 import stat
 import glob
 import csv
+import random
+import multiprocessing
 
 import collections
 
@@ -34,6 +39,8 @@ from nepidemix.simulation import Simulation
 from nepidemix.utilities import parameterexpander
 from nepidemix import exceptions as nepxExceptions
 from nepidemix.utilities import NepidemiXConfigParser
+from nepidemix.utilities import ArrayNetwork, SharedNetwork
+from nepidemix.utilities import repetitionSeed
 # Logging
 import logging
 
@@ -133,6 +140,7 @@ class ClusterSimulation(object):
     CFG_PARAM_config_base_name = "config_file_base"
 
     original_config_file_name = 'original_config.ini'
+    ledger_file_name = 'completed_jobs.txt'
     fileBaseName = 'config'
     confDirName = 'conf_combination'
     deployScriptName =  'deploy.sh'
@@ -710,3 +718,218 @@ def projectContent(projectDir, excludeSections = [], excludeOptions = [],
                                     Simulation.CFG_PARAM_baseFileName)+'*'
         fileList = glob.glob(wildFile)
         yield params, fileList
+
+
+
+def runProject(projectDir, processes = None, retries = 2, network = None):
+    """
+    Run all simulations of a project directory on the local machine.
+
+    Every configuration and repetition is a job, run by a pool of worker
+    processes handing out one job at a time. As in the PBS scripts each job
+    is run in its configuration directory. The base file name of the output
+    of repetition r is suffixed with _r<r>, as is any database name given,
+    since concurrent jobs writing to one database would block each other.
+    The log of the job is written next to the output with the same base name.
+
+    If the project uses the ensemble engine the repetitions of a
+    configuration are instead run as replicates of a single job.
+
+    If a network is given all jobs use its topology instead of creating a
+    network of their own. It is written once to a shared memory file (see
+    `nepidemix.utilities.SharedNetwork`) which every job reads through the
+    ``load_shared_network`` network function, and which is removed when the
+    project has been run.
+
+    If the configuration sets a seed, repetition 0 uses it and every other
+    repetition a seed derived from it and the repetition number.
+
+    Completed jobs are recorded in a ledger file in the project directory,
+    and are skipped if the project is run again. Failed jobs are retried.
+
+    Parameters
+    ----------
+
+    projectDir : str
+       Project directory, as created by ClusterSimulation.
+
+    processes : int, optional
+       Number of worker processes. Default is the number of cores.
+
+    retries : int, optional
+       Number of times a failed job is retried. Default 2.
+
+    network : networkx.Graph, optional
+       Network whose topology is used by all jobs. Node and edge attributes
+       are not used; the jobs initialize them as configured.
+
+    Returns
+    -------
+
+    failed : list
+       List of (configuration number, repetition) of jobs that did not
+       complete.
+
+    """
+    cp = projectConfig(projectDir)
+    numConfigs = cp.getint(ClusterSimulation.CFG_SECTION_INFO,
+                           ClusterSimulation.CFG_PARAM_num_configs)
+    confDirName = cp.get(ClusterSimulation.CFG_SECTION_INFO,
+                         ClusterSimulation.CFG_PARAM_config_dir_name,
+                         default = 'conf_combination')
+    confBaseName = cp.get(ClusterSimulation.CFG_SECTION_INFO,
+                          ClusterSimulation.CFG_PARAM_config_base_name,
+                          default = 'config')
+    reps = cp.getint(ClusterSimulation.CFG_SECTION_CLUSTER,
+                     ClusterSimulation.CFG_PARAM_repeats,
+                     default = 1)
+    ensemble = cp.get(Simulation.CFG_SECTION_SIM,
+                      Simulation.CFG_PARAM_engine,
+                      default = Simulation.ENGINE_networkx) \
+                      == Simulation.ENGINE_ensemble
+
+    shared = None
+    networkFile = None
+    if network != None:
+        shared = SharedNetwork.create(ArrayNetwork(network))
+        networkFile = shared.fileName
+
+    jobs = []
+    for n in range(numConfigs):
+        cpath = os.path.abspath("{0}/{1}_{2}".format(projectDir, confDirName, n))
+        iniName = cpath + "/{0}_{1}.ini".format(confBaseName, n)
+        if ensemble:
+            jobs.append((n, 0, cpath, iniName, reps, networkFile))
+        else:
+            jobs.extend([(n, r, cpath, iniName, 1, networkFile)
+                         for r in range(reps)])
+
+    ledgerName = projectDir + '/' + ClusterSimulation.ledger_file_name
+    completed = set()
+    if os.path.isfile(ledgerName):
+        with open(ledgerName, 'r') as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) == 2:
+                    completed.add((int(fields[0]), int(fields[1])))
+    pending = [job for job in jobs if (job[0], job[1]) not in completed]
+    logger.info("{0} of {1} jobs already completed, {2} to run."\
+                    .format(len(jobs) - len(pending), len(jobs), len(pending)))
+
+    if processes == None:
+        processes = multiprocessing.cpu_count()
+    # A fresh worker process for each job, so that no state is carried over.
+    pool = multiprocessing.Pool(processes, maxtasksperchild = 1)
+    try:
+        with open(ledgerName, 'a') as ledgerFp:
+            for attempt in range(retries + 1):
+                if len(pending) == 0:
+                    break
+                if attempt > 0:
+                    logger.info("Retrying {0} failed jobs (attempt {1} of {2})."\
+                                    .format(len(pending), attempt, retries))
+                failed = []
+                for job, err in pool.imap_unordered(_runJob, pending):
+                    if err == None:
+                        ledgerFp.write("{0} {1}\n".format(job[0], job[1]))
+                        ledgerFp.flush()
+                        os.fsync(ledgerFp.fileno())
+                        logger.info("Completed configuration {0}, repetition {1}."\
+                                        .format(job[0], job[1]))
+                    else:
+                        logger.error("Configuration {0}, repetition {1} failed: {2}"\
+                                         .format(job[0], job[1], err))
+                        failed.append(job)
+                pending = failed
+    finally:
+        pool.close()
+        pool.join()
+        if shared != None:
+            shared.close()
+    if len(pending) > 0:
+        logger.error("{0} jobs did not complete.".format(len(pending)))
+    return [(job[0], job[1]) for job in pending]
+
+
+def _runJob(job):
+    """
+    Run a single job of runProject in a worker process.
+
+    Parameters
+    ----------
+
+    job : tuple
+       (configuration number, repetition, configuration directory,
+       configuration file, replicates, shared network file or None)
+
+    Returns
+    -------
+
+    job : tuple
+       The job.
+
+    err : str or None
+       None if the job completed, otherwise a description of the error.
+
+    """
+    n, rep, cpath, iniName, replicates, networkFile = job
+    # Worker processes are forked with the random state of the parent.
+    random.seed()
+    numpy.random.seed()
+    rootLogger = logging.getLogger()
+    handler = None
+    try:
+        os.chdir(cpath)
+        settings = NepidemiXConfigParser()
+        with open(iniName, 'r') as fp:
+            settings.readfp(fp)
+        baseName = settings.get(Simulation.CFG_SECTION_OUTPT,
+                                Simulation.CFG_PARAM_baseFileName) \
+                                + "_r{0}".format(rep)
+        settings.set(Simulation.CFG_SECTION_OUTPT,
+                     Simulation.CFG_PARAM_baseFileName, baseName)
+        if settings.has_option(Simulation.CFG_SECTION_OUTPT,
+                               Simulation.CFG_PARAM_db_name):
+            dbRoot, dbExt = os.path.splitext(
+                settings.get(Simulation.CFG_SECTION_OUTPT,
+                             Simulation.CFG_PARAM_db_name))
+            settings.set(Simulation.CFG_SECTION_OUTPT,
+                         Simulation.CFG_PARAM_db_name,
+                         dbRoot + "_r{0}".format(rep) + dbExt)
+        if replicates > 1:
+            settings.set(Simulation.CFG_SECTION_SIM,
+                         Simulation.CFG_PARAM_replicates, replicates)
+        if rep > 0 and settings.has_option(Simulation.CFG_SECTION_SIM,
+                                           Simulation.CFG_PARAM_seed):
+            # Repetitions of a configuration with a fixed seed are given
+            # seeds of their own, derived from it.
+            seed = settings.getint(Simulation.CFG_SECTION_SIM,
+                                   Simulation.CFG_PARAM_seed)
+            settings.set(Simulation.CFG_SECTION_SIM, Simulation.CFG_PARAM_seed,
+                         repetitionSeed(seed, rep))
+        if networkFile != None:
+            settings.set(Simulation.CFG_SECTION_SIM,
+                         Simulation.CFG_PARAM_network_name,
+                         'load_shared_network')
+            settings.remove_option(Simulation.CFG_SECTION_SIM,
+                                   Simulation.CFG_PARAM_network_module)
+            settings.remove_section(Simulation.CFG_SECTION_NETWORK)
+            settings.set(Simulation.CFG_SECTION_NETWORK, 'file', networkFile)
+        handler = logging.FileHandler(cpath + '/' + baseName + '.log', 'w')
+        handler.setFormatter(logging.Formatter(
+                "%(asctime)s. - %(name)s - %(levelname)s - %(message)s"))
+        rootLogger.addHandler(handler)
+        rootLogger.setLevel(logging.DEBUG)
+
+        sim = Simulation()
+        sim.configure(settings)
+        sim.execute()
+        sim.saveData()
+        return job, None
+    except (Exception, SystemExit) as err:
+        logger.exception("Job failed.")
+        return job, "{0}: {1}".format(type(err).__name__, err)
+    finally:
+        if handler != None:
+            rootLogger.removeHandler(handler)
+            handler.close()
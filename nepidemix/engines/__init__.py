@@ -0,0 +1,38 @@
+"""
+==================
+Simulation engines
+==================
+
+Alternative implementations of the main loop of
+`nepidemix.simulation.Simulation`.
+
+An engine is selected through the ``engine`` option in the ``Simulation``
+configuration section. The default, ``networkx``, is the loop implemented in
+`Simulation.execute` itself. Every other value is looked up in `ENGINES`.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['ArrayEngine', 'GillespieEngine', 'EnsembleEngine', 'ParallelEngine',
+           'DynamicEngine', 'ENGINES']
+
+import arrayengine
+from arrayengine import ArrayEngine
+import gillespieengine
+from gillespieengine import GillespieEngine
+import ensembleengine
+from ensembleengine import EnsembleEngine
+import parallelengine
+from parallelengine import ParallelEngine
+import dynamicengine
+from dynamicengine import DynamicEngine
+
+# Map from engine option value to engine class.
+ENGINES = {'array' : ArrayEngine,
+           'gillespie' : GillespieEngine,
+           'ensemble' : EnsembleEngine,
+           'parallel' : ParallelEngine,
+           'dynamic' : DynamicEngine}
@@ -0,0 +1,346 @@
+"""
+==================
+Array state engine
+==================
+
+Main loop keeping node states in integer arrays.
+
+Every node state is interned to an integer id and kept in a numpy int32
+array, while the topology is held in a CSR adjacency. The double buffering
+of the networkx loop is replaced by two preallocated state arrays, and only
+nodes and edges that actually change are written back to the networkx graph.
+Thus network, state count and database output is produced exactly as by the
+networkx loop in `nepidemix.simulation.Simulation.execute`.
+
+If the process can compile its node rules into a kernel (see
+`nepidemix.process.Process.compileNodeRules`) all nodes are updated by the
+kernel at once, otherwise the node rule is called for every node. With the
+``leap_flat_rules`` option the kernel draws the transitions of states whose
+rules do not depend on neighbours per state (see
+`nepidemix.rulekernel.NodeRuleKernel.leap`). Edge rules are compiled in the
+same way (see `nepidemix.process.Process.compileEdgeRules`), keeping the
+edge states in an array indexed by edge.
+
+The engine requires a process with constant topology.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['ArrayEngine']
+
+import numpy
+
+from nepidemix.utilities.arraynetwork import ArrayNetwork, StateIndex
+from nepidemix.utilities.networkxtra import attributesChanged
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+
+class ArrayEngine(object):
+    """
+    Array backed simulation main loop.
+
+    The engine is created by, and operates on, a configured
+    `nepidemix.simulation.Simulation`. Process rules are executed in the same
+    order and with the same arguments as by the networkx loop, but without
+    copying the network or re-adding all nodes every iteration.
+
+    Attributes
+    ----------
+
+    arrayNetwork : nepidemix.utilities.ArrayNetwork
+       The network topology.
+
+    stateIndex : nepidemix.utilities.StateIndex
+       Node state interning, that of the process.
+
+    readStates : numpy.ndarray
+       Node state ids of the previous iteration.
+
+    writeStates : numpy.ndarray
+       Node state ids being computed in the current iteration.
+
+    kernel : object or None
+       The compiled node rules of the process, if any.
+
+    edgeKernel : object or None
+       The compiled edge rules of the process, if any.
+
+    """
+    # The main loop starts at Simulation.firstIteration, so a simulation can
+    # be resumed from a checkpoint.
+    supportsCheckpoints = True
+
+    def __init__(self, simulation):
+        """
+        Parameters
+        ----------
+
+        simulation : nepidemix.simulation.Simulation
+           A configured simulation.
+
+        """
+        self.simulation = simulation
+        self.process = simulation.process
+        self.network = simulation.network
+        self.arrayNetwork = self._createTopology()
+        self.stateIndex = self.process.stateIndex
+        self.readStates = numpy.empty(len(self.arrayNetwork),
+                                      dtype=numpy.int32)
+        nodeData = self.network.node
+        for i, n in enumerate(self.arrayNetwork.nodes):
+            self.readStates[i] = self.stateIndex.intern(
+                self.process.deduceNodeState((n, nodeData[n])))
+        self.writeStates = self.readStates.copy()
+        logger.info("Array engine: {0} nodes, {1} initial node states."\
+                        .format(len(self.arrayNetwork), len(self.stateIndex)))
+        self.kernel = self.process.compileNodeRules(self.network,
+                                                    self.arrayNetwork,
+                                                    self.stateIndex)
+        if self.kernel != None:
+            logger.info("Using compiled node rules.")
+            self.kernel.leap = simulation.leapFlatRules
+        self.edgeKernel = None
+        if self.process.runEdgeUpdate == True:
+            self.edgeKernel = self._compileEdgeRules()
+            if self.edgeKernel != None:
+                logger.info("Using compiled edge rules.")
+                if self.kernel != None:
+                    self.kernel.edgeKernel = self.edgeKernel
+
+    def run(self, db_cur = None):
+        """
+        Run the main loop for the number of iterations of the simulation.
+
+        Parameters
+        ----------
+
+        db_cur : sqlite3.Cursor, optional
+           If given node events are written to the database.
+
+        """
+        sim = self.simulation
+        process = self.process
+        network = self.network
+        dt = sim.dt
+        # Graph data is double buffered, the node data is not as nodes are
+        # only written back after all rules have been executed.
+        readData = network.graph
+        writeData = {}
+        sim._copyGraphData(readData, writeData)
+
+        for it in range(sim.firstIteration, sim.iterations):
+            changedNodes = []
+            changedEdges = []
+            if process.runNodeUpdate == True:
+                if self.kernel != None:
+                    changedNodes = self._updateNodesKernel(it, readData,
+                                                           writeData, db_cur)
+                else:
+                    changedNodes = self._updateNodes(it, readData, writeData,
+                                                     db_cur)
+            if process.runEdgeUpdate == True:
+                if self.edgeKernel != None:
+                    changedEdges = self._updateEdgesKernel(readData, writeData)
+                else:
+                    changedEdges = self._updateEdges(writeData)
+
+            # Commit node and edge changes.
+            nodes = self.arrayNetwork.nodes
+            for i, atts in changedNodes:
+                network.node[nodes[i]] = atts
+            if len(changedNodes) > 0:
+                ci = numpy.array([i for i, atts in changedNodes],
+                                 dtype=numpy.int64)
+                self.readStates[ci] = self.writeStates[ci]
+            for e in changedEdges:
+                ed = network.adj[e[0]][e[1]]
+                ed.clear()
+                ed.update(e[2])
+
+            network.graph = writeData
+            network = self._updateNetwork(network)
+            writeData[sim.TIME_FIELD_NAME] = readData[sim.TIME_FIELD_NAME] + dt
+
+            readData, writeData = writeData, readData
+            network.graph = readData
+            sim.network = network
+            sim._copyGraphData(readData, writeData)
+
+            if sim._endOfIteration(it):
+                break
+
+    def _createTopology(self):
+        """
+        The array topology of the network.
+
+        """
+        return ArrayNetwork(self.network)
+
+    def _compileEdgeRules(self):
+        """
+        The compiled edge rules of the process, or None.
+
+        """
+        return self.process.compileEdgeRules(self.network, self.arrayNetwork,
+                                             StateIndex())
+
+    def _updateNetwork(self, network):
+        """
+        Execute the network rule, if the process has one.
+
+        Returns
+        -------
+
+        network : networkx.Graph
+           The network returned by the rule.
+
+        """
+        if self.process.runNetworkUpdate == True:
+            network = self.process.networkUpdateRule(network,
+                                                     self.simulation.dt)
+        return network
+
+    def _updateNodes(self, it, readData, writeData, db_cur):
+        """
+        Execute the node rule for every node.
+
+        Returns
+        -------
+
+        changed : list
+           List of (array position, attribute dictionary) of nodes whose
+           attributes changed.
+
+        """
+        sim = self.simulation
+        process = self.process
+        network = self.network
+        stateIndex = self.stateIndex
+        nodes = self.arrayNetwork.nodes
+        nodeData = network.node
+        readStates = self.readStates
+        writeStates = self.writeStates
+        counts = writeData[sim.STATE_COUNT_FIELD_NAME]
+        simTime = readData[sim.TIME_FIELD_NAME]
+        changed = []
+        for i in xrange(len(nodes)):
+            n = nodes[i]
+            atts = nodeData[n]
+            nc = process.nodeUpdateRule((n, atts.copy()), network, sim.dt)
+            if attributesChanged(atts, nc[1]):
+                changed.append((i, nc[1]))
+                sid = stateIndex.intern(process.deduceNodeState(nc))
+                if sid != readStates[i]:
+                    writeStates[i] = sid
+                    oldstate = stateIndex.states[readStates[i]]
+                    newstate = stateIndex.states[sid]
+                    counts[newstate] += 1
+                    counts[oldstate] -= 1
+                    if db_cur != None:
+                        sim._dbNodeEvent(db_cur, oldstate, newstate, nc[1],
+                                         n, simTime, it)
+        return changed
+
+    def _updateNodesKernel(self, it, readData, writeData, db_cur):
+        """
+        Update all nodes using the compiled node rules.
+
+        Returns
+        -------
+
+        changed : list
+           List of (array position, attribute dictionary) of nodes whose
+           state changed.
+
+        """
+        sim = self.simulation
+        states = self.stateIndex.states
+        nodes = self.arrayNetwork.nodes
+        counts = writeData[sim.STATE_COUNT_FIELD_NAME]
+        simTime = readData[sim.TIME_FIELD_NAME]
+        ci = self.kernel.update(self.readStates, self.writeStates,
+                                readData[sim.STATE_COUNT_FIELD_NAME], sim.dt)
+        oldIds = self.readStates[ci]
+        newIds = self.writeStates[ci]
+        # Update the counts once per pair of states.
+        ns = len(states)
+        pairs, pairCounts = numpy.unique(oldIds.astype(numpy.int64) * ns 
+                                         + newIds, return_counts = True)
+        for p, c in zip(pairs, pairCounts):
+            counts[states[p % ns]] += int(c)
+            counts[states[p // ns]] -= int(c)
+        changed = []
+        for i, o, n in zip(ci, oldIds, newIds):
+            atts = self.kernel.attributes(n)
+            changed.append((i, atts))
+            if db_cur != None:
+                sim._dbNodeEvent(db_cur, states[o], states[n], atts,
+                                 nodes[i], simTime, it)
+        return changed
+
+    def _updateEdges(self, writeData):
+        """
+        Execute the edge rule for every edge.
+
+        Returns
+        -------
+
+        changed : list
+           List of edges (with data) whose attributes changed.
+
+        """
+        sim = self.simulation
+        process = self.process
+        network = self.network
+        counts = writeData[sim.STATE_COUNT_FIELD_NAME]
+        changed = []
+        for e in network.edges_iter(data = True):
+            ne = process.edgeUpdateRule((e[0], e[1], e[2].copy()),
+                                        network, sim.dt)
+            if attributesChanged(e[2], ne[2]):
+                changed.append(ne)
+                oldstate = process.deduceEdgeState(e)
+                newstate = process.deduceEdgeState(ne)
+                if newstate != oldstate:
+                    counts[newstate] += 1
+                    counts[oldstate] -= 1
+        return changed
+
+    def _updateEdgesKernel(self, readData, writeData):
+        """
+        Update all edges using the compiled edge rules.
+
+        The rules see the node states of the previous iteration.
+
+        Returns
+        -------
+
+        changed : list
+           List of edges (with data) whose state changed.
+
+        """
+        sim = self.simulation
+        kernel = self.edgeKernel
+        states = kernel.stateIndex.states
+        counts = writeData[sim.STATE_COUNT_FIELD_NAME]
+        ce, oldIds = kernel.update(self.readStates,
+                                   readData[sim.STATE_COUNT_FIELD_NAME], sim.dt)
+        newIds = kernel.states[ce]
+        ns = len(states)
+        pairs, pairCounts = numpy.unique(oldIds.astype(numpy.int64) * ns
+                                         + newIds, return_counts = True)
+        for p, c in zip(pairs, pairCounts):
+            counts[states[p % ns]] += int(c)
+            counts[states[p // ns]] -= int(c)
+        edges = kernel.edges
+        return [(edges[e][0], edges[e][1], kernel.attributes(n))
+                for e, n in zip(ce, newIds)]
+
@@ -0,0 +1,101 @@
+"""
+==============
+Dynamic engine
+==============
+
+Main loop for processes changing the network topology.
+
+The networkx loop of `nepidemix.simulation.Simulation.execute` rebuilds the
+whole network every iteration when the topology is not constant. This engine
+instead works as the array engine (see `nepidemix.engines.ArrayEngine`),
+keeping node states in arrays and writing only the changed nodes and edges
+back to the one networkx network, with the topology held in a
+`nepidemix.utilities.DynamicNetwork`.
+
+The network rule of the process is executed on the network itself, and the
+edges it adds and removes are recorded in a
+`nepidemix.utilities.TopologyLog`. The log is then applied to the dynamic
+network, and to the neighbour counts of the compiled node rules (see
+`nepidemix.rulekernel.DynamicNodeRuleKernel`), so that the cost of a
+topology change follows the number of edges changed.
+
+The network rule must change the network in place, through the networkx
+methods adding and removing edges, and must not add or remove nodes. Edge
+rules are executed edge by edge.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['DynamicEngine']
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+from nepidemix.utilities.dynamicnetwork import DynamicNetwork, TopologyLog
+
+from arrayengine import ArrayEngine
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+
+class DynamicEngine(ArrayEngine):
+    """
+    Array backed simulation main loop for a changing topology.
+
+    Attributes
+    ----------
+
+    arrayNetwork : nepidemix.utilities.DynamicNetwork
+       The network topology.
+
+    See Also
+    --------
+
+    ArrayEngine : Superclass
+
+    """
+    def _createTopology(self):
+        """
+        The dynamic topology of the network.
+
+        """
+        return DynamicNetwork(self.network)
+
+    def _compileEdgeRules(self):
+        """
+        Edges come and go, so the edge rules are not compiled.
+
+        """
+        return None
+
+    def _updateNetwork(self, network):
+        """
+        Execute the network rule and apply its topology changes.
+
+        As in the networkx loop the rule is executed every iteration unless
+        the process has constant topology and no network rule.
+
+        Returns
+        -------
+
+        network : networkx.Graph
+           The network.
+
+        """
+        process = self.process
+        if process.runNetworkUpdate != True and process.constantTopology == True:
+            return network
+        with TopologyLog(network) as log:
+            updated = process.networkUpdateRule(network, self.simulation.dt)
+        if updated is not network:
+            raise NepidemiXBaseException("The dynamic engine requires the network rule to change the network in place.")
+        added, removed = self.arrayNetwork.apply(log)
+        if self.kernel != None:
+            self.kernel.moveEdges(added, removed, self.readStates)
+        return network
@@ -0,0 +1,240 @@
+"""
+===============
+Ensemble engine
+===============
+
+Main loop running several replicates of a simulation in one pass.
+
+All replicates share the topology of the configured network, held as one
+block diagonal array adjacency (see
+`nepidemix.utilities.ArrayNetwork.tile`), and are updated together by the
+compiled node rules of the process. Replicate 0 starts from the configured
+node states, while the node states of every other replicate are initialized
+by the process in the same way, drawing from a random stream of the
+replicate (see `nepidemix.simulation.Simulation.replicateNodeStates` and
+`nepidemix.utilities.RandomStreams`). If the node states were not
+initialized by the simulation (node_init off), all replicates start from the
+node states of the network.
+
+Replicate 0 is written back to the networkx network, so the ordinary state
+count, network and database output describes that replicate. The state
+counts of all replicates are collected in
+`nepidemix.simulation.Simulation.ensembleSamples` and saved as separate
+files by `Simulation.saveData`.
+
+The engine requires a process able to compile its node rules (such as
+`nepidemix.process.ScriptedProcess`) and without edge or network rules.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['EnsembleEngine']
+
+import numpy
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+from nepidemix.utilities.arraynetwork import ArrayNetwork
+
+from nepidemix.utilities import networkxtra
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+
+class EnsembleEngine(object):
+    """
+    Replicate simulation main loop.
+
+    The engine is created by, and operates on, a configured
+    `nepidemix.simulation.Simulation`, running `Simulation.replicates`
+    replicates.
+
+    Attributes
+    ----------
+
+    replicates : int
+       Number of replicates.
+
+    arrayNetwork : nepidemix.utilities.ArrayNetwork
+       The topology, tiled once per replicate. Node i of replicate r is at
+       position r*N+i.
+
+    stateIndex : nepidemix.utilities.StateIndex
+       Node state interning, that of the process.
+
+    readStates : numpy.ndarray
+       Node state ids of the previous iteration.
+
+    writeStates : numpy.ndarray
+       Node state ids being computed in the current iteration.
+
+    kernel : nepidemix.rulekernel.NodeRuleKernel
+       The compiled node rules of the process.
+
+    stateCounts : numpy.ndarray
+       Number of nodes in each state id, array of shape (replicates, number
+       of states).
+
+    """
+    def __init__(self, simulation):
+        """
+        Parameters
+        ----------
+
+        simulation : nepidemix.simulation.Simulation
+           A configured simulation.
+
+        """
+        self.simulation = simulation
+        self.process = simulation.process
+        self.network = simulation.network
+        self.replicates = simulation.replicates
+        if self.process.runEdgeUpdate == True \
+                or self.process.runNetworkUpdate == True:
+            raise NepidemiXBaseException("The ensemble engine does not support edge or network rules.")
+        network = ArrayNetwork(self.network)
+        self.arrayNetwork = network.tile(self.replicates)
+        self.stateIndex = self.process.stateIndex
+        initial = numpy.empty(len(network), dtype=numpy.int32)
+        nodeData = self.network.node
+        for i, n in enumerate(network.nodes):
+            initial[i] = self.stateIndex.intern(
+                self.process.deduceNodeState((n, nodeData[n])))
+        replicateStates = simulation.replicateNodeStates
+        if replicateStates == None:
+            # The node states were placed by the network, not dealt.
+            replicateStates = [initial] * (self.replicates - 1)
+        self.readStates = numpy.concatenate([initial] + replicateStates)
+        self.writeStates = self.readStates.copy()
+        self.kernel = self.process.compileNodeRules(self.network,
+                                                    self.arrayNetwork,
+                                                    self.stateIndex)
+        if self.kernel == None:
+            raise NepidemiXBaseException("The ensemble engine requires a process with compiled node rules, {0} has none."\
+                                             .format(type(self.process).__name__))
+        self.kernel.leap = simulation.leapFlatRules
+        self._size = len(network)
+        # Which states match which state count labels, see _countLabels.
+        self._labels = None
+        self._labelMatch = None
+        ns = len(self.stateIndex)
+        self.stateCounts = numpy.bincount(
+            numpy.repeat(numpy.arange(self.replicates), self._size) * ns
+            + self.readStates, minlength = self.replicates * ns)\
+            .reshape((self.replicates, ns))
+        logger.info("Ensemble engine: {0} replicates of {1} nodes, {2} initial node states."\
+                        .format(self.replicates, self._size,
+                                len(self.stateIndex)))
+
+    def run(self, db_cur = None):
+        """
+        Run the main loop for the number of iterations of the simulation.
+
+        Parameters
+        ----------
+
+        db_cur : sqlite3.Cursor, optional
+           If given node events of replicate 0 are written to the database.
+
+        """
+        sim = self.simulation
+        network = self.network
+        graphData = network.graph
+        counts = graphData[sim.STATE_COUNT_FIELD_NAME]
+        states = self.stateIndex.states
+        nodes = self.arrayNetwork.nodes
+        kernel = self.kernel
+
+        # Ensemble samples, the time and a (replicates, labels) array per
+        # sample.
+        labels = counts.keys()
+        sim.ensembleSamples = {}
+        for k in sim.stateSamples:
+            sim.ensembleSamples[k] = [(graphData[sim.TIME_FIELD_NAME],
+                                       self._countLabels(labels))]
+
+        for it in range(sim.iterations):
+            simTime = graphData[sim.TIME_FIELD_NAME]
+            ci = kernel.update(self.readStates, self.writeStates, counts,
+                               sim.dt)
+            oldIds = self.readStates[ci]
+            newIds = self.writeStates[ci]
+            self._countTransitions(ci // self._size, oldIds, newIds)
+            # Replicate 0 is written back to the network.
+            for j in range(numpy.searchsorted(ci, self._size)):
+                i = ci[j]
+                atts = kernel.attributes(newIds[j])
+                network.node[nodes[i]] = atts
+                counts[states[newIds[j]]] += 1
+                counts[states[oldIds[j]]] -= 1
+                if db_cur != None:
+                    sim._dbNodeEvent(db_cur, states[oldIds[j]],
+                                     states[newIds[j]], atts, nodes[i],
+                                     simTime, it)
+            self.readStates[ci] = newIds
+            graphData[sim.TIME_FIELD_NAME] = simTime + sim.dt
+
+            for k in sim.stateSamples:
+                if sim._sampleDue(k, it):
+                    sim.ensembleSamples[k].append(
+                        (graphData[sim.TIME_FIELD_NAME],
+                         self._countLabels(labels)))
+            sim._endOfIteration(it)
+
+    def _countTransitions(self, reps, oldIds, newIds):
+        """
+        Update the state counts of the replicates.
+
+        """
+        ns = len(self.stateIndex)
+        if ns > self.stateCounts.shape[1]:
+            grown = numpy.zeros((self.replicates, ns),
+                                dtype = self.stateCounts.dtype)
+            grown[:, :self.stateCounts.shape[1]] = self.stateCounts
+            self.stateCounts = grown
+        numpy.subtract.at(self.stateCounts, (reps, oldIds), 1)
+        numpy.add.at(self.stateCounts, (reps, newIds), 1)
+
+    def _countLabels(self, labels):
+        """
+        Number of nodes matching each state count label in each replicate.
+
+        The (states, labels) matrix of matches is kept between calls, and
+        only extended with the rows of new states.
+
+        Returns
+        -------
+
+        counts : numpy.ndarray
+           Array of shape (replicates, len(labels)).
+
+        """
+        ns = self.stateCounts.shape[1]
+        if labels != self._labels:
+            self._labels = list(labels)
+            self._labelMatch = self._matchLabels(0, ns)
+        elif ns > self._labelMatch.shape[0]:
+            self._labelMatch = numpy.vstack(
+                [self._labelMatch,
+                 self._matchLabels(self._labelMatch.shape[0], ns)])
+        return self.stateCounts.dot(self._labelMatch)
+
+    def _matchLabels(self, start, stop):
+        """
+        Rows `start` to `stop` of the (states, labels) matrix of matches,
+        for the labels of `_labels`.
+
+        """
+        return numpy.array([[networkxtra.matchDictAttributes(dict(st),
+                                                             dict(label))
+                             for label in self._labels]
+                            for st in self.stateIndex.states[start:stop]],
+                           dtype = self.stateCounts.dtype)\
+                           .reshape((stop - start, len(self._labels)))
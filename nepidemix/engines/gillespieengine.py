@@ -0,0 +1,274 @@
+"""
+=================
+Gillespie engine
+=================
+
+Continuous time main loop for processes with compiled node rules.
+
+Instead of trying every rule of every node with probability rate times dt,
+the rule expressions are taken as transition rates of a continuous time
+Markov chain which is simulated exactly using the direct method of
+Gillespie. The propensity of every node (the sum of the rates of its rules)
+is kept in a binary sum tree, so drawing the next node is logarithmic in the
+number of nodes, and after a transition only the propensities of the node
+and the nodes having it as neighbour are recomputed.
+
+The time step dt of the simulation only decides the time points at which
+state counts and networks are sampled, so that output lands on the same
+grid as for the discrete time engines. As every transition changes the mean
+field, the propensities of all nodes in states having rules that refer to
+``MF`` are recomputed after every transition, which costs a pass over those
+nodes per transition.
+
+The engine requires a process able to compile its node rules (such as
+`nepidemix.process.ScriptedProcess`) and without edge or network rules.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['GillespieEngine', 'PropensityTree']
+
+import math
+
+import numpy
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+from nepidemix.utilities.arraynetwork import ArrayNetwork
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+
+class PropensityTree(object):
+    """
+    Binary sum tree over non-negative weights.
+
+    Leaf i holds the weight of item i and every inner node the sum of its
+    children, so the total is found at the root and an item can be drawn
+    with probability proportional to its weight in logarithmic time.
+
+    Attributes
+    ----------
+
+    size : int
+       Number of leaves, the smallest power of two not less than the number
+       of items.
+
+    tree : numpy.ndarray
+       The tree, with the root at position 1 and the children of position p
+       at 2p and 2p+1. Leaves start at position `size`.
+
+    """
+    def __init__(self, n):
+        """
+        Parameters
+        ----------
+
+        n : int
+           Number of items. All weights start at zero.
+
+        """
+        self.size = 1
+        while self.size < n:
+            self.size *= 2
+        self.tree = numpy.zeros(2 * self.size)
+
+    def total(self):
+        """
+        The sum of all weights.
+
+        """
+        return self.tree[1]
+
+    def update(self, idx, weights):
+        """
+        Set the weights of items `idx` (an array of unique positions) to
+        `weights`.
+
+        """
+        if len(idx) == 0:
+            return
+        tree = self.tree
+        p = idx + self.size
+        tree[p] = weights
+        p = numpy.unique(p // 2)
+        while p[0] > 0:
+            tree[p] = tree[2 * p] + tree[2 * p + 1]
+            p = numpy.unique(p // 2)
+
+    def sample(self, x):
+        """
+        The item at cumulative weight `x`, where 0 <= x < total().
+
+        """
+        tree = self.tree
+        p = 1
+        while p < self.size:
+            p *= 2
+            if x >= tree[p] and tree[p + 1] > 0:
+                x -= tree[p]
+                p += 1
+        return p - self.size
+
+
+class GillespieEngine(object):
+    """
+    Continuous time simulation main loop.
+
+    The engine is created by, and operates on, a configured
+    `nepidemix.simulation.Simulation`. The simulation is run for
+    iterations times dt time units, and the `Simulation` end of iteration
+    handling (sampling, network saving) is called at every multiple of dt.
+
+    Attributes
+    ----------
+
+    arrayNetwork : nepidemix.utilities.ArrayNetwork
+       The network topology.
+
+    stateIndex : nepidemix.utilities.StateIndex
+       Node state interning, that of the process.
+
+    states : numpy.ndarray
+       Current node state ids.
+
+    kernel : nepidemix.rulekernel.NodeRuleKernel
+       The compiled node rules of the process.
+
+    propensities : PropensityTree
+       Total rate of each node.
+
+    """
+    def __init__(self, simulation):
+        """
+        Parameters
+        ----------
+
+        simulation : nepidemix.simulation.Simulation
+           A configured simulation.
+
+        """
+        self.simulation = simulation
+        self.process = simulation.process
+        self.network = simulation.network
+        if self.process.runEdgeUpdate == True \
+                or self.process.runNetworkUpdate == True:
+            raise NepidemiXBaseException("The Gillespie engine does not support edge or network rules.")
+        self.arrayNetwork = ArrayNetwork(self.network)
+        self.stateIndex = self.process.stateIndex
+        self.states = numpy.empty(len(self.arrayNetwork), dtype=numpy.int32)
+        nodeData = self.network.node
+        for i, n in enumerate(self.arrayNetwork.nodes):
+            self.states[i] = self.stateIndex.intern(
+                self.process.deduceNodeState((n, nodeData[n])))
+        self.kernel = self.process.compileNodeRules(self.network,
+                                                    self.arrayNetwork,
+                                                    self.stateIndex)
+        if self.kernel == None:
+            raise NepidemiXBaseException("The Gillespie engine requires a process with compiled node rules, {0} has none."\
+                                             .format(type(self.process).__name__))
+        self.propensities = PropensityTree(len(self.arrayNetwork))
+        logger.info("Gillespie engine: {0} nodes, {1} initial node states."\
+                        .format(len(self.arrayNetwork), len(self.stateIndex)))
+
+    def run(self, db_cur = None):
+        """
+        Run the simulation for iterations times dt time units.
+
+        Parameters
+        ----------
+
+        db_cur : sqlite3.Cursor, optional
+           If given node events are written to the database, with the time
+           of the event. As a node may change state more than once in an
+           iteration the minor iteration is a running event number.
+
+        """
+        sim = self.simulation
+        network = self.network
+        graphData = network.graph
+        counts = graphData[sim.STATE_COUNT_FIELD_NAME]
+        nodes = self.arrayNetwork.nodes
+        states = self.states
+        # Uniform random numbers, drawn in batches by the process.
+        uniform = self.process.uniform
+        kernel = self.kernel
+        tree = self.propensities
+        numEvents = 0
+
+        self._updatePropensities(numpy.arange(len(states)), counts)
+        meanFieldStates = numpy.array(sorted(kernel.meanFieldStates),
+                                      dtype = numpy.int32)
+        t = graphData[sim.TIME_FIELD_NAME]
+        for it in range(sim.iterations):
+            tEnd = graphData[sim.TIME_FIELD_NAME] + sim.dt
+            while True:
+                total = tree.total()
+                if total <= 0:
+                    break
+                tau = -math.log(1.0 - uniform()) / total
+                if t + tau >= tEnd:
+                    # The process is memoryless, so the time already waited
+                    # is simply discarded at the sampling point.
+                    break
+                t += tau
+                i = tree.sample(uniform() * total)
+                old = states[i]
+                # Select the rule.
+                rates = kernel.rates(states, old, numpy.array([i]), counts)\
+                    [:, 0].cumsum()
+                r = numpy.searchsorted(rates,
+                                       uniform() * rates[-1],
+                                       side = 'right')
+                new = kernel.rules[old][min(r, len(rates) - 1)][0]
+                states[i] = new
+                oldstate = self.stateIndex.states[old]
+                newstate = self.stateIndex.states[new]
+                counts[newstate] += 1
+                counts[oldstate] -= 1
+                atts = kernel.attributes(new)
+                network.node[nodes[i]] = atts
+                if db_cur != None:
+                    sim._dbNodeEvent(db_cur, oldstate, newstate, atts,
+                                     nodes[i], t, it, numEvents)
+                changed = numpy.array([i], dtype=numpy.int64)
+                nbrs = kernel.moveNodes(changed,
+                                        numpy.array([old], dtype=numpy.int32),
+                                        numpy.array([new], dtype=numpy.int32))
+                affected = numpy.union1d(changed, nbrs)
+                if len(meanFieldStates) > 0:
+                    # The counts changed, and with them the rates of all
+                    # nodes in states whose rules refer to MF.
+                    affected = numpy.union1d(affected, numpy.flatnonzero(
+                            numpy.in1d(states, meanFieldStates)))
+                self._updatePropensities(affected, counts)
+                numEvents += 1
+
+            t = tEnd
+            graphData[sim.TIME_FIELD_NAME] = tEnd
+            if sim._endOfIteration(it):
+                break
+        logger.info("{0} transitions.".format(numEvents))
+
+    def _updatePropensities(self, idx, counts):
+        """
+        Recompute the propensities of the nodes at positions `idx`.
+
+        """
+        kernel = self.kernel
+        nodeStates = self.states[idx]
+        weights = numpy.zeros(len(idx))
+        for sid in numpy.unique(nodeStates):
+            if sid not in kernel.rules:
+                continue
+            sel = nodeStates == sid
+            weights[sel] = kernel.rates(self.states, sid, idx[sel],
+                                        counts).sum(axis = 0)
+        self.propensities.update(idx, weights)
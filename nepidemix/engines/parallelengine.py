@@ -0,0 +1,312 @@
+"""
+===============
+Parallel engine
+===============
+
+Main loop sweeping the nodes of one simulation on several cores.
+
+As in the array engine node states are interned to integer ids, but here the
+topology and the state array are held in a
+`nepidemix.utilities.SharedNetwork`, and the neighbour state count table of
+the compiled node rules in shared memory. The nodes are split into
+contiguous blocks, one per worker, and every iteration each worker evaluates
+the node rules of the active nodes of its block (see
+`nepidemix.rulekernel.NodeRuleKernel.activeNodes`) against the states of the
+previous iteration. Since the update is synchronous the blocks are
+independent. The main process finds the active nodes, which it passes to the
+workers in shared memory together with the state counts read by ``MF``, as
+the count vector of the counter store of the simulation. The workers return
+the nodes that changed and their new states, which are merged, counted and
+written back to the networkx network by the main process before the next
+iteration.
+
+Each block draws its random numbers from its own stream of the simulation
+(see `nepidemix.utilities.RandomStreams`), keyed by the iteration and the
+block number. A run is thus reproducible for a given seed and number of
+workers, but differs between numbers of workers.
+
+Workers are forked processes, inheriting the shared memory and the compiled
+rules, so the engine requires a platform supporting ``fork``. It also
+requires a process able to compile its node rules (such as
+`nepidemix.process.ScriptedProcess`) and without edge or network rules.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['ParallelEngine']
+
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+from nepidemix.utilities.arraynetwork import ArrayNetwork
+from nepidemix.utilities.sharednetwork import SharedNetwork
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+# The engine being run, inherited by the forked workers.
+_engine = None
+
+
+class ParallelEngine(object):
+    """
+    Multi-core simulation main loop.
+
+    The engine is created by, and operates on, a configured
+    `nepidemix.simulation.Simulation`, using `Simulation.workers` worker
+    processes.
+
+    Attributes
+    ----------
+
+    workers : int
+       Number of workers, and of node blocks.
+
+    sharedNetwork : nepidemix.utilities.SharedNetwork
+       The network topology and node states. Closed at the end of `run`.
+
+    arrayNetwork : nepidemix.utilities.ArrayNetwork
+       The network topology, a view of `sharedNetwork`. None once closed.
+
+    stateIndex : nepidemix.utilities.StateIndex
+       Node state interning, that of the process.
+
+    states : numpy.ndarray
+       Node state ids, in shared memory. None once closed.
+
+    kernel : nepidemix.rulekernel.NodeRuleKernel
+       The compiled node rules of the process, with its neighbour table in
+       shared memory.
+
+    blocks : list
+       The (first, last + 1) node positions of each block.
+
+    active : numpy.ndarray
+       The positions of the active nodes of an iteration, in shared memory,
+       grouped by state.
+
+    meanField : numpy.ndarray
+       The count vector of the state counts of an iteration, in shared
+       memory.
+
+    """
+    # The main loop starts at Simulation.firstIteration, so a simulation can
+    # be resumed from a checkpoint.
+    supportsCheckpoints = True
+
+    def __init__(self, simulation):
+        """
+        Parameters
+        ----------
+
+        simulation : nepidemix.simulation.Simulation
+           A configured simulation.
+
+        """
+        self.simulation = simulation
+        self.process = simulation.process
+        self.network = simulation.network
+        if self.process.runEdgeUpdate == True \
+                or self.process.runNetworkUpdate == True:
+            raise NepidemiXBaseException("The parallel engine does not support edge or network rules.")
+        self.sharedNetwork = SharedNetwork.create(ArrayNetwork(self.network))
+        self.arrayNetwork = self.sharedNetwork.arrayNetwork()
+        self.stateIndex = self.process.stateIndex
+        size = len(self.arrayNetwork)
+        self.states = self.sharedNetwork.states
+        nodeData = self.network.node
+        for i, n in enumerate(self.arrayNetwork.nodes):
+            self.states[i] = self.stateIndex.intern(
+                self.process.deduceNodeState((n, nodeData[n])))
+        self.kernel = self.process.compileNodeRules(self.network,
+                                                    self.arrayNetwork,
+                                                    self.stateIndex)
+        if self.kernel == None:
+            self._close()
+            raise NepidemiXBaseException("The parallel engine requires a process with compiled node rules, {0} has none."\
+                                             .format(type(self.process).__name__))
+        self.kernel.leap = simulation.leapFlatRules
+        # All states are known at this point (the rules register their
+        # destination states) and the table counts those referred to by the
+        # rules, so it does not grow and can be moved to shared memory once.
+        self.kernel._buildTable(self.states)
+        table = _sharedArray(numpy.int32, self.kernel.nnTable.size)\
+            .reshape(self.kernel.nnTable.shape)
+        table[:] = self.kernel.nnTable
+        self.kernel.nnTable = table
+
+        self.workers = max(1, min(simulation.workers, size))
+        bounds = numpy.linspace(0, size, self.workers + 1).astype(int).tolist()
+        self.blocks = zip(bounds[:-1], bounds[1:])
+        self._bounds = numpy.array(bounds, dtype = numpy.int64)
+        self.active = _sharedArray(numpy.int64, size)
+        self.meanField = None
+        logger.info("Parallel engine: {0} nodes in {1} blocks, {2} node states."\
+                        .format(size, self.workers, len(self.stateIndex)))
+
+    def run(self, db_cur = None):
+        """
+        Run the main loop for the number of iterations of the simulation.
+
+        Parameters
+        ----------
+
+        db_cur : sqlite3.Cursor, optional
+           If given node events are written to the database.
+
+        """
+        global _engine
+        sim = self.simulation
+        network = self.network
+        graphData = network.graph
+        counts = graphData[sim.STATE_COUNT_FIELD_NAME]
+        states = self.stateIndex.states
+        nodes = self.arrayNetwork.nodes
+        kernel = self.kernel
+        table = kernel.nnTable
+        ns = len(states)
+        # The workers read MF from the count vector.
+        kernel.bindCounterStore(counts.store)
+        self.meanField = _sharedArray(numpy.int64, len(counts.vector()))
+
+        _engine = self
+        pool = None
+        if self.workers > 1:
+            pool = multiprocessing.Pool(self.workers)
+        try:
+            for it in range(sim.firstIteration, sim.iterations):
+                simTime = graphData[sim.TIME_FIELD_NAME]
+                counts.vector(out = self.meanField)
+                tasks = self._tasks(it, kernel.activeNodes(self.states,
+                                                           counts), sim.dt)
+                if kernel.nnTable is not table:
+                    raise NepidemiXBaseException("The parallel engine can not add node states during a run.")
+                if pool != None:
+                    results = pool.map(_sweepBlock, tasks)
+                else:
+                    results = map(_sweepBlock, tasks)
+                ci = numpy.concatenate([r[0] for r in results])
+                newIds = numpy.concatenate([r[1] for r in results])
+                oldIds = self.states[ci]
+                # Update the counts once per pair of states.
+                pairs, pairCounts = numpy.unique(oldIds.astype(numpy.int64) * ns
+                                                 + newIds, return_counts = True)
+                for p, c in zip(pairs, pairCounts):
+                    counts[states[p % ns]] += int(c)
+                    counts[states[p // ns]] -= int(c)
+                for i, o, n in zip(ci, oldIds, newIds):
+                    atts = kernel.attributes(n)
+                    network.node[nodes[i]] = atts
+                    if db_cur != None:
+                        sim._dbNodeEvent(db_cur, states[o], states[n], atts,
+                                         nodes[i], simTime, it)
+                self.states[ci] = newIds
+                kernel.moveNodes(ci, oldIds, newIds, self.states)
+                graphData[sim.TIME_FIELD_NAME] = simTime + sim.dt
+                if sim._endOfIteration(it):
+                    break
+        finally:
+            if pool != None:
+                pool.terminate()
+                pool.join()
+            _engine = None
+            self._close()
+
+    def _close(self):
+        """
+        Drop the views of the shared network held by the engine and its
+        kernel, and close it.
+
+        """
+        if self.kernel != None:
+            self.kernel.arrayNetwork = None
+            self.kernel._rindptr = self.kernel._rindices = None
+            self.kernel._states = None
+        self.arrayNetwork = None
+        self.states = None
+        self.sharedNetwork.close()
+
+    def _tasks(self, it, active, dt):
+        """
+        Write the active nodes to `active` and split them into one task per
+        block.
+
+        Parameters
+        ----------
+
+        it : int
+           The iteration.
+
+        active : list
+           List of (state id, sorted positions) of the active nodes.
+
+        dt : float
+           Time step.
+
+        Returns
+        -------
+
+        tasks : list
+           The tasks of `_sweepBlock`.
+
+        """
+        slices = [[] for b in self.blocks]
+        start = 0
+        for sid, idx in active:
+            self.active[start:start+len(idx)] = idx
+            cuts = (numpy.searchsorted(idx, self._bounds) + start).tolist()
+            for p in range(len(self.blocks)):
+                if cuts[p+1] > cuts[p]:
+                    slices[p].append((sid, cuts[p], cuts[p+1]))
+            start += len(idx)
+        return [(p, it, slices[p], dt) for p in range(len(self.blocks))]
+
+
+def _sweepBlock(task):
+    """
+    Sweep the active nodes of one block of the running engine.
+
+    Parameters
+    ----------
+
+    task : tuple
+       (block number, iteration, list of (state id, first and last + 1
+       position in `ParallelEngine.active`) of the active nodes of the
+       block, dt).
+
+    Returns
+    -------
+
+    changed : numpy.ndarray
+       Sorted positions of the nodes that changed state.
+
+    newIds : numpy.ndarray
+       The new state ids of the changed nodes.
+
+    """
+    p, it, slices, dt = task
+    random = _engine.simulation.randomStreams.stream('partition', it, p)
+    active = [(sid, _engine.active[start:stop]) for sid, start, stop in slices]
+    return _engine.kernel.sweep(_engine.states, active, _engine.meanField, dt,
+                                random)
+
+
+def _sharedArray(dtype, size):
+    """
+    A numpy array of `size` zeros of type `dtype` in shared memory,
+    inherited by forked processes.
+
+    """
+    dtype = numpy.dtype(dtype)
+    buf = RawArray('b', max(size, 1) * dtype.itemsize)
+    return numpy.frombuffer(buf, dtype = dtype, count = size)
@@ -21,6 +21,12 @@ from utilities import networkxtra
 
 from utilities.linkedcounter import LinkedCounter
 
+from utilities.arraynetwork import StateIndex
+
+from utilities.dynamicnetwork import DynamicNetwork
+
+from rulekernel import NodeRuleKernel, DynamicNodeRuleKernel, EdgeRuleKernel
+
 import numpy
 
 import networkx
@@ -31,7 +37,9 @@ import math
 
 import collections
 
-import copy
+import ast
+
+import itertools
 
 # Logging
 import logging
@@ -86,6 +94,17 @@ class Process(object):
     deduceEdgeState(...)
        From whatever representation the process has of an edge return its 
        state.
+    compileNodeRules(...)
+       Optional. A whole-population version of nodeUpdateRule used by the
+       array engines.
+    compileEdgeRules(...)
+       Optional. A whole-network version of edgeUpdateRule used by the
+       array engine.
+    parseState(...)
+       Optional. The state count label of a state given as a string in the
+       configuration.
+    isAbsorbed(...)
+       Optional. Tells the simulation that no rule can change the network.
 
     See method documentation for interface specifications.
 
@@ -107,6 +126,14 @@ class Process(object):
        updates. If set to false a full topology copy will be performed and
        this also overrides any run[Node/Edge/Network]Update flags set to 
        False, forcing the updates.
+    stateIndex
+       A `nepidemix.utilities.StateIndex` giving every node state deduced
+       by the process an integer id, in the order the states are first
+       seen. Shared by the engines and the database output, which stores
+       the content derived ids given by `StateIndex.digest`.
+    random
+       The ``numpy.random.RandomState`` the process draws from, set by
+       `setRandom`. Default is the global ``numpy.random``.
 
     """
     def __init__(self, 
@@ -147,6 +174,42 @@ class Process(object):
         self.runNodeUpdate = runNodeUpdate
         self.runNetworkUpdate = runNetworkUpdate
         self.constantTopology = constantTopology
+        self.stateIndex = StateIndex()
+        self.setRandom(numpy.random)
+
+    def setRandom(self, random, batchSize = 1024):
+        """
+        Set the generator the process draws random numbers from.
+
+        Parameters
+        ----------
+
+        random : numpy.random.RandomState
+           The generator.
+
+        batchSize : int, optional
+           Number of uniform random numbers drawn at a time by `uniform`.
+           Default 1024.
+
+        """
+        self.random = random
+        self._uniformBatchSize = max(batchSize, 1)
+        self._uniforms = []
+
+    def uniform(self):
+        """
+        A uniform random number in [0, 1) from `random`.
+
+        The numbers are drawn as vectors, to avoid a call to the generator
+        for every node update.
+
+        """
+        if len(self._uniforms) == 0:
+            self._uniforms = self.random.random_sample(
+                self._uniformBatchSize).tolist()
+            # Popped from the end.
+            self._uniforms.reverse()
+        return self._uniforms.pop()
 
 
     
@@ -404,6 +467,126 @@ class Process(object):
         """
         return None
 
+    def compileNodeRules(self, network, arrayNetwork, stateIndex):
+        """
+        Compile the node update rule into a kernel updating all nodes at once.
+
+        Used by the array engines (see `nepidemix.engines`). A kernel must
+        have the methods ``update(srcStates, dstStates, meanField, dt)``,
+        setting the state ids of changed nodes in `dstStates` and returning
+        their sorted positions, and ``attributes(sid)`` giving a new node
+        attribute dictionary for a state id. See
+        `nepidemix.rulekernel.NodeRuleKernel`.
+
+        Overload if the process can evaluate its rules on arrays. The default
+        returns None, in which case nodeUpdateRule is called for each node.
+
+        Parameters
+        ----------
+
+        network : networkx.Graph
+           The network.
+
+        arrayNetwork : nepidemix.utilities.ArrayNetwork
+           The topology of `network` as used by the engine.
+
+        stateIndex : nepidemix.utilities.StateIndex
+           The interning of the states returned by deduceNodeState into the
+           integer ids used by the engine.
+
+        Returns
+        -------
+
+        kernel : object or None
+           The compiled rules.
+
+        """
+        return None
+
+    def compileEdgeRules(self, network, arrayNetwork, stateIndex):
+        """
+        Compile the edge update rule into a kernel updating all edges at once.
+
+        Used by the array engine (see `nepidemix.engines.ArrayEngine`). A
+        kernel must have the attributes ``edges``, the (node, node) pairs in
+        edge order, and ``states``, the state id of each edge, and the methods
+        ``update(nodeStates, meanField, dt)``, setting the new edge states and
+        returning the sorted positions and previous state ids of the changed
+        edges, and ``attributes(sid)`` giving a new edge attribute dictionary
+        for a state id. See `nepidemix.rulekernel.EdgeRuleKernel`.
+
+        Overload if the process can evaluate its edge rules on arrays. The
+        default returns None, in which case edgeUpdateRule is called for each
+        edge.
+
+        Parameters
+        ----------
+
+        network : networkx.Graph
+           The network.
+
+        arrayNetwork : nepidemix.utilities.ArrayNetwork
+           The topology of `network` as used by the engine.
+
+        stateIndex : nepidemix.utilities.StateIndex
+           The interning of the states returned by deduceEdgeState into the
+           integer ids used by the engine. Separate from that of the nodes.
+
+        Returns
+        -------
+
+        kernel : object or None
+           The compiled rules.
+
+        """
+        return None
+
+    def parseState(self, stateString):
+        """
+        The state of the state count dictionary described by a string.
+
+        Used for states named in the configuration, such as in stopping
+        conditions. The default returns the string itself.
+
+        Parameters
+        ----------
+
+        stateString : str
+           The state as written in the configuration.
+
+        Returns
+        -------
+
+        state : hashable
+           The state count label.
+
+        """
+        return stateString
+
+    def isAbsorbed(self, network):
+        """
+        Check if the network has reached a state no rule can leave.
+
+        Used by the simulation to stop early (see option
+        ``stop_when_absorbed``). Overload if the process can tell. The
+        default returns False, i.e. the network may always change.
+
+        Parameters
+        ----------
+
+        network : networkx.Graph
+           The network, as after an iteration.
+
+        Returns
+        -------
+
+        absorbed : bool
+           True if no further node, edge or network update can change the
+           network.
+
+        """
+        return False
+
 
 class ExplicitStateProcess(Process):
     """
@@ -565,7 +748,8 @@ class ExplicitStateProcess(Process):
             raise NepidemiXBaseException(errMsg)
         # Distribute the states.
         networkxtra.attributeValueDeal(network.nodes_iter(data=True),nodeAttDict, 
-                                             network.number_of_nodes())
+                                             network.number_of_nodes(),
+                                             random = self.random)
       
         # Finally just add a symbol for the mean field of any states that may
         # have ended up with a distribution of zero entities in the first round
@@ -628,7 +812,8 @@ class ExplicitStateProcess(Process):
         # Distribute the states.
         networkxtra.attributeValueDeal(network.edges_iter(data=True), 
                                              edgeAttDict, 
-                                             network.number_of_edges())
+                                             network.number_of_edges(),
+                                             random = self.random)
         
         # Finally just add a symbol for the mean field of any states that may
         # have ended up with a distribution of zero entities in the first round
@@ -889,7 +1074,8 @@ class AttributeStateProcess(Process):
         networkxtra.attributeValueDeal(network.nodes_iter(data=True),
                                              nodeAtts, 
                                              network.number_of_nodes(),
-                                             dealExact in ('yes', 'on', 'true'))
+                                             dealExact in ('yes', 'on', 'true'),
+                                             self.random)
         return network
 
     def initializeNetworkEdges(self, network, *args, **kwargs):
@@ -948,7 +1134,8 @@ class AttributeStateProcess(Process):
         networkxtra.attributeValueDeal(network.edges_iter(data=True),
                                              edgeAtts, 
                                              network.number_of_edges(),
-                                             dealExact in ('yes', 'on', 'true'))
+                                             dealExact in ('yes', 'on', 'true'),
+                                             self.random)
         return network
 
     def deduceNodeState(self, node):
@@ -1005,6 +1192,21 @@ class AttributeStateProcess(Process):
         # This is an explicit state process, so we can just return it.
         return frozenset(edge[-1].iteritems())
 
+    def parseState(self, stateString):
+        """
+        The state of the state count dictionary described by a string.
+
+        The string is a (partial) state dictionary, written as in the
+        NodeStateDistribution section, e.g. '{status:I}'.
+
+        See Also
+        --------
+
+        Process : Superclass
+
+        """
+        return frozenset(eval(stateString, self.evalNS).iteritems())
+
 
 class ScriptedProcess(AttributeStateProcess):
     """
@@ -1107,6 +1309,18 @@ class ScriptedProcess(AttributeStateProcess):
     |                 | be written and they will be evaluated in the order     |
     |                 | declared.                                              |
     +-----------------+--------------------------------------------------------+
+    | EdgeRules       | List of edge transition rules.                         |
+    |                 | Written as the node rules, but with edge attribute     |
+    |                 | dictionaries on both sides of the ``->`` sign. Every   |
+    |                 | iteration the rules are evaluated for every edge, on   |
+    |                 | the node states of the previous iteration.             |
+    |                 | ``NE({attribute1:key1, attribute2:key2, ...})``        |
+    |                 | yields the number of end nodes of the edge (0, 1 or 2) |
+    |                 | in the given node state (or partial state). ``MF`` can |
+    |                 | be used as in the node rules, ``NN`` can not.          |
+    |                 | The counts of all edge states are tracked with the     |
+    |                 | mean field states.                                     |
+    +-----------------+--------------------------------------------------------+
 
     Configuration File Sections
     ---------------------------
@@ -1208,9 +1422,6 @@ class ScriptedProcess(AttributeStateProcess):
         
         Currently constant topology is assumed.
 
-        Currently *only* node updates are performed even if
-        edge rules are given!!
-
         """
         if not kwargs.has_key(self.CFG_PARAM_config_file):
             err = "No config file given for ScriptedProcess!"
@@ -1237,7 +1448,7 @@ class ScriptedProcess(AttributeStateProcess):
                          .format(configFileName))
 
         # These are the 'protected' names (of operators).
-        protNames = set(['NN', 'MF'])
+        protNames = set(['NN', 'MF', 'NE'])
         
         
         nodeAtts = dict([(att, creader.parseTuple(vals)) for att, vals in creader.items(self.CFG_SECTION_node_attribs)])
@@ -1258,6 +1469,17 @@ class ScriptedProcess(AttributeStateProcess):
                      runNetworkUpdate = False,
                      constantTopology = True)
         
+        # Mean field states given as constants to MF in the rules, see
+        # _compileRule.
+        self.meanFieldKeys = []
+        self._meanFieldKeyIndex = {}
+        # Positions of meanFieldKeys in the count vector of a counter store,
+        # see _MFlookup.
+        self._meanFieldStore = None
+        self._meanFieldPositions = None
+        # Enumerated states, see _createAllPossibleSets.
+        self._possibleSets = {}
+
         # Create rule mappings.
         self.nodeRules = self._createRuleDict([(creader.parseMapping(s),r) for s,r in nodeRuleList], self.nodeAttributeDict)
         self.edgeRules = self._createRuleDict([(creader.parseMapping(s),r) for s,r in edgeRuleList], self.edgeAttributeDict)
@@ -1265,6 +1487,7 @@ class ScriptedProcess(AttributeStateProcess):
         # Add the functions to the namespace dictionary.
         self.evalNS['NN'] = self._NNlookup
         self.evalNS['MF'] = self._MFlookup
+        self.evalNS['NE'] = self._NElookup
 
         # Add the parameters.
         self.evalNS.update(self.modelParameters)
@@ -1306,6 +1529,10 @@ class ScriptedProcess(AttributeStateProcess):
         # Need to overload this as the mean fields can be partial states.
         # Work over the meanField states to evaluate keys and to separate them into
         # the different possible states.
+        # All counts are taken from a histogram of the node states, made in
+        # one pass over the nodes.
+        histogram = self._stateHistogram(network.nodes_iter(data=True),
+                                         self.nodeAttributeDict)
         nmfl = []
         for s in self.meanFieldStates:
             
@@ -1323,7 +1550,7 @@ class ScriptedProcess(AttributeStateProcess):
                     network.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME][oStateSet] = listnr
                 for k in allsets:
                     # Count number of nodes matching this state.
-                    nns = networkxtra.entityCountSet(network.nodes_iter(data=True), k)
+                    nns = histogram.get(k, 0)
                     # Add them to the network graph.
                     if network.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME].has_key(k):
                         network.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME][k].linkedCounters.extend(l)
@@ -1333,13 +1560,24 @@ class ScriptedProcess(AttributeStateProcess):
 #                        logger.debug("Leaf state {0} CREATED. Initial count: {1}".format(k,nns))
                 # If we created a listener we need to set is value to the sum as well.
                 if len(allsets) >1:
-                    osnns = networkxtra.entityCountSet(network.nodes_iter(data=True), oStateSet)
+                    osnns = self._histogramCount(histogram, oStateSet,
+                                                 network.nodes_iter(data=True))
                     network.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME][oStateSet].counter = osnns 
 #                    logger.debug("Partial state {0} CREATED, inital value set to {1}".format(oStateSet, osnns))
 
             # Extend sets.
             nmfl.extend(allsets)
 
+        # With edge rules every full edge state is counted, as edge updates
+        # move edges between them.
+        if len(self.edgeRules) > 0:
+            counts = network.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME]
+            edgeHistogram = self._stateHistogram(network.edges_iter(data=True),
+                                                 self.edgeAttributeDict)
+            oStateSet, allsets = self._createAllPossibleSets({}, self.edgeAttributeDict)
+            for k in allsets:
+                if not counts.has_key(k):
+                    counts[k] = LinkedCounter(edgeHistogram.get(k, 0))
 
         self.meanFieldStates = nmfl
 
@@ -1352,6 +1590,53 @@ class ScriptedProcess(AttributeStateProcess):
 
 
 
+    def _stateHistogram(self, iterator, referenceDict):
+        """
+        Count the entities of an iterator per state.
+
+        The state of an entity is taken as the set of its attributes named
+        in `referenceDict`, so that the count of a full state is found
+        directly in the histogram.
+
+        Parameters
+        ----------
+
+        iterator : networkx.Graph iterator
+           A networkx node or edge iterator, created with data=True.
+
+        referenceDict : dict
+           Dictionary of all valid attributes and their allowed values.
+
+        Returns
+        -------
+
+        histogram : collections.Counter
+           Number of entities in each state.
+
+        """
+        names = referenceDict.keys()
+        return collections.Counter(frozenset([(a, e[-1][a]) for a in names
+                                              if e[-1].has_key(a)])
+                                   for e in iterator)
+
+    def _histogramCount(self, histogram, stateSet, iterator):
+        """
+        Number of entities matching a (partial) state set, as counted by
+        `networkxtra.entityCountSet`, from a histogram made by
+        `_stateHistogram`.
+
+        If the set refers to attributes not in the histogram the entities of
+        `iterator` are counted instead.
+
+        """
+        names = set()
+        for state in histogram:
+            names.update([a for a, v in state])
+        if not all([a in names for a, v in stateSet]):
+            return networkxtra.entityCountSet(iterator, stateSet)
+        return sum([c for state, c in histogram.iteritems()
+                    if networkxtra.matchSetAttributes(dict(state), stateSet)])
+
     def _createRuleDict(self, ruleList, referenceDict):
         """
         Given a set of rules as strings this method create a list of 
@@ -1390,7 +1675,7 @@ class ScriptedProcess(AttributeStateProcess):
             oStateSet, fromStateList = self._createAllPossibleSets(fromState, referenceDict)
             toState = eval(mpair[1], self.evalNS)
             # Create rule-code.
-            rCode = compile(rule,"<string: '{0}'>".format(rule),mode='eval')
+            rCode = self._compileRule(rule)
             for fst in fromStateList:
                 # The dictionary has source state as key, and the value is a pair where
                 # first value is the target state, and the second value is a compiled code object.
@@ -1400,15 +1685,57 @@ class ScriptedProcess(AttributeStateProcess):
 
         return tmpRules
 
+    def _compileRule(self, rule):
+        """
+        Compile a rule string to a code object.
+
+        Calls to MF with a constant state (a dictionary of attribute names and
+        values) are replaced by calls with the index of the state in
+        `meanFieldKeys`, so that the state need not be built and hashed every
+        time the rule is evaluated.
+
+        Parameters
+        ----------
+
+        rule : str
+           The rule expression.
+
+        Returns
+        -------
+
+        code : code object
+           The compiled rule.
+
+        """
+        tree = _MeanFieldIndexer(self).visit(ast.parse(rule, mode='eval'))
+        ast.fix_missing_locations(tree)
+        return compile(tree, "<string: '{0}'>".format(rule), mode='eval')
+
+    def _meanFieldIndex(self, atts):
+        """
+        Index of the mean field state `atts` in `meanFieldKeys`, added if not
+        already present.
+
+        """
+        key = frozenset(atts.iteritems())
+        if not self._meanFieldKeyIndex.has_key(key):
+            self._meanFieldKeyIndex[key] = len(self.meanFieldKeys)
+            self.meanFieldKeys.append(key)
+        return self._meanFieldKeyIndex[key]
+
     def _createAllPossibleSets(self, attDict, referenceDict):
         """
         From an attribute dictionary that may or may not be a full
-        state, create all possible full states as a list of dictionaries.
+        state, create all possible full states as a tuple of sets.
         
         The attribute dictionary can be a full state (having a single value for all attributes),
         or multiple states (having multiple values for the same attribute) or even be a
         partial state (lacking attributes). All possible states reached by further specializing
         the dictionary is returned.
+
+        The states are enumerated once for every distinct specialization, and
+        the result is shared by all later calls (e.g. by rules and mean field
+        states referring to the same partial state).
         
         Parameters
         ----------
@@ -1422,39 +1749,29 @@ class ScriptedProcess(AttributeStateProcess):
         Returns
         -------
 
-        stlist : dict
-           List of dictionaries. Each dictionary is a possible state reached from attDict.
+        oset : frozenset
+           The set of `attDict`.
+
+        stlist : tuple
+           Tuple of frozensets. Each set is a possible state reached from attDict.
         
         """
-        stlist = [{}]
         oset = frozenset(attDict.iteritems())
-        for a,op in referenceDict.iteritems():
-            if not attDict.has_key(a):
-                attDict[a] = op
-            if not type(attDict[a]) == tuple:
-                attDict[a] = (attDict[a],)
-
-            # For every additional attribute create a new copy of the full list.
-            stlexten = []
-
-            for c in attDict[a]:
-                # For each additional attribute.
-                # Copy the original list.
-                tmplist = copy.deepcopy(stlist)
-                # Set the attribute value to the current.
-                for d in tmplist:
-                    d[a] = c
-                # Extend the list.
-                stlexten.extend(tmplist)
-            # When we are done update the list for this attribute.
-            stlist = stlexten
-        # Return sets of the dictionaries.
+        names = tuple(referenceDict.keys())
+        values = []
+        for a in names:
+            v = attDict.get(a, referenceDict[a])
+            if not type(v) == tuple:
+                v = (v,)
+            values.append(v)
+        key = (names, tuple(values))
+        stlist = self._possibleSets.get(key)
+        if stlist == None:
+            stlist = tuple(_iterPossibleStates(names, values))
+            self._possibleSets[key] = stlist
 #        logger.debug("Computed list of possible states: {0}".format(stlist))
-        return (oset, [frozenset(d.iteritems()) for d in stlist])
-            
-            
-                    
-    
+        return (oset, stlist)
+
     def nodeUpdateRule(self, node, srcNetwork, dt):
         """
         Perform local node changes.
@@ -1501,7 +1818,7 @@ class ScriptedProcess(AttributeStateProcess):
         # And the nearest adj matrix.
         self._currentAdj = srcNetwork.adj[node[0]]
         # Create random event.
-        eventp = numpy.random.random_sample()
+        eventp = self.uniform()
         
         # As we may check a number of possible destination
         # states the probability of each sequential one
@@ -1524,6 +1841,75 @@ class ScriptedProcess(AttributeStateProcess):
                 break
         return node
 
+    def edgeUpdateRule(self, edge, srcNetwork, dt):
+        """
+        Perform local edge changes.
+
+        Executes the edge rules matching the state of the edge, in the same
+        way as nodeUpdateRule does for nodes.
+
+        Parameters
+        ----------
+
+        edge : networkx edge, Structure (<node id 1>, <node id 2>, <attribute dict>)
+           This is a copy of the current edge and the target of any changes.
+
+        srcNetwork : networkx.Graph
+           A networkX graph, with the original edges and nodes. Will remain
+           unchanged.
+
+        dt : float
+           Time differential (float) as a fraction of time unit (since last
+           update).
+
+        Returns
+        -------
+
+        edge : networkx edge
+           `edge` with changes
+
+        See Also
+        --------
+
+        Process : Superclass
+
+        """
+        self._currentMeanField = srcNetwork.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME]
+        # The end nodes, for NE.
+        self._currentEndpoints = (srcNetwork.node[edge[0]],
+                                  srcNetwork.node[edge[1]])
+        eventp = self.uniform()
+        prob = 0
+        rList = self.edgeRules.get(frozenset(edge[-1].iteritems()), [])
+        for dSt, rule in rList:
+            prob += eval(rule, self.evalNS) * dt
+            if eventp < prob:
+                edge[-1].update(dSt)
+                break
+        return edge
+
+    def _NElookup(self, nodeAtts):
+        """
+        Internal function that is mapped to the symbol 'NE' for use in edge
+        rules. NE(dict) gives the number of end nodes of the current edge (0,
+        1 or 2) having the attributes described by the dictionary dict.
+
+        Parameters
+        ----------
+
+        nodeAtts : dict
+           Node state dictionary matching a specific or partial state.
+
+        Returns
+        -------
+
+        nnodes : int
+           Number of end nodes matching `nodeAtts`.
+
+        """
+        return len([n for n in self._currentEndpoints
+                    if networkxtra.matchDictAttributes(n, nodeAtts)])
+
     def _NNlookup(self, nodeAtts, givenEdgeAtts = None):
         """
         Internal function that is mapped to the symbol 'NN' for use in the process definition
@@ -1571,12 +1957,115 @@ class ScriptedProcess(AttributeStateProcess):
         Parameters
         ----------
 
-        atts : dict
-           Attribute dictionary matching a specific or partial mean field state.
+        atts : dict or int
+           Attribute dictionary matching a specific or partial mean field state,
+           or the index of the state in `meanFieldKeys`.
+
+        """
+        if type(atts) is int:
+            counts = self._currentMeanField
+            store = getattr(counts, 'store', None)
+            if store is not None:
+                # State counts held by a counter store are read by position,
+                # resolved once per store.
+                if store is not self._meanFieldStore \
+                        or atts >= len(self._meanFieldPositions):
+                    self._meanFieldPositions = \
+                        store.positions(self.meanFieldKeys).tolist()
+                    self._meanFieldStore = store
+                pos = self._meanFieldPositions[atts]
+                if pos >= 0:
+                    return counts.count(pos) / self._currentNetworkSize
+            key = self.meanFieldKeys[atts]
+        else:
+            key = frozenset(atts.iteritems())
+        rv = self._currentMeanField[key] / self._currentNetworkSize
+        return rv
 
+    def compileNodeRules(self, network, arrayNetwork, stateIndex):
         """
-        rv = self._currentMeanField[frozenset(atts.iteritems())] / self._currentNetworkSize
-        return rv
+        Compile the node rules into a `nepidemix.rulekernel.NodeRuleKernel`,
+        or a `nepidemix.rulekernel.DynamicNodeRuleKernel` if the topology is
+        a `nepidemix.utilities.DynamicNetwork`.
+
+        A subclass overloading nodeUpdateRule gets no kernel, so that the
+        engines call its rule for each node.
+
+        See Also
+        --------
+
+        Process : Superclass
+
+        """
+        if type(self).nodeUpdateRule.__func__ \
+                is not ScriptedProcess.nodeUpdateRule.__func__:
+            return None
+        if isinstance(arrayNetwork, DynamicNetwork):
+            return DynamicNodeRuleKernel(self, network, arrayNetwork,
+                                         stateIndex)
+        return NodeRuleKernel(self, network, arrayNetwork, stateIndex)
+
+    def compileEdgeRules(self, network, arrayNetwork, stateIndex):
+        """
+        Compile the edge rules into a `nepidemix.rulekernel.EdgeRuleKernel`.
+
+        A subclass overloading edgeUpdateRule gets no kernel, so that the
+        engines call its rule for each edge.
+
+        See Also
+        --------
+
+        Process : Superclass
+
+        """
+        if type(self).edgeUpdateRule.__func__ \
+                is not ScriptedProcess.edgeUpdateRule.__func__:
+            return None
+        return EdgeRuleKernel(self, network, arrayNetwork, stateIndex)
+
+    def isAbsorbed(self, network):
+        """
+        Check if the network has reached a state no rule can leave.
+
+        The rules matching each node and edge are evaluated, as by
+        nodeUpdateRule and edgeUpdateRule, until one leading to another state
+        with a positive rate is found. As the rates only depend on the states
+        of the network, a network without such a rule never changes. A
+        process with a network rule or changing topology is never absorbed.
+
+        See Also
+        --------
+
+        Process : Superclass
+
+        """
+        if self.runNetworkUpdate == True or self.constantTopology == False:
+            return False
+        self._currentMeanField = network.graph[nepx.simulation.Simulation.STATE_COUNT_FIELD_NAME]
+        if self.runNodeUpdate == True:
+            for n, atts in network.nodes_iter(data = True):
+                rList = [(dSt, rule) for dSt, rule
+                         in self.nodeRules.get(frozenset(atts.iteritems()), [])
+                         if not _matches(atts, dSt)]
+                if len(rList) == 0:
+                    continue
+                self._currentNNIter = [nb for nb in networkxtra.neighbors_data_iter(network, n)]
+                self._currentAdj = network.adj[n]
+                for dSt, rule in rList:
+                    if eval(rule, self.evalNS) > 0:
+                        return False
+        if self.runEdgeUpdate == True:
+            for u, v, atts in network.edges_iter(data = True):
+                rList = [(dSt, rule) for dSt, rule
+                         in self.edgeRules.get(frozenset(atts.iteritems()), [])
+                         if not _matches(atts, dSt)]
+                if len(rList) == 0:
+                    continue
+                self._currentEndpoints = (network.node[u], network.node[v])
+                for dSt, rule in rList:
+                    if eval(rule, self.evalNS) > 0:
+                        return False
+        return True
 
     
 class ScriptedTimedProcess(ScriptedProcess):
@@ -1709,7 +2198,7 @@ class ScriptedTimedProcess(ScriptedProcess):
         # And the nearest adj matrix.
         self._currentAdj = srcNetwork.adj[node[0]]
         # Create random event.
-        eventp = numpy.random.random_sample()
+        eventp = self.uniform()
         
         # As we may check a number of possible destination
         # states the probability of each sequential one
@@ -1737,6 +2226,59 @@ class ScriptedTimedProcess(ScriptedProcess):
                 break
         return node
 
+    def isAbsorbed(self, network):
+        """
+        Rates depending on the time spent in a state change with time, so
+        the network is only absorbed if no node or edge is in a state having
+        rules leading to another state.
+
+        See Also
+        --------
+
+        ScriptedProcess : Superclass
+
+        """
+        if self.runNetworkUpdate == True or self.constantTopology == False:
+            return False
+        for entities, rules, run in [(network.nodes_iter(data = True),
+                                      self.nodeRules, self.runNodeUpdate),
+                                     (network.edges_iter(data = True),
+                                      self.edgeRules, self.runEdgeUpdate)]:
+            if run != True:
+                continue
+            for e in entities:
+                atts = e[-1]
+                for dSt, rule in rules.get(frozenset(atts.iteritems()), []):
+                    if not _matches(atts, dSt):
+                        return False
+        return True
+
+    def compileNodeRules(self, network, arrayNetwork, stateIndex):
+        """
+        Rules depending on the time spent in a state can not be compiled, the
+        array engines will call nodeUpdateRule for each node.
+
+        Returns
+        -------
+
+        kernel : None
+
+        """
+        return None
+
+    def compileEdgeRules(self, network, arrayNetwork, stateIndex):
+        """
+        Rules depending on the time spent in a state can not be compiled, the
+        array engine will call edgeUpdateRule for each edge.
+
+        Returns
+        -------
+
+        kernel : None
+
+        """
+        return None
+
     def _mapToTSS(self,featureIterator, time):
         """
         Map attribute keys from str to `_TimedState` objects.
@@ -1863,3 +2405,67 @@ class _TimedState(object):
         return self.value.__cmp__(other)
 
 
+def _matches(atts, update):
+    """
+    True if the attributes `atts` already have the values of `update`, i.e.
+    if the update leaves them unchanged.
+
+    """
+    for k, v in update.iteritems():
+        if k not in atts or atts[k] != v:
+            return False
+    return True
+
+
+def _iterPossibleStates(names, values):
+    """
+    Iterate over the states having, for each attribute in `names`, one of the
+    corresponding tuple of `values`. The first attribute varies fastest.
+
+    """
+    rnames = names[::-1]
+    for combination in itertools.product(*values[::-1]):
+        yield frozenset(zip(rnames, combination))
+
+
+class _MeanFieldIndexer(ast.NodeTransformer):
+    """
+    Rewrites MF calls with a constant state argument into MF calls with the
+    index of the state, see `ScriptedProcess._compileRule`.
+
+    Attribute names and values may be given as string literals, or as the
+    names the process defines for them.
+
+    """
+    def __init__(self, process):
+        self.process = process
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == 'MF' \
+                and len(node.args) == 1 and len(node.keywords) == 0 \
+                and node.starargs == None and node.kwargs == None \
+                and isinstance(node.args[0], ast.Dict):
+            atts = {}
+            for k, v in zip(node.args[0].keys, node.args[0].values):
+                k = self._constant(k)
+                v = self._constant(v)
+                if k == None or v == None:
+                    return node
+                atts[k] = v
+            index = ast.Num(n = self.process._meanFieldIndex(atts))
+            node.args = [ast.copy_location(index, node.args[0])]
+        return node
+
+    def _constant(self, node):
+        """
+        The string value of `node`, or None if not constant.
+
+        """
+        if isinstance(node, ast.Str):
+            return node.s
+        if isinstance(node, ast.Name) \
+                and node.id not in self.process.modelParameters \
+                and isinstance(self.process.evalNS.get(node.id), basestring):
+            return self.process.evalNS[node.id]
+        return None
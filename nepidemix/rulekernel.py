@@ -0,0 +1,1302 @@
+"""
+=================
+Node rule kernels
+=================
+
+Whole-population evaluation of scripted node rules.
+
+A `NodeRuleKernel` is compiled from the node rules of a
+`nepidemix.process.ScriptedProcess` and used by the array engines in place of
+calling `nodeUpdateRule` once per node. Nodes are grouped by their interned
+state, each rule expression is evaluated once per group with ``NN(...)``
+yielding an array of neighbour counts for all nodes in the group and
+``MF(...)`` a scalar, and the transitions of a group are drawn from one
+vector of uniform random numbers.
+
+Only active nodes are evaluated. Every iteration the rules of each state are
+probed as for a node without neighbours. If any rule then has a nonzero rate
+all nodes in the state are active, otherwise only the nodes having at least
+one neighbour in a state referred to by ``NN`` in the rules, as any other node
+would get the probed rate. The node sets of each state are updated as nodes
+change state, so that the cost of an iteration follows the number of active
+nodes and transitions rather than the size of the network.
+
+Rules are compiled for the states of the network when the kernel is created
+and for the states their rules lead to, so that only states that can occur are
+interned. The states are evaluated in declaration order, i.e. the order of
+the values declared for the node attributes, whatever ids they were given.
+
+Neighbour counts are read from a table with one row per node and one column
+per node state referred to by ``NN``, holding the number of neighbours of the
+node in that state. The table is built once and afterwards only the rows of
+the neighbours of nodes that changed state are updated, so that the cost of
+``NN`` does not depend on the number of edges. Lookups restricted by edge
+attributes are counted over the edges directly.
+
+Edge rules are compiled into an `EdgeRuleKernel`, holding the state ids of
+all edges in an array. Edges are grouped by state as nodes are, and
+``NE(...)`` yields the number of end nodes (0, 1 or 2) of each edge
+evaluated that match a node state. If a node kernel is given the edge kernel
+through `NodeRuleKernel.edgeKernel`, ``NN(...)`` restricted by edge
+attributes reads the current edge states from it.
+
+A `DynamicNodeRuleKernel` works on a `DynamicNetwork` whose edges are added
+and removed during the run, updating the neighbour table for every edge
+changed.
+
+A kernel compiled for an `ArrayNetwork` holding several replicates of a
+network (see `ArrayNetwork.tile`) updates all replicates at once, with
+``MF(...)`` counted separately in each replicate.
+
+The semantics are those of `ScriptedProcess.nodeUpdateRule`: the rules of a
+state are tried in declaration order, each with the unit time probability
+given by its expression times dt, and the first successful rule is followed.
+
+If `NodeRuleKernel.leap` is set, the states whose rules do not refer to
+``NN`` (such as a flat recovery rate) are not evaluated node by node. All
+nodes in such a state have the same probability of following each rule, so
+the number of nodes following each rule is drawn from one multinomial
+distribution, and the nodes are picked at random among those in the state.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ['NodeRuleKernel', 'DynamicNodeRuleKernel', 'EdgeRuleKernel']
+
+import numpy
+
+from nepidemix.utilities import networkxtra
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+
+class NodeRuleKernel(object):
+    """
+    Vectorized node rules of a scripted process.
+
+    Attributes
+    ----------
+
+    rules : dict
+       Map from source state id to the list of (destination state id, rule
+       code object) pairs of that state, in declaration order.
+
+    meanFieldStates : set
+       Source state ids having a rule that refers to ``MF``.
+
+    flatStates : set
+       Source state ids whose rules do not refer to ``NN``.
+
+    leap : bool
+       If True the transitions of the nodes in the states of `flatStates`
+       are drawn per state rather than per node. Default False.
+
+    edgeKernel : EdgeRuleKernel or None
+       If set, the edge states used by ``NN`` restricted by edge attributes
+       are read from it rather than from the network. Default None.
+
+    nnTable : numpy.ndarray
+       Neighbour state counts, int32 array of shape (number of nodes, number
+       of states referred to by ``NN``). nnTable[i, c] is the number of
+       neighbours of node i in the state counted in column c.
+
+    """
+    def __init__(self, process, network, arrayNetwork, stateIndex):
+        """
+        Compile the node rules.
+
+        Parameters
+        ----------
+
+        process : nepidemix.process.ScriptedProcess
+           The process owning the rules.
+
+        network : networkx.Graph
+           The network. Only used to read edge attributes.
+
+        arrayNetwork : nepidemix.utilities.ArrayNetwork
+           Topology of `network`.
+
+        stateIndex : nepidemix.utilities.StateIndex
+           The node state interning of the engine, holding the states of the
+           nodes of `network`. The destination states of their rules are
+           registered in it.
+
+        """
+        self.process = process
+        self.network = network
+        self.arrayNetwork = arrayNetwork
+        self.stateIndex = stateIndex
+        self._initTopology()
+
+        self.rules = {}
+        self.meanFieldStates = set()
+        self.flatStates = set()
+        self.leap = False
+        self.edgeKernel = None
+        # Source state ids in declaration order, and the number of interned
+        # states whose rules have been compiled.
+        self._order = []
+        self._compiled = 0
+        self._compileStates()
+
+        # The rules are evaluated in a copy of the process name space where NN
+        # gives neighbour counts for all nodes currently evaluated.
+        self.evalNS = dict(process.evalNS)
+        self.evalNS['NN'] = self._NNlookup
+        # With several replicates (see ArrayNetwork.tile) MF gives the mean
+        # field of the replicate of each node.
+        self._replicateSize = len(arrayNetwork) // arrayNetwork.replicates
+        if arrayNetwork.replicates > 1:
+            self.evalNS['MF'] = self._MFlookup
+        else:
+            self.evalNS['MF'] = self._MFvalue
+        # Positions probed, one in each replicate.
+        self._probeIdx = numpy.arange(arrayNetwork.replicates,
+                                      dtype = numpy.int64) \
+                                      * self._replicateSize
+
+        self.nnTable = None
+        # Neighbour table column of each state id, -1 for states not counted.
+        self._colMap = numpy.zeros(0, dtype = numpy.int64)
+        self._members = None
+
+        # Current source states and positions of the evaluated nodes.
+        self._states = None
+        self._idx = None
+        # Neighbour states referred to while probing, otherwise None.
+        self._probeStates = None
+        # Per iteration cache of neighbour counts over matching edges, keyed
+        # by NN arguments, and of replicate mean fields.
+        self._nnCounts = {}
+        self._mfValues = {}
+        # Count vector of a counter store read by MF, see sweep, and the
+        # positions in it of the mean field states.
+        self._mfVector = None
+        self._mfStore = None
+        self._mfPositions = {}
+        # Caches of state and CSR entry masks, and of table columns, matching
+        # NN arguments.
+        self._stateMasks = {}
+        self._edgeMasks = {}
+        self._nnColumns = {}
+        # Edge position of each CSR entry, when reading an edge kernel.
+        self._csrEdges = None
+
+    def attributes(self, sid):
+        """
+        The node attribute dictionary of state `sid`.
+
+        """
+        return dict(self.stateIndex.states[sid])
+
+    def _compileStates(self):
+        """
+        Compile the rules of the states interned since last called, and in
+        turn of the destination states of those rules.
+
+        """
+        stateIndex = self.stateIndex
+        nodeRules = self.process.nodeRules
+        if self._compiled == len(stateIndex):
+            return
+        while self._compiled < len(stateIndex):
+            sid = self._compiled
+            self._compiled += 1
+            srcState = stateIndex.states[sid]
+            rList = nodeRules.get(srcState)
+            if rList is None:
+                continue
+            srcDict = dict(srcState)
+            compiled = []
+            for dSt, rCode in rList:
+                dstDict = srcDict.copy()
+                dstDict.update(dSt)
+                compiled.append((stateIndex.intern(frozenset(dstDict.iteritems())),
+                                 rCode))
+            self.rules[sid] = compiled
+            if any(['MF' in rCode.co_names for dSt, rCode in rList]):
+                self.meanFieldStates.add(sid)
+            if all(['NN' not in rCode.co_names for dSt, rCode in rList]):
+                self.flatStates.add(sid)
+        self._order = sorted(self.rules, key = self._declarationKey)
+
+    def _declarationKey(self, sid):
+        """
+        Sort key placing source states in the order of the product of the
+        declared attribute values, attributes sorted by name.
+
+        """
+        atts = dict(self.stateIndex.states[sid])
+        attDict = self.process.nodeAttributeDict
+        return tuple([list(attDict[n]).index(atts[n])
+                      for n in sorted(attDict.keys())])
+
+    def _initTopology(self):
+        """
+        Index the CSR adjacency of the network.
+
+        """
+        # Array position of the node owning each CSR entry.
+        self._rows = numpy.repeat(numpy.arange(len(self.arrayNetwork),
+                                               dtype=numpy.int32),
+                                  self.arrayNetwork.degree())
+        # Nodes having each node as neighbour, to update the table.
+        self._rindptr, self._rindices = self.arrayNetwork.reverseAdjacency()
+
+    def update(self, srcStates, dstStates, meanField, dt):
+        """
+        Execute the rules for all nodes.
+
+        Parameters
+        ----------
+
+        srcStates : numpy.ndarray
+           Node state ids of the previous iteration. Not changed.
+
+        dstStates : numpy.ndarray
+           Node state ids of this iteration. On entry equal to `srcStates`,
+           on return set to the new state of all nodes that changed.
+
+        meanField : dict
+           The state counts of the previous iteration. Not used with several
+           replicates, where the mean field is counted per replicate.
+
+        dt : float
+           Time step.
+
+        Returns
+        -------
+
+        changed : numpy.ndarray
+           Sorted array positions of the nodes that changed state.
+
+        """
+        changed = []
+        random = self.process.random
+        for sid, idx in self.activeNodes(srcStates, meanField):
+            rList = self.rules[sid]
+            if self.leap and sid in self.flatStates:
+                for hidx, dstId in self._leap(sid, rList, idx, dt, random):
+                    dstStates[hidx] = dstId
+                    changed.append(hidx)
+                continue
+            self._idx = idx
+            u = random.random_sample(len(idx))
+            prob = numpy.zeros(len(idx))
+            undecided = numpy.ones(len(idx), dtype = bool)
+            for dstId, rCode in rList:
+                prob += self._evaluate(rCode) * dt
+                hit = undecided & (u < prob)
+                undecided &= ~hit
+                if dstId != sid and hit.any():
+                    hidx = idx[hit]
+                    dstStates[hidx] = dstId
+                    changed.append(hidx)
+        self._idx = None
+        if len(changed) == 0:
+            return numpy.zeros(0, dtype = numpy.int64)
+        changed = numpy.concatenate(changed)
+        changed.sort()
+        oldIds = srcStates[changed]
+        newIds = dstStates[changed]
+        nbrs = self._updateTable(changed, oldIds, newIds)
+        self._updateActiveSets(changed, oldIds, newIds, nbrs, dstStates)
+        return changed
+
+    def activeNodes(self, states, meanField):
+        """
+        The nodes whose rules are to be evaluated, grouped by state.
+
+        These are all nodes of the states whose rules have a nonzero rate
+        without neighbours, or whose transitions are leaped, and otherwise
+        the nodes having a neighbour in a state referred to by the rules.
+
+        Parameters
+        ----------
+
+        states : numpy.ndarray
+           Current node state ids.
+
+        meanField : dict
+           The current state counts.
+
+        Returns
+        -------
+
+        active : list
+           List of (state id, sorted array positions) in declaration order,
+           for the states having active nodes.
+
+        """
+        self._setMeanField(meanField)
+        self._states = states
+        self._nnCounts = {}
+        self._mfValues = {}
+        if self._compiled < len(self.stateIndex):
+            # States set outside of the rules.
+            self._compileStates()
+            self._members = None
+        if self.nnTable is None:
+            self._buildTable(states)
+        if self._members is None:
+            self._buildActiveSets(states)
+        active = []
+        for sid in self._order:
+            idx = self._members[sid]
+            if len(idx) == 0:
+                continue
+            if not (self.leap and sid in self.flatStates) \
+                    and not self._probe(sid, self.rules[sid]):
+                idx = self._hot[sid]
+                if len(idx) == 0:
+                    continue
+            idx = numpy.fromiter(idx, dtype = numpy.int64, count = len(idx))
+            idx.sort()
+            active.append((sid, idx))
+        return active
+
+    def sweep(self, states, active, meanField, dt, random):
+        """
+        Execute the rules for the nodes `active` without changing any state.
+
+        Unlike `update` the neighbour table and the active node sets are
+        only read, so disjoint sets of nodes may be swept concurrently by
+        processes sharing `states` and `nnTable`, provided the table is kept
+        up to date with `moveNodes`.
+
+        Parameters
+        ----------
+
+        states : numpy.ndarray
+           Node state ids of the previous iteration.
+
+        active : list
+           List of (state id, sorted array positions) of the nodes to
+           evaluate, as given by `activeNodes`.
+
+        meanField : dict or numpy.ndarray
+           The state counts of the previous iteration, or their count vector
+           in the counter store bound by `bindCounterStore` (see
+           `nepidemix.utilities.CounterStore.positions`).
+
+        dt : float
+           Time step.
+
+        random : numpy.random.RandomState
+           Random number generator used for the transitions.
+
+        Returns
+        -------
+
+        changed : numpy.ndarray
+           Sorted positions of the nodes that changed state.
+
+        newIds : numpy.ndarray
+           The new state ids of the changed nodes.
+
+        """
+        self._setMeanField(meanField)
+        self._states = states
+        self._nnCounts = {}
+        self._mfValues = {}
+        if self.nnTable is None:
+            self._buildTable(states)
+        changed = []
+        newIds = []
+        for sid, idx in active:
+            rList = self.rules[sid]
+            if len(idx) == 0:
+                continue
+            if self.leap and sid in self.flatStates:
+                for hidx, dstId in self._leap(sid, rList, idx, dt, random):
+                    changed.append(hidx)
+                    newIds.append(numpy.repeat(numpy.int32(dstId), len(hidx)))
+                continue
+            self._idx = idx
+            u = random.random_sample(len(idx))
+            prob = numpy.zeros(len(idx))
+            undecided = numpy.ones(len(idx), dtype = bool)
+            for dstId, rCode in rList:
+                prob += self._evaluate(rCode) * dt
+                hit = undecided & (u < prob)
+                undecided &= ~hit
+                if dstId != sid and hit.any():
+                    changed.append(idx[hit])
+                    newIds.append(numpy.repeat(numpy.int32(dstId), hit.sum()))
+        self._idx = None
+        if len(changed) == 0:
+            return (numpy.zeros(0, dtype = numpy.int64),
+                    numpy.zeros(0, dtype = numpy.int32))
+        changed = numpy.concatenate(changed)
+        newIds = numpy.concatenate(newIds)
+        order = numpy.argsort(changed)
+        return changed[order], newIds[order]
+
+    def rates(self, states, sid, idx, meanField):
+        """
+        Rates of the rules of state `sid` for a set of nodes.
+
+        Used by the continuous time engines. A rule leading back to `sid`
+        is given rate zero.
+
+        Parameters
+        ----------
+
+        states : numpy.ndarray
+           Current node state ids.
+
+        sid : int
+           State of the nodes.
+
+        idx : numpy.ndarray
+           Positions of the nodes, all in state `sid`.
+
+        meanField : dict
+           The current state counts.
+
+        Returns
+        -------
+
+        rates : numpy.ndarray
+           Array of shape (number of rules of `sid`, len(idx)), in rule
+           declaration order. Negative rates are set to zero.
+
+        """
+        self._setMeanField(meanField)
+        self._states = states
+        self._nnCounts = {}
+        self._mfValues = {}
+        if self.nnTable is None:
+            self._buildTable(states)
+        rList = self.rules[sid]
+        rates = numpy.zeros((len(rList), len(idx)))
+        self._idx = idx
+        for r, (dstId, rCode) in enumerate(rList):
+            if dstId != sid:
+                rates[r] = self._evaluate(rCode)
+        self._idx = None
+        return numpy.maximum(rates, 0.0)
+
+    def moveNodes(self, changed, oldIds, newIds, states = None):
+        """
+        Update the neighbour counts for nodes that changed state outside of
+        `update`.
+
+        Parameters
+        ----------
+
+        changed : numpy.ndarray
+           Positions of the nodes.
+
+        oldIds : numpy.ndarray
+           Previous state ids of the nodes.
+
+        newIds : numpy.ndarray
+           New state ids of the nodes.
+
+        states : numpy.ndarray, optional
+           Node state ids, with the changed nodes in their new states. If
+           given the active node sets (see `activeNodes`) are updated too.
+
+        Returns
+        -------
+
+        nbrs : numpy.ndarray
+           Positions of the nodes having a changed node as neighbour.
+
+        """
+        nbrs = self._updateTable(changed, oldIds, newIds)
+        if states is not None and self._members is not None:
+            self._updateActiveSets(changed, oldIds, newIds, nbrs, states)
+        return nbrs
+
+    def bindCounterStore(self, store):
+        """
+        Resolve the positions of the mean field states of the rules in the
+        count vector of a counter store, so that ``MF(...)`` can read the
+        vector passed to `sweep`.
+
+        Parameters
+        ----------
+
+        store : nepidemix.utilities.CounterStore
+           The store of the state counts.
+
+        """
+        keys = self.process.meanFieldKeys
+        self._mfStore = store
+        self._mfPositions = dict(zip(range(len(keys)),
+                                     store.positions(keys).tolist()))
+
+    def _setMeanField(self, meanField):
+        """
+        Set the state counts read by ``MF(...)``: a count vector of the bound
+        counter store, or a dictionary read by the process.
+
+        """
+        if isinstance(meanField, numpy.ndarray):
+            self._mfVector = meanField
+            self.process._currentMeanField = None
+        else:
+            self._mfVector = None
+            self.process._currentMeanField = meanField
+
+    def _probe(self, sid, rList):
+        """
+        Evaluate the rules of state `sid` as for a node without neighbours.
+
+        Neighbour states referred to by the rules are added to the active set
+        bookkeeping of the state.
+
+        Returns
+        -------
+
+        active : bool
+           True if any rule has a nonzero rate without neighbours, in which
+           case all nodes in the state must be evaluated.
+
+        """
+        self._idx = self._probeIdx
+        self._probeStates = set()
+        active = False
+        with numpy.errstate(all = 'ignore'):
+            for dstId, rCode in rList:
+                if dstId != sid and numpy.any(self._evaluate(rCode) != 0):
+                    active = True
+        probeStates = sorted(self._probeStates)
+        self._probeStates = None
+        self._addColumns(probeStates, self._states)
+        probeCols = set(self._colMap[probeStates].tolist())
+        if not probeCols.issubset(self._refCols[sid]):
+            self._refCols[sid] = numpy.array(sorted(probeCols.union(
+                        self._refCols[sid])), dtype = numpy.int64)
+            members = numpy.fromiter(self._members[sid], dtype = numpy.int64,
+                                     count = len(self._members[sid]))
+            self._hot[sid] = set(self._hotNodes(sid, members).tolist())
+        return active
+
+    def _leap(self, sid, rList, positions, dt, random):
+        """
+        Draw the transitions of the nodes at `positions`, all in state `sid`
+        whose rules do not refer to ``NN``.
+
+        In each replicate the probability of following a rule is that of
+        `update`, i.e. the probability that a uniform random number falls
+        between the accumulated probabilities of the preceding rules and of
+        the rule. The number of nodes following each rule is drawn from a
+        multinomial distribution, and the nodes are picked at random.
+
+        Returns
+        -------
+
+        transitions : list
+           List of (positions, destination state id) of the nodes changing
+           state.
+
+        """
+        numReps = len(self._probeIdx)
+        # The rules evaluate to the same value for all nodes of a replicate.
+        self._idx = self._probeIdx
+        prob = numpy.zeros(numReps)
+        reached = numpy.zeros(numReps)
+        pvals = []
+        for dstId, rCode in rList:
+            prob = prob + self._evaluate(rCode) * dt
+            top = numpy.clip(numpy.maximum(reached, prob), 0.0, 1.0)
+            pvals.append(top - reached)
+            reached = top
+        self._idx = None
+        pvals = numpy.array(pvals + [1.0 - reached]).T
+        bounds = numpy.searchsorted(positions, numpy.arange(numReps + 1)
+                                    * self._replicateSize)
+        transitions = []
+        for r in xrange(numReps):
+            members = positions[bounds[r]:bounds[r+1]]
+            if len(members) == 0:
+                continue
+            counts = random.multinomial(len(members), pvals[r])[:-1]
+            total = counts.sum()
+            if total == 0:
+                continue
+            chosen = members[_sampleIndices(random, len(members), total)]
+            start = 0
+            for (dstId, rCode), c in zip(rList, counts.tolist()):
+                if dstId != sid and c > 0:
+                    transitions.append((chosen[start:start+c], dstId))
+                start += c
+        return transitions
+
+    def _hotNodes(self, sid, positions):
+        """
+        The nodes among `positions` (all in state `sid`) having at least one
+        neighbour in a state referred to by the rules of `sid`.
+
+        """
+        cols = self._refCols[sid]
+        if len(cols) == 0 or len(positions) == 0:
+            return positions[:0]
+        return positions[self.nnTable[positions[:, numpy.newaxis], cols]\
+                             .sum(axis = 1) > 0]
+
+    def _buildActiveSets(self, states):
+        """
+        Initialize the node sets of all source states.
+
+        """
+        self._members = {}
+        self._hot = {}
+        self._refCols = {}
+        for sid in self.rules:
+            self._members[sid] = set(numpy.flatnonzero(states == sid).tolist())
+            self._hot[sid] = set()
+            self._refCols[sid] = numpy.zeros(0, dtype = numpy.int64)
+
+    def _updateActiveSets(self, changed, oldIds, newIds, nbrs, states):
+        """
+        Move changed nodes between the state sets and re-examine the nodes
+        whose neighbour counts changed.
+
+        """
+        for i, o, n in zip(changed.tolist(), oldIds.tolist(), newIds.tolist()):
+            if o in self._members:
+                self._members[o].discard(i)
+                self._hot[o].discard(i)
+            if n in self._members:
+                self._members[n].add(i)
+        affected = numpy.union1d(changed, nbrs)
+        affectedStates = states[affected]
+        for sid in self.rules:
+            positions = affected[affectedStates == sid]
+            if len(positions) == 0:
+                continue
+            hot = self._hotNodes(sid, positions)
+            self._hot[sid].difference_update(positions.tolist())
+            self._hot[sid].update(hot.tolist())
+
+    def _buildTable(self, states):
+        """
+        Count the neighbour states referred to by the rules, of all nodes.
+
+        The rules of all states are probed for the states they pass to
+        ``NN``, so that the table usually does not change once built.
+
+        """
+        self.nnTable = numpy.zeros((len(states), 0), dtype = numpy.int32)
+        self._colMap = numpy.zeros(0, dtype = numpy.int64)
+        self._nnColumns = {}
+        self._states = states
+        self._idx = self._probeIdx
+        self._probeStates = set()
+        with numpy.errstate(all = 'ignore'):
+            for sid in self._order:
+                for dstId, rCode in self.rules[sid]:
+                    self._evaluate(rCode)
+        probeStates = sorted(self._probeStates)
+        self._probeStates = None
+        self._idx = None
+        self._addColumns(probeStates, states)
+
+    def _addColumns(self, sids, states):
+        """
+        Add neighbour table columns counting the states `sids` not yet
+        counted.
+
+        """
+        self._growColumnMap()
+        sids = [sid for sid in sids if self._colMap[sid] < 0]
+        if len(sids) == 0:
+            return
+        ns = len(sids)
+        lookup = numpy.empty(len(self.stateIndex), dtype = numpy.int64)
+        lookup.fill(-1)
+        lookup[sids] = numpy.arange(ns)
+        owners, nbrs = self._adjacency()
+        cols = lookup[states[nbrs]]
+        keep = cols >= 0
+        flat = owners[keep].astype(numpy.int64) * ns + cols[keep]
+        counts = numpy.bincount(flat, minlength = len(states) * ns)\
+            .astype(numpy.int32).reshape((len(states), ns))
+        self._colMap[sids] = numpy.arange(self.nnTable.shape[1],
+                                          self.nnTable.shape[1] + ns)
+        self.nnTable = numpy.hstack([self.nnTable, counts])
+
+    def _adjacency(self):
+        """
+        The (neighbour owner, neighbour) positions of all adjacency entries.
+
+        """
+        return self._rows, self.arrayNetwork.indices
+
+    def _updateTable(self, changed, oldIds, newIds):
+        """
+        Move the nodes at positions `changed` from state `oldIds` to
+        `newIds` in the neighbour counts of the nodes having them as
+        neighbours.
+
+        Returns
+        -------
+
+        nbrs : numpy.ndarray
+           Positions of the nodes whose counts were updated.
+
+        """
+        self._growColumnMap()
+        # Gather (neighbour, old state, new state) for every affected entry.
+        start = self._rindptr[changed]
+        deg = self._rindptr[changed + 1] - start
+        total = deg.sum()
+        if total == 0:
+            return self._rindices[:0]
+        offset = numpy.repeat(start - numpy.cumsum(deg) + deg, deg) \
+            + numpy.arange(total)
+        nbrs = self._rindices[offset]
+        self._addCounts(nbrs, numpy.repeat(oldIds, deg), -1)
+        self._addCounts(nbrs, numpy.repeat(newIds, deg), 1)
+        return nbrs
+
+    def _addCounts(self, positions, sids, step):
+        """
+        Add `step` to the counts of states `sids` of the nodes at
+        `positions`, for the states counted in the table.
+
+        """
+        cols = self._colMap[sids]
+        keep = cols >= 0
+        numpy.add.at(self.nnTable, (positions[keep], cols[keep]), step)
+
+    def _growColumnMap(self):
+        """
+        Extend the column map to states registered since it was built.
+
+        """
+        ns = len(self.stateIndex)
+        if ns > len(self._colMap):
+            grown = numpy.empty(ns, dtype = numpy.int64)
+            grown.fill(-1)
+            grown[:len(self._colMap)] = self._colMap
+            self._colMap = grown
+
+    def _evaluate(self, rCode):
+        """
+        Evaluate a rule for all nodes at the current positions, see
+        `_evaluate`.
+
+        """
+        return _evaluate(self, rCode)
+
+    def _NNlookup(self, nodeAtts, givenEdgeAtts = None):
+        """
+        Vectorized version of `ScriptedProcess._NNlookup`.
+
+        Returns
+        -------
+
+        nnodes : numpy.ndarray
+           Number of nearest neighbours matching `nodeAtts` (over edges
+           matching `givenEdgeAtts`) of each node being evaluated.
+
+        """
+        nkey = frozenset(nodeAtts.iteritems())
+        if self._probeStates is not None:
+            # Probing, see _probe.
+            self._probeStates.update(numpy.flatnonzero(
+                    self._stateMask(nkey, nodeAtts)).tolist())
+            return numpy.zeros(len(self._idx), dtype = numpy.int32)
+        if givenEdgeAtts == None:
+            cols = self._columns(nkey, nodeAtts)
+            if len(cols) == 1:
+                return self.nnTable[self._idx, cols[0]]
+            return self.nnTable[self._idx[:, numpy.newaxis], cols].sum(axis = 1)
+        ekey = frozenset(givenEdgeAtts.iteritems())
+        cnt = self._nnCounts.get((nkey, ekey))
+        if cnt is None:
+            cnt = self._edgeCounts(nkey, nodeAtts, ekey, givenEdgeAtts)
+            self._nnCounts[(nkey, ekey)] = cnt
+        return cnt[self._idx]
+
+    def _columns(self, key, nodeAtts):
+        """
+        Neighbour table columns of the states matching `nodeAtts`, adding
+        columns for states not yet counted.
+
+        """
+        entry = self._nnColumns.get(key)
+        if entry is not None and entry[0] == len(self.stateIndex):
+            return entry[1]
+        sids = numpy.flatnonzero(self._stateMask(key, nodeAtts))
+        self._addColumns(sids.tolist(), self._states)
+        cols = self._colMap[sids]
+        self._nnColumns[key] = (len(self.stateIndex), cols)
+        return cols
+
+    def _edgeCounts(self, nkey, nodeAtts, ekey, edgeAtts):
+        """
+        Number of neighbours matching `nodeAtts` over edges matching
+        `edgeAtts`, of every node.
+
+        """
+        match = self._stateMask(nkey, nodeAtts)\
+            [self._states[self.arrayNetwork.indices]]
+        match &= self._edgeMask(ekey, edgeAtts)
+        return numpy.bincount(self._rows[match],
+                              minlength = len(self.arrayNetwork))
+
+    def _MFvalue(self, atts):
+        """
+        Version of `ScriptedProcess._MFlookup` reading the count vector
+        passed to `sweep`, if any.
+
+        Returns
+        -------
+
+        meanField : float
+           Fraction of nodes matching `atts`.
+
+        """
+        if self._mfVector is None:
+            return self.process._MFlookup(atts)
+        if type(atts) is not int:
+            atts = frozenset(atts.iteritems())
+        pos = self._mfPositions.get(atts)
+        if pos is None:
+            pos = self._mfStore.positions([atts])[0]
+            self._mfPositions[atts] = pos
+        if pos < 0:
+            raise KeyError(atts)
+        return self._mfVector[pos] / self.process._currentNetworkSize
+
+    def _MFlookup(self, atts):
+        """
+        Replicate version of `ScriptedProcess._MFlookup`.
+
+        Returns
+        -------
+
+        meanField : numpy.ndarray
+           Fraction of nodes matching `atts` in the replicate of each node
+           being evaluated.
+
+        """
+        if type(atts) is int:
+            key = self.process.meanFieldKeys[atts]
+        else:
+            key = frozenset(atts.iteritems())
+        frac = self._mfValues.get(key)
+        if frac is None:
+            match = numpy.flatnonzero(self._stateMask(key, dict(key))\
+                                          [self._states])
+            frac = numpy.bincount(match // self._replicateSize,
+                                  minlength = self.arrayNetwork.replicates)\
+                                  / float(self._replicateSize)
+            self._mfValues[key] = frac
+        return frac[self._idx // self._replicateSize]
+
+    def _stateMask(self, key, nodeAtts):
+        """
+        Boolean array over state ids, True for states matching `nodeAtts`.
+
+        """
+        return _stateMask(self._stateMasks, self.stateIndex, key, nodeAtts)
+
+    def _edgeMask(self, key, edgeAtts):
+        """
+        Boolean array over CSR entries, True for edges matching `edgeAtts`.
+
+        """
+        if self.edgeKernel != None:
+            # Edge states change, the mask is not cached.
+            if self._csrEdges is None:
+                self._csrEdges = self.edgeKernel.csrEdges(self.arrayNetwork)
+            return self.edgeKernel.stateMask(key, edgeAtts)\
+                [self.edgeKernel.states[self._csrEdges]]
+        mask = self._edgeMasks.get(key)
+        if mask is None:
+            nodes = self.arrayNetwork.nodes
+            adj = self.network.adj
+            mask = numpy.array([networkxtra.matchDictAttributes(
+                        adj[nodes[i]][nodes[j]], edgeAtts)
+                                for i, j in zip(self._rows,
+                                                self.arrayNetwork.indices)],
+                               dtype = bool)
+            self._edgeMasks[key] = mask
+        return mask
+
+
+class DynamicNodeRuleKernel(NodeRuleKernel):
+    """
+    Node rule kernel for a network whose edges change during the run.
+
+    The topology is a `nepidemix.utilities.DynamicNetwork`. The neighbour
+    table and the active node sets are updated with `moveEdges` as edges are
+    added and removed, so that the cost of a topology change follows the
+    number of edges changed rather than the size of the network.
+
+    """
+    def moveEdges(self, added, removed, states):
+        """
+        Update the neighbour counts for edges added to and removed from the
+        network.
+
+        Parameters
+        ----------
+
+        added : numpy.ndarray
+           Array of shape (number of edges, 2) with the positions of the end
+           nodes of the edges added, as given by `DynamicNetwork.apply`.
+
+        removed : numpy.ndarray
+           As `added`, for the edges removed.
+
+        states : numpy.ndarray
+           Current node state ids.
+
+        """
+        if self.nnTable is None:
+            # Built from the current topology when first needed.
+            return
+        self._growColumnMap()
+        ends = []
+        for pairs, step in [(added, 1), (removed, -1)]:
+            if len(pairs) == 0:
+                continue
+            src = pairs[:, 0]
+            dst = pairs[:, 1]
+            self._addCounts(src, states[dst], step)
+            if not self.arrayNetwork.directed:
+                loop = src == dst
+                self._addCounts(dst[~loop], states[src[~loop]], step)
+            ends.extend([src, dst])
+        if len(ends) > 0:
+            empty = numpy.zeros(0, dtype = numpy.int64)
+            self._updateActiveSets(empty, empty, empty,
+                                   numpy.unique(numpy.concatenate(ends)),
+                                   states)
+
+    def _initTopology(self):
+        """
+        Nothing to index, the dynamic network is read directly.
+
+        """
+        pass
+
+    def _adjacency(self):
+        """
+        The (neighbour owner, neighbour) positions of all adjacency entries,
+        read from the dynamic network.
+
+        """
+        return self._edges()
+
+    def _updateTable(self, changed, oldIds, newIds):
+        """
+        Move the nodes at positions `changed` from state `oldIds` to
+        `newIds` in the neighbour counts of their predecessors.
+
+        Returns
+        -------
+
+        nbrs : numpy.ndarray
+           Positions of the nodes whose counts were updated.
+
+        """
+        self._growColumnMap()
+        preds = [self.arrayNetwork.predecessors(i) for i in changed.tolist()]
+        deg = numpy.array([len(p) for p in preds], dtype = numpy.int64)
+        if deg.sum() == 0:
+            return numpy.zeros(0, dtype = numpy.int64)
+        nbrs = numpy.concatenate(preds)
+        self._addCounts(nbrs, numpy.repeat(oldIds, deg), -1)
+        self._addCounts(nbrs, numpy.repeat(newIds, deg), 1)
+        return nbrs
+
+    def _edgeCounts(self, nkey, nodeAtts, ekey, edgeAtts):
+        """
+        Number of neighbours matching `nodeAtts` over edges matching
+        `edgeAtts`, of every node.
+
+        The edge attributes are read from the network for every edge present.
+
+        """
+        src, dst = self._edges()
+        nodes = self.arrayNetwork.nodes
+        adj = self.network.adj
+        match = self._stateMask(nkey, nodeAtts)[self._states[dst]]
+        match &= numpy.array([networkxtra.matchDictAttributes(
+                    adj[nodes[i]][nodes[j]], edgeAtts)
+                              for i, j in zip(src.tolist(), dst.tolist())],
+                             dtype = bool)
+        return numpy.bincount(src[match], minlength = len(self.arrayNetwork))
+
+    def _edges(self):
+        """
+        The (neighbour owner, neighbour) positions of all adjacency entries,
+        both directions of every undirected edge.
+
+        """
+        network = self.arrayNetwork
+        slots = network.edgeSlots()
+        src = network.source[slots]
+        dst = network.target[slots]
+        if not network.directed:
+            loop = src == dst
+            src, dst = (numpy.concatenate([src, dst[~loop]]),
+                        numpy.concatenate([dst, src[~loop]]))
+        return src, dst
+
+class EdgeRuleKernel(object):
+    """
+    Vectorized edge rules of a scripted process.
+
+    Edges are numbered in the order given by ``network.edges()``, each
+    undirected edge once.
+
+    Attributes
+    ----------
+
+    rules : dict
+       Map from source edge state id to the list of (destination state id,
+       rule code object) pairs of that state, in declaration order.
+
+    edges : list
+       The (node, node) pairs of the edges, in edge order.
+
+    source, target : numpy.ndarray
+       Array positions (in the `ArrayNetwork`) of the end nodes of each edge.
+
+    states : numpy.ndarray
+       Current state id of each edge.
+
+    """
+    def __init__(self, process, network, arrayNetwork, stateIndex):
+        """
+        Compile the edge rules.
+
+        Parameters
+        ----------
+
+        process : nepidemix.process.ScriptedProcess
+           The process owning the rules.
+
+        network : networkx.Graph
+           The network, giving the edges and their initial states.
+
+        arrayNetwork : nepidemix.utilities.ArrayNetwork
+           Topology of `network`, giving the node positions.
+
+        stateIndex : nepidemix.utilities.StateIndex
+           The interning of the edge states, separate from that of the node
+           states.
+
+        """
+        self.process = process
+        self.stateIndex = stateIndex
+        self.edges = network.edges()
+        nodeIndex = arrayNetwork.nodeIndex
+        self.source = numpy.array([nodeIndex[u] for u, v in self.edges],
+                                  dtype = numpy.int64)
+        self.target = numpy.array([nodeIndex[v] for u, v in self.edges],
+                                  dtype = numpy.int64)
+        adj = network.adj
+        self.states = numpy.array([stateIndex.intern(
+                    process.deduceEdgeState((u, v, adj[u][v])))
+                                   for u, v in self.edges], dtype = numpy.int32)
+
+        self.rules = {}
+        for srcState, rList in process.edgeRules.iteritems():
+            srcDict = dict(srcState)
+            compiled = []
+            for dSt, rCode in rList:
+                dstDict = srcDict.copy()
+                dstDict.update(dSt)
+                compiled.append((stateIndex.intern(frozenset(dstDict.iteritems())),
+                                 rCode))
+            self.rules[stateIndex.intern(srcState)] = compiled
+
+        # The rules are evaluated in a copy of the process name space where NE
+        # gives end node counts for all edges currently evaluated.
+        self.evalNS = dict(process.evalNS)
+        self.evalNS['NE'] = self._NElookup
+        self._nodeStates = None
+        self._idx = None
+        self._stateMasks = {}
+        self._nodeMasks = {}
+
+    def attributes(self, sid):
+        """
+        The edge attribute dictionary of state `sid`.
+
+        """
+        return dict(self.stateIndex.states[sid])
+
+    def update(self, nodeStates, meanField, dt):
+        """
+        Execute the rules for all edges, and set their new states.
+
+        Parameters
+        ----------
+
+        nodeStates : numpy.ndarray
+           Node state ids of the previous iteration.
+
+        meanField : dict
+           The state counts of the previous iteration.
+
+        dt : float
+           Time step.
+
+        Returns
+        -------
+
+        changed : numpy.ndarray
+           Sorted positions of the edges that changed state.
+
+        oldIds : numpy.ndarray
+           The previous state ids of the changed edges.
+
+        """
+        self.process._currentMeanField = meanField
+        self._nodeStates = nodeStates
+        random = self.process.random
+        changed = []
+        newIds = []
+        for sid, rList in self.rules.iteritems():
+            idx = numpy.flatnonzero(self.states == sid)
+            if len(idx) == 0:
+                continue
+            self._idx = idx
+            u = random.random_sample(len(idx))
+            prob = numpy.zeros(len(idx))
+            undecided = numpy.ones(len(idx), dtype = bool)
+            for dstId, rCode in rList:
+                prob += self._evaluate(rCode) * dt
+                hit = undecided & (u < prob)
+                undecided &= ~hit
+                if dstId != sid and hit.any():
+                    changed.append(idx[hit])
+                    newIds.append(numpy.repeat(numpy.int32(dstId), hit.sum()))
+        self._idx = None
+        self._nodeStates = None
+        if len(changed) == 0:
+            return (numpy.zeros(0, dtype = numpy.int64),
+                    numpy.zeros(0, dtype = numpy.int32))
+        changed = numpy.concatenate(changed)
+        newIds = numpy.concatenate(newIds)
+        order = numpy.argsort(changed)
+        changed = changed[order]
+        oldIds = self.states[changed]
+        self.states[changed] = newIds[order]
+        return changed, oldIds
+
+    def stateMask(self, key, atts):
+        """
+        Boolean array over edge state ids, True for states matching `atts`.
+
+        """
+        return _stateMask(self._stateMasks, self.stateIndex, key, atts)
+
+    def csrEdges(self, arrayNetwork):
+        """
+        The edge position of every CSR entry of `arrayNetwork`.
+
+        """
+        n = len(arrayNetwork)
+        if arrayNetwork.directed:
+            keys = self.source * n + self.target
+            positions = numpy.arange(len(self.edges))
+        else:
+            keys = numpy.concatenate([self.source * n + self.target,
+                                      self.target * n + self.source])
+            positions = numpy.tile(numpy.arange(len(self.edges)), 2)
+        order = numpy.argsort(keys, kind = 'mergesort')
+        rows = numpy.repeat(numpy.arange(n, dtype = numpy.int64),
+                            arrayNetwork.degree())
+        entries = rows * n + arrayNetwork.indices
+        return positions[order[numpy.searchsorted(keys[order], entries)]]
+
+    def _evaluate(self, rCode):
+        """
+        Evaluate a rule for all edges at the current positions, see
+        `_evaluate`.
+
+        """
+        return _evaluate(self, rCode)
+
+    def _NElookup(self, nodeAtts):
+        """
+        Vectorized version of `ScriptedProcess._NElookup`.
+
+        Returns
+        -------
+
+        nnodes : numpy.ndarray
+           Number of end nodes matching `nodeAtts` of each edge being
+           evaluated.
+
+        """
+        mask = _stateMask(self._nodeMasks, self.process.stateIndex,
+                          frozenset(nodeAtts.iteritems()), nodeAtts)
+        states = self._nodeStates
+        return mask[states[self.source[self._idx]]].astype(numpy.int32) \
+            + mask[states[self.target[self._idx]]]
+
+
+def _evaluate(kernel, rCode):
+    """
+    Evaluate a rule in the name space of `kernel` for all the nodes or edges
+    at its current positions ``kernel._idx``.
+
+    Expressions that can not be applied to arrays (such as calls to math
+    functions of NN) are evaluated position by position.
+
+    """
+    try:
+        return eval(rCode, kernel.evalNS)
+    except (TypeError, ValueError):
+        idx = kernel._idx
+        val = numpy.empty(len(idx))
+        for j in xrange(len(idx)):
+            kernel._idx = idx[j:j+1]
+            val[j] = eval(rCode, kernel.evalNS)
+        kernel._idx = idx
+        return val
+
+def _stateMask(cache, stateIndex, key, atts):
+    """
+    Boolean array over the state ids of `stateIndex`, True for states
+    matching `atts`, cached in `cache` under `key`.
+
+    """
+    mask = cache.get(key)
+    if mask is None or len(mask) < len(stateIndex):
+        mask = numpy.array([networkxtra.matchDictAttributes(dict(st), atts)
+                            for st in stateIndex.states], dtype = bool)
+        cache[key] = mask
+    return mask
+
+def _sampleIndices(random, n, k):
+    """
+    `k` distinct random integers in [0, n), in random order.
+
+    For small `k` integers are drawn with replacement and repeated ones are
+    discarded, which is sampling without replacement, instead of permuting
+    all `n`.
+
+    """
+    if 4 * k > n:
+        return random.permutation(n)[:k]
+    idx = numpy.zeros(0, dtype = numpy.int64)
+    while len(idx) < k:
+        drawn = numpy.concatenate([idx, random.randint(n,
+                                                       size = 2 * (k - len(idx))
+                                                       + 16)])
+        first = numpy.unique(drawn, return_index = True)[1]
+        idx = drawn[numpy.sort(first)]
+    return idx[:k]
@@ -18,6 +18,7 @@ __license__ = "Modified BSD License"
 __all__  = ['Simulation']
 
 import numpy
+import random
 import sys
 import imp
 import csv
@@ -25,6 +26,7 @@ import time
 import networkx
 import copy
 import os
+import multiprocessing
 from collections import OrderedDict
 import pickle
 
@@ -32,11 +34,27 @@ import pickle
 
 from nepidemix import process
 
+from nepidemix import engines
 
 from nepidemix.exceptions import NepidemiXBaseException
 
 from nepidemix.utilities import NepidemiXConfigParser
 
+from nepidemix.utilities import StateCountRecorder, StateCountStream
+
+from nepidemix.utilities import DeltaSnapshotWriter
+
+from nepidemix.utilities import CounterStore
+
+from nepidemix.utilities import RandomStreams
+
+from nepidemix.utilities import StateIndex
+
+from nepidemix.utilities import CheckpointWriter, loadCheckpoint
+from nepidemix.utilities import packAttributes, unpackAttributes
+
+from nepidemix.utilities.networkxtra import attributesChanged
+
 from nepidemix.version import full_version
 
 from nepidemix.utilities.dbio import sqlite3io
@@ -242,6 +260,89 @@ class Simulation(object):
     |                       | configuration files into logical sections      |
     |                       | and store them in individual files.            |
     +-----------------------+------------------------------------------------+
+    | engine                | Optional (default value networkx). The         |
+    |                       | implementation of the main loop. ``networkx``  |
+    |                       | copies the network every iteration. ``array``  |
+    |                       | keeps node states as integers in arrays and    |
+    |                       | only writes changed nodes back to the network. |
+    |                       | ``gillespie`` simulates scripted node rules in |
+    |                       | continuous time, with dt only setting the      |
+    |                       | sampling grid. ``ensemble`` runs all           |
+    |                       | replicates (see below) in one pass.            |
+    |                       | ``parallel`` sweeps blocks of nodes on several |
+    |                       | worker processes (see below). ``dynamic`` is   |
+    |                       | the array engine for processes changing the    |
+    |                       | topology, applying the edges added and removed |
+    |                       | by the network rule in place. Engines other    |
+    |                       | than networkx and dynamic require a process    |
+    |                       | with constant topology, otherwise networkx is  |
+    |                       | used.                                          |
+    |                       | See ``nepidemix.engines``.                     |
+    +-----------------------+------------------------------------------------+
+    | replicates            | Optional (default value 1). Number of          |
+    |                       | replicates run by the ensemble engine, sharing |
+    |                       | the network topology. The node states of every |
+    |                       | replicate are initialized as those of the      |
+    |                       | network, drawing from a random stream of the   |
+    |                       | replicate. With node_init or network_init off  |
+    |                       | all replicates start from the node states of   |
+    |                       | the network. The ordinary output describes     |
+    |                       | replicate 0, while the state counts of all     |
+    |                       | replicates, as well as their mean, variance    |
+    |                       | and quantiles, are saved in files ending in    |
+    |                       | _replicates, _mean, _var and _qNN.             |
+    +-----------------------+------------------------------------------------+
+    | workers               | Optional (default value the number of CPUs).   |
+    |                       | Number of worker processes used by the         |
+    |                       | parallel engine. Results depend on the number  |
+    |                       | of workers, but are reproducible for a given   |
+    |                       | seed and number of workers.                    |
+    +-----------------------+------------------------------------------------+
+    | leap_flat_rules       | Optional (default value false). If true the    |
+    |                       | array, ensemble and parallel engines draw the  |
+    |                       | transitions of node states whose rules do not  |
+    |                       | refer to NN as one multinomial number of nodes |
+    |                       | per rule, instead of one random number per     |
+    |                       | node. The distribution of the simulation is    |
+    |                       | unchanged.                                     |
+    +-----------------------+------------------------------------------------+
+    | seed                  | Optional. Non-negative integer seed of all     |
+    |                       | random numbers of the simulation. Network      |
+    |                       | generation, initialization, node updates and   |
+    |                       | each replicate and worker block draw from      |
+    |                       | independent streams derived from it (see       |
+    |                       | ``nepidemix.utilities.RandomStreams``). If not |
+    |                       | given a seed is drawn for every configured     |
+    |                       | simulation, and recorded as seed in the Info   |
+    |                       | section of the saved configuration so that the |
+    |                       | run can be repeated.                           |
+    +-----------------------+------------------------------------------------+
+    | stop_when_absorbed    | Optional (default value false). If true the    |
+    |                       | simulation stops before the last iteration     |
+    |                       | once the state counts are unchanged by an      |
+    |                       | iteration and the process reports that no rule |
+    |                       | can change the network any more (see           |
+    |                       | ``nepidemix.process.Process.isAbsorbed``),     |
+    |                       | e.g. when no infected nodes remain.            |
+    +-----------------------+------------------------------------------------+
+    | stop_state_zero       | Optional. A state, written as in the           |
+    |                       | NodeStateDistribution section, e.g.            |
+    |                       | {status:I}. The simulation stops once its      |
+    |                       | count is zero. Must be a state counted by the  |
+    |                       | process, such as a declared mean field state.  |
+    +-----------------------+------------------------------------------------+
+    | stop_stationary       | Optional (default value 0). If > 0 the         |
+    |                       | simulation stops once no state count has moved |
+    |                       | more than stop_tolerance from its value        |
+    |                       | <value> state count samples earlier. The       |
+    |                       | counts are compared every                      |
+    |                       | save_state_count_interval iterations (every    |
+    |                       | iteration if the interval is <= 0).            |
+    +-----------------------+------------------------------------------------+
+    | stop_tolerance        | Optional (default value 0). Tolerance of       |
+    |                       | stop_stationary, as a fraction of the number   |
+    |                       | of nodes.                                      |
+    +-----------------------+------------------------------------------------+
 
     
     +----------------------------+-------------------------------------------+
@@ -280,6 +381,24 @@ class Simulation(object):
     |                            | with the current simulation it is         |
     |                            | appended to. If not an error is           |
     |                            | generated.                                |
+    |                            | Node state ids are derived from the state |
+    |                            | content (see StateIndex.digest).          |
+    |                            | Databases written by earlier versions,    |
+    |                            | holding hash() state ids, are not         |
+    |                            | compatible.                               |
+    +----------------------------+-------------------------------------------+
+    | db_buffer_size             | Optional (default value 10000). Node      |
+    |                            | events are buffered and written to the    |
+    |                            | database once per iteration, or when this |
+    |                            | many events have been buffered.           |
+    +----------------------------+-------------------------------------------+
+    | db_journal_mode            | Optional. If given the sqlite journal     |
+    |                            | mode of the database (PRAGMA              |
+    |                            | journal_mode), e.g. MEMORY or WAL.        |
+    +----------------------------+-------------------------------------------+
+    | db_synchronous             | Optional. If given the sqlite synchronous |
+    |                            | setting of the database (PRAGMA           |
+    |                            | synchronous), e.g. OFF or NORMAL.         |
     +----------------------------+-------------------------------------------+
     | save_state_count           | Optional (default value true) switch      |
     |                            | (on/off, true/false, yes/no, 1/0).        |            
@@ -296,6 +415,63 @@ class Simulation(object):
     |                            | node state counts are always saved even   |
     |                            | if they are not covered by the interval.  |
     +----------------------------+-------------------------------------------+
+    | save_state_count_npz       | Optional (default value false) switch     |
+    |                            | (on/off, true/false, yes/no, 1/0).        |
+    |                            | If true the state counts are also saved   |
+    |                            | as a numpy .npz file, with the arrays     |
+    |                            | times, counts and labels.                 |
+    +----------------------------+-------------------------------------------+
+    | stream_state_count         | Optional (default value false) switch     |
+    |                            | (on/off, true/false, yes/no, 1/0).        |
+    |                            | If true the state count csv file is       |
+    |                            | written while the simulation runs rather  |
+    |                            | than by saveData, keeping memory use      |
+    |                            | constant and partial results on failure.  |
+    |                            | Columns are fixed by the initial states.  |
+    |                            | Can not be combined with                  |
+    |                            | save_state_count_npz.                     |
+    +----------------------------+-------------------------------------------+
+    | stream_flush_interval      | Optional (default value 100). Number of   |
+    |                            | streamed samples between flushes of the   |
+    |                            | state count file.                         |
+    +----------------------------+-------------------------------------------+
+    | checkpoint_interval        | Optional (default value 0). If > 0 a      |
+    |                            | checkpoint is written every <value>       |
+    |                            | iterations to <base_name>.checkpoint in   |
+    |                            | output_dir, from which an interrupted     |
+    |                            | simulation can be continued with          |
+    |                            | Simulation.resume, giving the same output |
+    |                            | as an uninterrupted run. Requires a       |
+    |                            | process with constant topology, the       |
+    |                            | networkx, array, parallel or dynamic      |
+    |                            | engine, and save_network_format gpickle.  |
+    +----------------------------+-------------------------------------------+
+    | stop_output                | Optional (default value truncate). Output |
+    |                            | of a simulation stopped early by a        |
+    |                            | stopping condition. truncate ends the     |
+    |                            | state count file with a sample at the     |
+    |                            | stop. pad instead writes the samples of a |
+    |                            | full run, repeating the final counts for  |
+    |                            | the iterations after the stop, so that    |
+    |                            | the file has the rows of a full run. The  |
+    |                            | network is saved at the stop. The         |
+    |                            | iteration stopped after and the condition |
+    |                            | met are set in the Info section           |
+    |                            | (stop_iteration, stop_reason).            |
+    +----------------------------+-------------------------------------------+
+    | save_network_format        | Optional (default value gpickle). Format  |
+    |                            | of saved networks, gpickle or delta.      |
+    |                            | gpickle saves the full network to one     |
+    |                            | file per saved iteration. delta saves the |
+    |                            | network once to a _topology file and the  |
+    |                            | graph data and changed node attributes of |
+    |                            | every saved iteration to a .delta file,   |
+    |                            | read by                                   |
+    |                            | nepidemix.utilities.DeltaSnapshotReader.  |
+    |                            | delta requires a process with constant    |
+    |                            | topology and no edge rules, otherwise     |
+    |                            | gpickle is used.                          |
+    +----------------------------+-------------------------------------------+
     | save_network_compress_file | Optional (default value true) switch      |
     |                            | (on/off, true/false, yes/no, 1/0).        |
     |                            | Denotes if the saved network files should |
@@ -363,12 +539,23 @@ class Simulation(object):
     CFG_PARAM_node_init = "node_init"
     CFG_PARAM_edge_init = "edge_init"
     CFG_PARAM_include_files = "include_files"
+    CFG_PARAM_engine = "engine"
+    CFG_PARAM_replicates = "replicates"
+    CFG_PARAM_workers = "workers"
+    CFG_PARAM_seed = "seed"
+    CFG_PARAM_leap_flat_rules = "leap_flat_rules"
+    CFG_PARAM_stop_when_absorbed = "stop_when_absorbed"
+    CFG_PARAM_stop_state_zero = "stop_state_zero"
+    CFG_PARAM_stop_stationary = "stop_stationary"
+    CFG_PARAM_stop_tolerance = "stop_tolerance"
 
     # Info parameters.
     CFG_PARAM_execute_time = "sim_exec_time"
     CFG_PARAM_avgclust = "avg_clustering"
     CFG_PARAM_avgdegree = "avg_degree"
     CFG_PARAM_nepidemix_version = "NepidemiX_version";
+    CFG_PARAM_stop_iteration = "stop_iteration"
+    CFG_PARAM_stop_reason = "stop_reason"
 
     # Network output parameters
     CFG_PARAM_save_network = "save_network"
@@ -377,9 +564,33 @@ class Simulation(object):
     CFG_PARAM_save_network_compress_file = "save_network_compress_file"
     CFG_PARAM_save_state_count = "save_state_count"
     CFG_PARAM_save_state_count_interval = "save_state_count_interval"
+    CFG_PARAM_save_state_count_npz = "save_state_count_npz"
+    CFG_PARAM_stream_state_count = "stream_state_count"
+    CFG_PARAM_stream_flush_interval = "stream_flush_interval"
+    CFG_PARAM_checkpoint_interval = "checkpoint_interval"
+    CFG_PARAM_stop_output = "stop_output"
     CFG_PARAM_save_node_rule_transition_count = "save_state_transition_cnt"
     CFG_PARAM_print_progress = "print_progress_bar"
     CFG_PARAM_db_name = "db_name"
+    CFG_PARAM_db_buffer_size = "db_buffer_size"
+    CFG_PARAM_db_journal_mode = "db_journal_mode"
+    CFG_PARAM_db_synchronous = "db_synchronous"
+
+    # The engine implemented by Simulation itself. Others are found in
+    # nepidemix.engines.ENGINES.
+    ENGINE_networkx = "networkx"
+    ENGINE_ensemble = "ensemble"
+    ENGINE_dynamic = "dynamic"
+
+    # Percentiles saved for ensemble runs.
+    ENSEMBLE_PERCENTILES = [5, 50, 95]
+
+    # Values of the stop_output option.
+    STOP_OUTPUT_truncate = "truncate"
+    STOP_OUTPUT_pad = "pad"
+
+    # Version of the checkpoint contents.
+    CHECKPOINT_VERSION = 2
 
     # Names of fields in the network graph dictionary.
     TIME_FIELD_NAME = "Time"
@@ -397,9 +608,84 @@ class Simulation(object):
 
         self.save_config = False
         self.settings = None
+        self.engineName = self.ENGINE_networkx
+        self.replicates = 1
+        self.workers = 1
+        self.leapFlatRules = False
+        # Random number streams, set by configure.
+        self.randomStreams = None
+        # Replicate state counts, set by the ensemble engine.
+        self.ensembleSamples = None
+        # Initial node state ids of replicates 1 and up, set by configure if
+        # the node states of the ensemble engine are dealt.
+        self.replicateNodeStates = None
 
         # Set when database is initialized, and simulation table filled out.
         self._db_sim_id = None
+        self._dbWriter = None
+        # Set when the first delta network snapshot is saved.
+        self._snapshotWriter = None
+        # State counters, set by execute.
+        self._counterStore = None
+        # The first iteration to execute, set when resuming.
+        self.firstIteration = 0
+        self.checkpointInterval = 0
+        # Set by configure if checkpoints are written.
+        self._checkpointWriter = None
+        self._resumeSettings = None
+        # Set by resume.
+        self._resumeCheckpoint = None
+        # Stopping conditions, set by configure.
+        self.stopWhenAbsorbed = False
+        self.stopState = None
+        self._stopStateString = None
+        self.stopStationary = 0
+        self.stopTolerance = 0.0
+        self.stopOutput = self.STOP_OUTPUT_truncate
+        # The iteration the simulation stopped after, if stopped early.
+        self.stopIteration = None
+        # Counts of the previous iteration, and the reference counts of the
+        # stationarity test and the number of iterations within tolerance.
+        self._stopPrevious = None
+        self._stopReference = None
+        self._stopStationaryCount = 0
+
+    @classmethod
+    def resume(cls, fileName):
+        """
+        Create a simulation continuing from a checkpoint.
+
+        The simulation is configured as the one writing the checkpoint, and
+        its `execute` continues from the checkpoint iteration, appending to
+        the output of the interrupted simulation. The output is the same as
+        that of an uninterrupted run.
+
+        Parameters
+        ----------
+
+        fileName : str
+           The checkpoint file (see option ``checkpoint_interval``).
+
+        Returns
+        -------
+
+        simulation : Simulation
+           The configured simulation.
+
+        """
+        checkpoint = loadCheckpoint(fileName)
+        if checkpoint.get('version') != cls.CHECKPOINT_VERSION:
+            emsg = "Checkpoint '{0}' has version {1}, expected {2}."\
+                .format(fileName, checkpoint.get('version'),
+                        cls.CHECKPOINT_VERSION)
+            logger.error(emsg)
+            raise NepidemiXBaseException(emsg)
+        logger.info("Resuming from '{0}' at iteration {1}."\
+                        .format(fileName, checkpoint['iteration']))
+        sim = cls()
+        sim._resumeCheckpoint = checkpoint
+        sim.configure(checkpoint['settings'])
+        return sim
 
     def execute(self):
         """ 
@@ -408,63 +694,131 @@ class Simulation(object):
         The simulation must be configured before this method is called.
         
         """
-        nwcopytime = 0
         startTime = time.time()
         logger.info("Running simulation.")
         logger.info("Simulation will cover {0} months."\
                         .format(self.iterations*self.dt))
 
+        checkpoint = self._resumeCheckpoint
         # If the network is to be saved, then save the initial config.
-        if self.saveNetwork == True:
+        if self.saveNetwork == True and checkpoint == None:
             self._saveNetwork(number = 0)
         
         # Create state count arrays, count and add the initial states.
 
         self.stateSamples = {}
         
-        self.stateSamples[self.STATE_COUNT_FIELD_NAME] = []
+        for k in [self.STATE_COUNT_FIELD_NAME]:
+            if self.saveStates[k] and self.streamStates:
+                stateDataFName = self.outputDir+"/"+self.baseFileName+"_{0}.csv".format(k)
+                logger.info("Streaming to file = '{0}'".format(stateDataFName))
+                self.stateSamples[k] = StateCountStream(stateDataFName,
+                                                        self.network.graph[k].keys(),
+                                                        self.TIME_FIELD_NAME,
+                                                        self.streamFlushInterval,
+                                                        checkpoint = None if checkpoint == None else checkpoint['samples'][k])
+                continue
+            # Room for the initial, final and all interval samples.
+            capacity = 2
+            if self.saveStates[k] and self.saveStatesInterval[k] > 0:
+                capacity += self.iterations // self.saveStatesInterval[k]
+            self.stateSamples[k] = StateCountRecorder(capacity)
+            if checkpoint != None:
+                self.stateSamples[k].restore(checkpoint['samples'][k])
 
         # Get database cursor if there is a connection.
-        db_cur = self._dbConnection.cursor() if self._dbConnection != None else None
+        db_cur = self._dbConnection.cursor() if self._dbWriter != None else None
     
         # Add entry for time 0.
-        for k in self.stateSamples:
-            # Create dictionary.
-            countDict = {}
-            # Insert time stamp.
-            countDict[self.TIME_FIELD_NAME] = self.network.graph.get(self.TIME_FIELD_NAME,0.0)
-            # Copy data.
+        if checkpoint == None:
+            for k in self.stateSamples:
+                self.stateSamples[k].record(self.network.graph.get(self.TIME_FIELD_NAME,0.0),
+                                            self.network.graph[k])
+
+        logger.info("Initial node state count vector: {0}".format(dict([ (s,str(v)) for s,v in self.network.graph[self.STATE_COUNT_FIELD_NAME].iteritems()])))
+
+        # From here on the state counts are double buffered views of a
+        # counter store, committed rather than copied between iterations.
+        self._counterStore = CounterStore(self.network.graph[self.STATE_COUNT_FIELD_NAME])
+        self.network.graph[self.STATE_COUNT_FIELD_NAME] = self._counterStore.views[0]
+        self.stopIteration = None
+        self._stopPrevious = numpy.array(self.network.graph[self.STATE_COUNT_FIELD_NAME].values())
+        self._stopReference = self._stopPrevious
+        self._stopStationaryCount = 0
+        if checkpoint != None:
+            self._restoreCheckpoint(checkpoint)
 
-            countDict.update(dict([ (s,str(v)) for s,v in self.network.\
-                                        graph[k].iteritems()]))
+        logger.info("Process will leave topology constant?: {0}".format(self.process.constantTopology))
+        logger.info("Using the '{0}' engine.".format(self.engineName))
+        try:
+            if self.engineName == self.ENGINE_networkx:
+                self._executeNetworkX(db_cur)
+            else:
+                engines.ENGINES[self.engineName](self).run(db_cur)
+        finally:
+            # Keep what has been streamed, also on failure.
+            for k in self.stateSamples:
+                if isinstance(self.stateSamples[k], StateCountStream):
+                    self.stateSamples[k].close()
+            if self._snapshotWriter != None:
+                self._snapshotWriter.close()
+                self._snapshotWriter = None
+            if self._checkpointWriter != None:
+                self._checkpointWriter.close()
 
-            self.stateSamples[k].append(countDict)
+        # Print 100 % when done
+        if self.printProgress:
+            sys.stdout.write("[100%]\n")
+        # Commit changes to database
+        if self._dbConnection != None:
+            if self._dbWriter != None:
+                self._dbWriter.flush()
+            self._dbConnection.commit()
+        logger.info("Simulation done.")
+        endTime = time.time()
+        logger.info("Total execution time: {0} s.".format(endTime-startTime))
+        if self.settings != None:
+            self.settings.set(self.CFG_SECTION_INFO, 
+                              self.CFG_PARAM_execute_time,(endTime-startTime))
 
+    def _executeNetworkX(self, db_cur):
+        """
+        The networkx main loop.
+
+        Each iteration every node (and edge) is copied, updated by the process
+        and added to a second network which then becomes the current one.
+
+        Parameters
+        ----------
 
-        logger.info("Initial node state count vector: {0}".format(self.stateSamples[self.STATE_COUNT_FIELD_NAME]))
+        db_cur : sqlite3.Cursor or None
+           Database cursor for node event output.
 
+        """
         readNetwork = self.network
-        logger.info("Process will leave topology constant?: {0}".format(self.process.constantTopology))
         if self.process.constantTopology == True:
             writeNetwork = readNetwork.copy()
         else:
             writeNetwork = networkx.Graph()
-            for stk in self.stateSamples:
-                writeNetwork.graph[stk] = readNetwork.graph[stk].copy()
+        self._copyGraphData(readNetwork.graph, writeNetwork.graph)
 
-        for it in range(self.iterations):
+        for it in range(self.firstIteration, self.iterations):
             # Add a node transition count array for this iteration (update timestamp and copy data array).
             # Update nodes.
             if self.process.constantTopology == False or self.process.runNodeUpdate == True:
                 # Go over all nodes.
 
                 for n in readNetwork.nodes_iter(data = True):
-                    oldstate = self.process.deduceNodeState(n)
                     nc = (n[0], n[1].copy())
                     nc = self.process.nodeUpdateRule(nc, 
                                                      readNetwork, 
                                                      self.dt)
                     writeNetwork.add_node(nc[0], nc[1])
+                    # Unchanged attributes give an unchanged state, so the
+                    # states are only deduced for changed nodes.
+                    if not attributesChanged(n[1], nc[1]):
+                        continue
+                    oldstate = self.process.deduceNodeState(n)
                     newstate = self.process.deduceNodeState(nc)
 
                     if newstate != oldstate:
@@ -480,48 +834,24 @@ class Simulation(object):
                         writeNetwork.graph[self.STATE_COUNT_FIELD_NAME][oldstate] -= 1
 
                         # Update database
-                        # Check if we have a description of the destination stat
-                        # (the source state should be there per definition)
-                        # If not, insert it.
                         if db_cur != None:
-                            ncks = nc[1].keys()
-                            db_cur.execute("""INSERT OR IGNORE INTO {0}({1}, {2}) VALUES ({3})"""\
-                            .format(sqlite3io.NODE_STATE_TABLE_NAME,
-                                    sqlite3io.NODE_STATE_TABLE_ID_COL,
-                                    ",".join(ncks),
-                                    ",".join(["?"]*(1+len(nc[1])))),
-                            [hash(newstate)]+
-                            [nc[1][k] for k in ncks])
-                            db_cur.execute("""INSERT INTO {0}({1}, {2},
-                                               {3}, {4}, 
-                                               {5}, 
-                                               {6},
-                                               {7})
-                                              VALUES (?, ?, ?, ?, ?, ?, ?)"""\
-                                           .format(sqlite3io.NODE_EVENT_TABLE_NAME,
-                                                   sqlite3io.NODE_EVENT_TABLE_SRC_STATE_COL,
-                                                   sqlite3io.NODE_EVENT_TABLE_DST_STATE_COL,
-                                                   sqlite3io.NODE_EVENT_TABLE_NODE_ID_COL,
-                                                   sqlite3io.NODE_EVENT_TABLE_SIM_ID_COL,
-                                                   sqlite3io.NODE_EVENT_TABLE_SIM_TIME_COL,
-                                                   sqlite3io.NODE_EVENT_TABLE_MAJOR_IT_COL,
-                                                   sqlite3io.NODE_EVENT_TABLE_MINOR_IT_COL,
-                                           ),
-                                           (hash(oldstate), hash(newstate),
-                                           n[0], self._db_sim_id,
-                                           readNetwork.graph[self.TIME_FIELD_NAME],
-                                            it, n[0]))
+                            self._dbNodeEvent(db_cur, oldstate, newstate, nc[1],
+                                              n[0],
+                                              readNetwork.graph[self.TIME_FIELD_NAME],
+                                              it)
 
 
             # Update edges.
             if self.process.constantTopology == False or self.process.runEdgeUpdate == True:
                 for e in readNetwork.edges_iter(data = True):
-                    oldstate = self.process.deduceEdgeState(e)
                     ne = (e[0], e[1], e[2].copy())
                     ne = self.process.edgeUpdateRule(ne,
                                                      readNetwork,
                                                      self.dt)
                     writeNetwork.add_edge(ne[0], ne[1], ne[2])
+                    if not attributesChanged(e[2], ne[2]):
+                        continue
+                    oldstate = self.process.deduceEdgeState(e)
                     newstate = self.process.deduceEdgeState(ne)
 
                     if newstate != oldstate:
@@ -541,52 +871,341 @@ class Simulation(object):
             if self.process.constantTopology == False:
                 writeNetwork.clear()
             # Always update the graph data
-            for k in readNetwork.graph:
-                writeNetwork.graph[k] = copy.deepcopy(readNetwork.graph[k])
-                # Check if we should save node state this iteration.
-                # it +1 is checked as the 0th is always saved before the loop.
-                # Also always save the last result.
-                if  k in self.stateSamples and self.saveStates[k] and \
-                        ((self.saveStatesInterval[k] >0 and (it+1)%(self.saveStatesInterval[k]) == 0)\
-                             or (it == self.iterations -1 )):
-                    # Add the mean field states.
-                    countDict = {}
-                    # Create dictionary.
-                    # Insert time stamp.
-                    countDict[self.TIME_FIELD_NAME] = self.network.graph[self.TIME_FIELD_NAME]
-                    # Copy data.
-                    countDict.update(dict([ (s,str(v)) for s,v in self.network.graph[k].iteritems()]))
-                    # Add to current list of samples.
-                    self.stateSamples[k].append(countDict)
-                                
-                            
-            # Check network saving. Same here as for states above:
-            # look at iteration +1, as it is done after execution of the rules.
-            if self.saveNetwork == True and ( \
-                ( self.saveNetworkInterval >0 \
-                      and (it+1)%(self.saveNetworkInterval) == 0 )\
-                    or it == (self.iterations-1) ):
-                self._saveNetwork(number= (it+1))
-            # Print progress
-            if self.printProgress:
-                if it % int(self.iterations * 0.20) == 0:
-                    sys.stdout.write("[{0}%]".format(int(it*100.0/self.iterations)))
-                    sys.stdout.flush()
-                elif it % int(self.iterations * 0.025) == 0:
-                    sys.stdout.write("=")
-                    sys.stdout.flush()
-        # Print 100 % when done
+            self._copyGraphData(readNetwork.graph, writeNetwork.graph)
+
+            if self._endOfIteration(it):
+                break
+
+    def _copyGraphData(self, src, dst):
+        """
+        Make the graph data dictionary `dst` equal to `src`.
+
+        The state counts are committed to the other buffer of the counter
+        store (see `nepidemix.utilities.CounterStore`) rather than copied, any
+        other value is deep copied.
+
+        """
+        for k in src:
+            if k == self.STATE_COUNT_FIELD_NAME and self._counterStore != None:
+                dst[k] = self._counterStore.commit(src[k])
+            else:
+                dst[k] = copy.deepcopy(src[k])
+
+    def _endOfIteration(self, it):
+        """
+        Sample state counts, save the network and print progress as due after
+        iteration `it`, and check the stopping conditions. Called by the
+        engines at the end of every iteration, once `network` holds the
+        updated network.
+
+        If a stopping condition is met the iteration is treated as the last:
+        with stop_output truncate the final sample is recorded, with pad the
+        samples due and the padding samples are, and the network is saved.
+
+        Parameters
+        ----------
+
+        it : int
+           The iteration just completed (counting from 0).
+
+        Returns
+        -------
+
+        stop : bool
+           True if the engine is to stop after this iteration.
+
+        """
+        stopReason = None
+        if it < self.iterations - 1 and self._stopConditions():
+            stopReason = self._stopReason(it)
+
+        # A truncated run ends with a sample at the stop, a padded one only
+        # records the samples of a full run.
+        pad = stopReason != None and self.stopOutput == self.STOP_OUTPUT_pad
+        for k in self.stateSamples:
+            if self._sampleDue(k, it) or \
+                    (stopReason != None and not pad and self.saveStates[k]):
+                self.stateSamples[k].record(self.network.graph[self.TIME_FIELD_NAME],
+                                            self.network.graph[k])
+        if pad:
+            self._padSamples(it)
+                        
+        # Write the node events of the iteration.
+        if self._dbWriter != None:
+            self._dbWriter.flush()
+
+        # Check network saving. Same here as for states above:
+        # look at iteration +1, as it is done after execution of the rules.
+        if self.saveNetwork == True and ( \
+            ( self.saveNetworkInterval >0 \
+                  and (it+1)%(self.saveNetworkInterval) == 0 )\
+                or it == (self.iterations-1) or stopReason != None):
+            self._saveNetwork(number= (it+1))
+
+        if stopReason != None:
+            logger.info("Stopping after iteration {0} of {1}: {2}."\
+                            .format(it + 1, self.iterations, stopReason))
+            self.stopIteration = it + 1
+            if self.settings != None:
+                self.settings.set(self.CFG_SECTION_INFO,
+                                  self.CFG_PARAM_stop_iteration, it + 1)
+                self.settings.set(self.CFG_SECTION_INFO,
+                                  self.CFG_PARAM_stop_reason, stopReason)
+            return True
+        if self._checkpointWriter != None \
+                and (it+1) % self.checkpointInterval == 0 \
+                and it < self.iterations - 1:
+            self._writeCheckpoint(it+1)
+        # Print progress
         if self.printProgress:
-            sys.stdout.write("[100%]\n")
-        # Commit changes to database
+            if it % int(self.iterations * 0.20) == 0:
+                sys.stdout.write("[{0}%]".format(int(it*100.0/self.iterations)))
+                sys.stdout.flush()
+            elif it % int(self.iterations * 0.025) == 0:
+                sys.stdout.write("=")
+                sys.stdout.flush()
+        return False
+
+    def _stopConditions(self):
+        """
+        True if any stopping condition is configured.
+
+        """
+        return self.stopWhenAbsorbed or self.stopState != None \
+            or self.stopStationary > 0
+
+    def _stopReason(self, it):
+        """
+        The stopping condition met by the current network after iteration
+        `it`, or None.
+
+        Called once per iteration. The stationarity test counts the state
+        count samples (see stop_stationary) the counts have stayed within
+        tolerance, so that a stationary simulation stops at a sample.
+
+        """
+        counts = self.network.graph[self.STATE_COUNT_FIELD_NAME]
+        values = numpy.array(counts.values())
+        previous = self._stopPrevious
+        self._stopPrevious = values
+        if self.stopState != None and counts[self.stopState] == 0:
+            return "{0} is zero".format(self._stopStateString)
+        interval = self.saveStatesInterval[self.STATE_COUNT_FIELD_NAME]
+        if self.stopStationary > 0 and (interval <= 0
+                                        or (it + 1) % interval == 0):
+            if numpy.abs(values - self._stopReference).max() \
+                    <= self.stopTolerance * len(self.network):
+                self._stopStationaryCount += 1
+            else:
+                self._stopReference = values
+                self._stopStationaryCount = 0
+            if self._stopStationaryCount >= self.stopStationary:
+                return "stationary for {0} samples".format(self.stopStationary)
+        # Unchanged counts are necessary for an absorbed network, and cheap
+        # to test before asking the process.
+        if self.stopWhenAbsorbed and numpy.array_equal(values, previous) \
+                and self.process.isAbsorbed(self.network):
+            return "absorbed"
+        return None
+
+    def _padSamples(self, it):
+        """
+        Record the current state counts for the samples due after iteration
+        `it`, as if the counts were left unchanged by the remaining
+        iterations.
+
+        """
+        simTime = self.network.graph[self.TIME_FIELD_NAME]
+        for j in range(it + 1, self.iterations):
+            simTime = simTime + self.dt
+            for k in self.stateSamples:
+                if self._sampleDue(k, j):
+                    self.stateSamples[k].record(simTime, self.network.graph[k])
+
+    def _writeCheckpoint(self, iteration):
+        """
+        Start writing a checkpoint of the simulation, to be continued at
+        iteration `iteration`.
+
+        The checkpoint holds the node and edge attributes, the graph data,
+        the state counts and node states, the states of the random number
+        generators, the samples recorded and the database position. Node
+        events written so far are committed to the database first.
+
+        """
         if self._dbConnection != None:
             self._dbConnection.commit()
-        logger.info("Simulation done.")
-        endTime = time.time()
-        logger.info("Total execution time: {0} s.".format(endTime-startTime))
-        if self.settings != None:
-            self.settings.set(self.CFG_SECTION_INFO, 
-                              self.CFG_PARAM_execute_time,(endTime-startTime))
+        network = self.network
+        nodes = network.nodes()
+        nodeIndex = dict(zip(nodes, xrange(len(nodes))))
+        edges = network.edges(data = True)
+        graphData = OrderedDict([(k, v) for k, v in network.graph.iteritems()
+                                 if k != self.STATE_COUNT_FIELD_NAME])
+        database = None
+        if self._dbWriter != None:
+            database = {'simulationId' : self._db_sim_id,
+                        'seenStates' : self._dbWriter.seenStates()}
+        checkpoint = {
+            'version' : self.CHECKPOINT_VERSION,
+            'iteration' : iteration,
+            'settings' : self._resumeSettings,
+            'nodes' : nodes,
+            'nodeAttributes' : packAttributes([network.node[n] for n in nodes]),
+            'edges' : numpy.array([(nodeIndex[u], nodeIndex[v])
+                                   for u, v, d in edges],
+                                  dtype = numpy.int64).reshape((-1, 2)),
+            'edgeAttributes' : packAttributes([d for u, v, d in edges]),
+            'graph' : copy.deepcopy(graphData),
+            'counts' : network.graph[self.STATE_COUNT_FIELD_NAME].state(),
+            'states' : list(self.process.stateIndex.states),
+            'random' : {'process' : self.process.random.get_state(),
+                        'uniforms' : list(self.process._uniforms),
+                        'python' : random.getstate(),
+                        'numpy' : numpy.random.get_state()},
+            'samples' : dict([(k, self.stateSamples[k].checkpoint())
+                              for k in self.stateSamples]),
+            'database' : database,
+            'stop' : (self._stopPrevious, self._stopReference,
+                      self._stopStationaryCount)}
+        self._checkpointWriter.write(checkpoint)
+
+    def _restoreCheckpoint(self, checkpoint):
+        """
+        Set the network, state counts, random number generators and the
+        first iteration to those of `checkpoint`.
+
+        Called by execute once the counter store is created.
+
+        """
+        network = self.network
+        nodes = checkpoint['nodes']
+        edges = checkpoint['edges']
+        if len(nodes) != network.number_of_nodes() \
+                or len(edges) != network.number_of_edges():
+            raise NepidemiXBaseException("The checkpoint network does not match the configured network.")
+        for n, atts in zip(nodes, unpackAttributes(checkpoint['nodeAttributes'])):
+            network.node[n] = atts
+        for (i, j), atts in zip(edges.tolist(),
+                                unpackAttributes(checkpoint['edgeAttributes'])):
+            ed = network.adj[nodes[i]][nodes[j]]
+            ed.clear()
+            ed.update(atts)
+        for k, v in checkpoint['graph'].iteritems():
+            network.graph[k] = v
+        counts = network.graph[self.STATE_COUNT_FIELD_NAME]
+        counts.setState(*checkpoint['counts'])
+        # State ids are given in order of interning, and must be those of the
+        # interrupted simulation.
+        stateIndex = StateIndex()
+        for state in checkpoint['states']:
+            stateIndex.intern(state)
+        self.process.stateIndex = stateIndex
+        rs = checkpoint['random']
+        self.process.random.set_state(rs['process'])
+        self.process._uniforms = list(rs['uniforms'])
+        random.setstate(rs['python'])
+        numpy.random.set_state(rs['numpy'])
+        self._stopPrevious, self._stopReference, self._stopStationaryCount = \
+            checkpoint['stop']
+        self.firstIteration = checkpoint['iteration']
+
+    def _initializeReplicateNodes(self, attDict):
+        """
+        Deal the initial node states of replicates 1 and up of the ensemble
+        engine as those of the network, by the node initialization of the
+        process, each replicate drawing from a random stream of its own.
+
+        Parameters
+        ----------
+
+        attDict : dict
+           The node state distribution passed to initializeNetworkNodes.
+
+        Returns
+        -------
+
+        states : list
+           One array per replicate with the state id, interned in the state
+           index of the process, of each node in the order of network.nodes().
+
+        """
+        nodes = self.network.nodes()
+        stateIndex = self.process.stateIndex
+        states = []
+        for r in range(1, self.replicates):
+            replicate = networkx.Graph()
+            replicate.graph = OrderedDict(self.network.graph)
+            replicate.graph[self.STATE_COUNT_FIELD_NAME] = OrderedDict()
+            replicate.add_nodes_from(self.network.nodes_iter(data = True))
+            self.process.setRandom(self.randomStreams.stream('replicate', r))
+            self.process.initializeNetworkNodes(replicate, **attDict)
+            nodeData = replicate.node
+            states.append(numpy.array(
+                    [stateIndex.intern(self.process.deduceNodeState(
+                                (n, nodeData[n]))) for n in nodes],
+                    dtype = numpy.int32))
+        return states
+
+    def _sampleDue(self, sampleName, it):
+        """
+        True if sample `sampleName` is to be saved after iteration `it`.
+
+        """
+        # it +1 is checked as the 0th is always saved before the loop.
+        # Also always save the last result.
+        return self.saveStates[sampleName] and \
+            ((self.saveStatesInterval[sampleName] >0 and \
+                  (it+1)%(self.saveStatesInterval[sampleName]) == 0)\
+                 or (it == self.iterations -1 ))
+
+    def _dbNodeEvent(self, db_cur, oldstate, newstate, nodeAttributes,
+                     nodeId, simTime, it, minorIt = None):
+        """
+        Write a node state change to the database.
+
+        The event is buffered, and written at the end of the iteration.
+
+        Parameters
+        ----------
+
+        db_cur : sqlite3.Cursor
+           Database cursor. Events are only to be written if not None.
+
+        oldstate : hashable
+           Node state before the change.
+
+        newstate : hashable
+           Node state after the change.
+
+        nodeAttributes : dict
+           Node attribute dictionary after the change.
+
+        nodeId : networkx node
+           The node.
+
+        simTime : float
+           Simulation time of the event. For the discrete time engines the
+           time at the start of the iteration.
+
+        it : int
+           The iteration.
+
+        minorIt : int, optional
+           Minor iteration of the event, unique within the iteration. The
+           default is the node id.
+
+        """
+        if minorIt == None:
+            minorIt = nodeId
+        # The source state should already be known to the writer, the
+        # destination state is added if not. States are stored by their content
+        # derived ids, so that the ids agree between simulations in the same
+        # database.
+        stateIndex = self.process.stateIndex
+        newId = stateIndex.digest(stateIndex.intern(newstate))
+        self._dbWriter.addState(newId, nodeAttributes)
+        self._dbWriter.addEvent(stateIndex.digest(stateIndex.intern(oldstate)),
+                                newId, nodeId, simTime, it, minorIt)
 
 
     def configure(self, settings):
@@ -644,12 +1263,14 @@ class Simulation(object):
                 logger.error("Missing mandatory config option : {0}".format(err))
                 sys.exit()
 
+            modulePaths = []
             for pth in settings.getrange(self.CFG_SECTION_SIM,
                                     self.CFG_PARAM_mod_path,
                                     default=[]):
                 abspth = os.path.abspath(pth)
                 logger.info("Adding '{0}' to python path.".format(abspth))
                 sys.path.append(abspth)
+                modulePaths.append(abspth)
 
 
                 
@@ -671,12 +1292,64 @@ class Simulation(object):
         logger.info("Created '{0}' object"
                     .format(process_name))
 
+        # Main loop implementation.
+        self.engineName = settings.get(self.CFG_SECTION_SIM,
+                                       self.CFG_PARAM_engine,
+                                       default = self.ENGINE_networkx)
+        if self.engineName != self.ENGINE_networkx:
+            if not engines.ENGINES.has_key(self.engineName):
+                emsg = "Unknown engine '{0}'. Valid engines are: {1}."\
+                    .format(self.engineName,
+                            ", ".join([self.ENGINE_networkx] + 
+                                      sorted(engines.ENGINES.keys())))
+                logger.error(emsg)
+                raise NepidemiXBaseException(emsg)
+            if self.process.constantTopology == False \
+                    and self.engineName != self.ENGINE_dynamic:
+                logger.warning("The '{0}' engine requires a process with constant topology. Using the '{1}' engine."\
+                                   .format(self.engineName,
+                                           self.ENGINE_networkx))
+                self.engineName = self.ENGINE_networkx
+
+        self.replicates = settings.getint(self.CFG_SECTION_SIM,
+                                          self.CFG_PARAM_replicates,
+                                          default = 1)
+        if self.replicates > 1 and self.engineName != self.ENGINE_ensemble:
+            logger.warning("{0} replicates requested, but only the '{1}' engine runs replicates. Running one."\
+                               .format(self.replicates, self.ENGINE_ensemble))
+        self.workers = settings.getint(self.CFG_SECTION_SIM,
+                                       self.CFG_PARAM_workers,
+                                       default = multiprocessing.cpu_count())
+        if self.workers < 1:
+            emsg = "The number of workers must be positive, got {0}."\
+                .format(self.workers)
+            logger.error(emsg)
+            raise NepidemiXBaseException(emsg)
+
         # Set/update verision info field.
         self.settings.set(self.CFG_SECTION_INFO, 
                           self.CFG_PARAM_nepidemix_version,
                           full_version)
 
+        self.leapFlatRules = settings.getboolean(self.CFG_SECTION_SIM,
+                                                self.CFG_PARAM_leap_flat_rules,
+                                                default = False)
+
+        # Random number streams.
+        if settings.has_option(self.CFG_SECTION_SIM, self.CFG_PARAM_seed):
+            seed = settings.getint(self.CFG_SECTION_SIM, self.CFG_PARAM_seed)
+        else:
+            seed = None
+        self.randomStreams = RandomStreams(seed)
+        # The settings may configure more simulations, so a drawn seed is
+        # only recorded as information.
+        self.settings.set(self.CFG_SECTION_INFO, self.CFG_PARAM_seed,
+                          self.randomStreams.seed)
+        logger.info("Random seed {0}.".format(self.randomStreams.seed))
+
         # Construct and initialize network.
+        # Network generators draw from the global generators.
+        self.randomStreams.seedGlobal('network')
         dparams = settings.evaluateSection(self.CFG_SECTION_NETWORK)
         nwork_name = settings.get(self.CFG_SECTION_SIM, 
                                   self.CFG_PARAM_network_name)
@@ -714,6 +1387,8 @@ class Simulation(object):
                 self.network.graph[self.TIME_FIELD_NAME] = 0.0
 
             logger.debug("Time field after init: {0}".format(self.network.graph[self.TIME_FIELD_NAME]))
+
+            self.process.setRandom(self.randomStreams.stream('initialization'))
             
             # Nodes
             if settings.getboolean(self.CFG_SECTION_SIM, 
@@ -723,6 +1398,10 @@ class Simulation(object):
                 else:
                     attDict = {}
                 self.process.initializeNetworkNodes(self.network, **attDict)
+                if self.replicates > 1 \
+                        and self.engineName == self.ENGINE_ensemble:
+                    self.replicateNodeStates = \
+                        self._initializeReplicateNodes(attDict)
             else:
                 logger.info("Skipping node initialization.")
             # Edges
@@ -739,6 +1418,54 @@ class Simulation(object):
             # Right now it doesn't have a configuration section.
             self.process.initializeNetwork(self.network)
 
+        # Node updates draw about one random number per node and iteration.
+        self.process.setRandom(self.randomStreams.stream('process'),
+                               max(len(self.network), 1))
+        # As do user defined processes using the global generators.
+        self.randomStreams.seedGlobal('global')
+
+        # Stopping conditions.
+        self.stopWhenAbsorbed = settings.getboolean(self.CFG_SECTION_SIM,
+                                                    self.CFG_PARAM_stop_when_absorbed,
+                                                    default = False)
+        self.stopState = None
+        if settings.has_option(self.CFG_SECTION_SIM, self.CFG_PARAM_stop_state_zero):
+            self._stopStateString = settings.get(self.CFG_SECTION_SIM,
+                                                 self.CFG_PARAM_stop_state_zero)
+            try:
+                self.stopState = self.process.parseState(self._stopStateString)
+            except (NameError, SyntaxError, AttributeError):
+                self.stopState = None
+            if self.stopState == None or \
+                    self.stopState not in self.network.graph[self.STATE_COUNT_FIELD_NAME]:
+                emsg = "The state '{0}' of option {1} is not counted by the process."\
+                    .format(self._stopStateString,
+                            self.CFG_PARAM_stop_state_zero)
+                logger.error(emsg)
+                raise NepidemiXBaseException(emsg)
+        self.stopStationary = settings.getint(self.CFG_SECTION_SIM,
+                                              self.CFG_PARAM_stop_stationary,
+                                              default = 0)
+        self.stopTolerance = settings.getfloat(self.CFG_SECTION_SIM,
+                                               self.CFG_PARAM_stop_tolerance,
+                                               default = 0.0)
+        self.stopOutput = settings.get(self.CFG_SECTION_OUTPT,
+                                       self.CFG_PARAM_stop_output,
+                                       default = self.STOP_OUTPUT_truncate)
+        if self.stopOutput not in [self.STOP_OUTPUT_truncate,
+                                   self.STOP_OUTPUT_pad]:
+            emsg = "Unknown {0} '{1}', must be {2} or {3}."\
+                .format(self.CFG_PARAM_stop_output, self.stopOutput,
+                        self.STOP_OUTPUT_truncate, self.STOP_OUTPUT_pad)
+            logger.error(emsg)
+            raise NepidemiXBaseException(emsg)
+        if self._stopConditions() and self.engineName == self.ENGINE_ensemble:
+            logger.warning("Replicates of the '{0}' engine can not stop early, the stopping conditions are ignored."\
+                               .format(self.ENGINE_ensemble))
+            self.stopWhenAbsorbed = False
+            self.stopState = None
+            self.stopStationary = 0
+
 
         self.saveStatesInterval = {}
 
@@ -755,6 +1482,22 @@ class Simulation(object):
                                 self.CFG_PARAM_save_state_count,
                                 default=True)
 
+        self.saveStatesNPZ = \
+            settings.getboolean(self.CFG_SECTION_OUTPT,
+                                self.CFG_PARAM_save_state_count_npz,
+                                default = False)
+
+        self.streamStates = \
+            settings.getboolean(self.CFG_SECTION_OUTPT,
+                                self.CFG_PARAM_stream_state_count,
+                                default = False)
+        self.streamFlushInterval = \
+            settings.getint(self.CFG_SECTION_OUTPT,
+                            self.CFG_PARAM_stream_flush_interval,
+                            default = 100)
+        if self.streamStates and self.saveStatesNPZ:
+            logger.warning("State counts are streamed, no npz file will be saved.")
+            self.saveStatesNPZ = False
 
         self.saveNodeRuleTransitionCount = \
             settings.getboolean(self.CFG_SECTION_OUTPT,
@@ -796,6 +1539,12 @@ class Simulation(object):
             settings.getboolean(self.CFG_SECTION_OUTPT,
                                 self.CFG_PARAM_save_network_compress_file,
                                 default = True)
+
+        if self.saveNetworkFormat == 'delta' \
+                and (self.process.constantTopology != True \
+                         or self.process.runEdgeUpdate == True):
+            logger.warning("Delta network snapshots require constant topology and no edge rules, saving as gpickle.")
+            self.saveNetworkFormat = 'gpickle'
     
         # Print progress bar if turned on and the number of iterations 
         # are greater than 100.
@@ -805,13 +1554,103 @@ class Simulation(object):
                                 default = True) \
                                 and (self.iterations > 100)
 
+        # Checkpoints
+        self.checkpointInterval = settings.getint(self.CFG_SECTION_OUTPT,
+                                                  self.CFG_PARAM_checkpoint_interval,
+                                                  default = 0)
+        if self.checkpointInterval > 0:
+            if self.engineName != self.ENGINE_networkx and \
+                    not getattr(engines.ENGINES[self.engineName],
+                                'supportsCheckpoints', False):
+                logger.warning("The '{0}' engine does not support checkpoints, none will be written."\
+                                   .format(self.engineName))
+                self.checkpointInterval = 0
+            elif self.process.constantTopology != True:
+                logger.warning("Checkpoints require a process with constant topology, none will be written.")
+                self.checkpointInterval = 0
+            elif self.saveNetwork == True and self.saveNetworkFormat == 'delta':
+                logger.warning("Checkpoints can not be combined with delta network snapshots, none will be written.")
+                self.checkpointInterval = 0
+
         # Database name and creation
         db_name = settings.get(self.CFG_SECTION_OUTPT,
                                self.CFG_PARAM_db_name,
                                default = "{0}.db".format(self.baseFileName))
         if not os.path.isabs(db_name):
             db_name = os.path.join(self.outputDir,db_name)
-        self._setupDatabase(db_name)
+        db_name = os.path.abspath(db_name)
+        if self.checkpointInterval > 0:
+            # The settings of a resumed simulation, writing to the same
+            # files. Included files are already read into the settings.
+            self._resumeSettings = pickle.loads(pickle.dumps(settings,
+                                                             protocol = -1))
+            for opt, value in [(self.CFG_PARAM_outputDir,
+                                os.path.abspath(self.outputDir)),
+                               (self.CFG_PARAM_baseFileName, self.baseFileName),
+                               (self.CFG_PARAM_uniqueFileName, "no"),
+                               (self.CFG_PARAM_db_name, db_name)]:
+                self._resumeSettings.set(self.CFG_SECTION_OUTPT, opt, value)
+            self._resumeSettings.set(self.CFG_SECTION_SIM, self.CFG_PARAM_seed,
+                                     self.randomStreams.seed)
+            if len(modulePaths) > 0:
+                self._resumeSettings.set(self.CFG_SECTION_SIM,
+                                         self.CFG_PARAM_mod_path,
+                                         ",".join(modulePaths))
+            self._resumeSettings.remove_option(self.CFG_SECTION_SIM,
+                                               self.CFG_PARAM_include_files)
+            checkpointName = os.path.join(self.outputDir,
+                                          self.baseFileName + ".checkpoint")
+            logger.info("Writing a checkpoint every {0} iterations to '{1}'."\
+                            .format(self.checkpointInterval, checkpointName))
+            self._checkpointWriter = CheckpointWriter(checkpointName)
+        self._dbBufferSize = settings.getint(self.CFG_SECTION_OUTPT,
+                                             self.CFG_PARAM_db_buffer_size,
+                                             default = 10000)
+        pragmas = []
+        for pragma, opt in [("journal_mode", self.CFG_PARAM_db_journal_mode),
+                            ("synchronous", self.CFG_PARAM_db_synchronous)]:
+            if settings.has_option(self.CFG_SECTION_OUTPT, opt):
+                pragmas.append((pragma, settings.get(self.CFG_SECTION_OUTPT,
+                                                     opt)))
+        self._setupDatabase(db_name, pragmas)
+        if self._resumeCheckpoint != None:
+            self._resumeDatabase(self._resumeCheckpoint['iteration'],
+                                 self._resumeCheckpoint['database'])
+
+    def _resumeDatabase(self, iteration, database):
+        """
+        Continue writing node events to the simulation of a checkpoint.
+
+        The simulation entry created by `_setupDatabase` is removed, as are
+        any events of the checkpointed simulation from iteration `iteration`
+        on.
+
+        Parameters
+        ----------
+
+        iteration : int
+           The first iteration to be executed.
+
+        database : dict or None
+           The database information of the checkpoint.
+
+        """
+        if self._dbWriter == None or database == None:
+            return
+        cur = self._dbConnection.cursor()
+        cur.execute("DELETE FROM {0} WHERE {1} = ?"\
+                        .format(sqlite3io.SIMULATION_TABLE_NAME,
+                                sqlite3io.SIMULATION_TABLE_SIM_ID_COL),
+                    (self._db_sim_id,))
+        self._db_sim_id = database['simulationId']
+        cur.execute("DELETE FROM {0} WHERE {1} = ? AND {2} >= ?"\
+                        .format(sqlite3io.NODE_EVENT_TABLE_NAME,
+                                sqlite3io.NODE_EVENT_TABLE_SIM_ID_COL,
+                                sqlite3io.NODE_EVENT_TABLE_MAJOR_IT_COL),
+                    (self._db_sim_id, iteration))
+        self._dbConnection.commit()
+        self._dbWriter.simulation_id = self._db_sim_id
+        self._dbWriter.restoreSeen(database['seenStates'])
 
     def saveData(self):
         """ 
@@ -827,7 +1666,11 @@ class Simulation(object):
                 logger.error("No data to save exists. Run execute() first.")
             else:
                 for sampleName in self.stateSamples:
-                    if self.saveStates[sampleName] == True:
+                    if self.saveStates[sampleName] == True \
+                            and isinstance(self.stateSamples[sampleName],
+                                           StateCountStream):
+                        logger.info("State counts already streamed to file.")
+                    elif self.saveStates[sampleName] == True:
                         stateDataFName = self.outputDir+"/"+self.baseFileName+"_{0}.csv".format(sampleName)
                         logger.info("File = '{0}'".format(stateDataFName))
                         try:
@@ -842,11 +1685,18 @@ class Simulation(object):
                                 # Write labels in first row
                                 stateDataWriter.writerow(keys)
                                 # Write data.
-                                for row in self.stateSamples[sampleName]:
-                                    stateDataWriter.writerow([row.get(k,0) for k in keys])
+                                stateDataWriter.writerows(self.stateSamples[sampleName].rows(keys[1:]))
                         except IOError:
                             logger.error("Could not open file '{0}' for writing!"\
                                              .format(stateDataFName))
+                        if self.saveStatesNPZ == True:
+                            stateDataFName = self.outputDir+"/"+self.baseFileName+"_{0}.npz".format(sampleName)
+                            logger.info("File = '{0}'".format(stateDataFName))
+                            self.stateSamples[sampleName].saveNPZ(stateDataFName,
+                                                                  self.network.graph[sampleName].keys())
+                    if self.saveStates[sampleName] == True \
+                            and self.ensembleSamples != None:
+                        self._saveEnsembleData(sampleName)
                 
         if self.save_config == True:
             if self.settings == None:
@@ -861,11 +1711,52 @@ class Simulation(object):
                                              .format(configDataFName))
         logger.info("Saving done")
 
+    def _saveEnsembleData(self, sampleName):
+        """
+        Save the replicate samples of `sampleName` and their statistics.
+
+        The replicate file has the replicate number as first column,
+        followed by the columns of the ordinary sample file. The mean,
+        variance and percentile files have the same columns as the ordinary
+        sample file.
+
+        """
+        keys = [self.TIME_FIELD_NAME]
+        keys.extend(self.network.graph[sampleName].keys())
+        times = [t for t, counts in self.ensembleSamples[sampleName]]
+        # Array of shape (samples, replicates, labels).
+        data = numpy.array([counts for t, counts in self.ensembleSamples[sampleName]])
+        stats = [("replicates", None),
+                 ("mean", data.mean(axis = 1)),
+                 ("var", data.var(axis = 1))]
+        stats.extend([("q{0}".format(q),
+                       numpy.percentile(data, q, axis = 1))
+                      for q in self.ENSEMBLE_PERCENTILES])
+        for statName, stat in stats:
+            stateDataFName = self.outputDir+"/"+self.baseFileName+"_{0}_{1}.csv".format(sampleName, statName)
+            logger.info("File = '{0}'".format(stateDataFName))
+            try:
+                with open(stateDataFName, 'wb') as stateDataFP:
+                    stateDataWriter = csv.writer(stateDataFP)
+                    if stat is None:
+                        stateDataWriter.writerow(["Replicate"] + keys)
+                        for r in range(data.shape[1]):
+                            for t, row in zip(times, data[:, r]):
+                                stateDataWriter.writerow([r, t] + list(row))
+                    else:
+                        stateDataWriter.writerow(keys)
+                        for t, row in zip(times, stat):
+                            stateDataWriter.writerow([t] + list(row))
+            except IOError:
+                logger.error("Could not open file '{0}' for writing!"\
+                                 .format(stateDataFName))
+
     def _saveNetwork(self, number = -1):
         """
         Save network to file.
         
-        Currently gpickle (uncompressed or bz2 compressed) is supported.
+        Currently gpickle (uncompressed or bz2 compressed) and delta (see
+        `nepidemix.utilities.DeltaSnapshotWriter`) are supported.
         
         Parameters
         ----------
@@ -878,6 +1769,17 @@ class Simulation(object):
 
         sveBaseName = "{0}/{1}".format(self.outputDir,
                                            self.baseFileName)
+        if self.saveNetworkFormat == 'delta':
+            if self._snapshotWriter == None:
+                topologyName = sveBaseName + "_topology.gpickle"
+                if self.saveNetworkFormatCompress == True:
+                    topologyName = topologyName + '.bz2'
+                self._snapshotWriter = DeltaSnapshotWriter(sveBaseName + ".delta",
+                                                           topologyName,
+                                                           self.network)
+            self._snapshotWriter.write(max(number, 0), self.network)
+            return
+
         if number >= 0:
             sveBaseName = sveBaseName +"_{0:010}".format(number)
 
@@ -895,8 +1797,9 @@ class Simulation(object):
         #        logger.info("Wrote initial graph to '{0}'.".format(sveBaseName))
 
 
-    def _setupDatabase(self, db_name):
+    def _setupDatabase(self, db_name, pragmas = []):
         self._dbConnection = None
+        self._dbWriter = None
         self._db_sim_id = None
         try:
             # Try to get the sqlite3 package
@@ -904,11 +1807,26 @@ class Simulation(object):
             logger.info("Connecting to database '{0}'".format(db_name))
             self._dbConnection = sqlite3.connect(db_name)
             cur = self._dbConnection.cursor()
-            # Check if the tables do not exist, create them.
+            for pragma, value in pragmas:
+                logger.info("Setting database {0} = {1}".format(pragma, value))
+                cur.execute("PRAGMA {0} = {1}".format(pragma, value))
+            # Create the tables if they do not exist, otherwise check that
+            # the node state ids are compatible.
             tbls = sorted([n[0] for n in cur.execute("SELECT name from sqlite_master")])
-            if not all([d in tbls for d in [sqlite3io.SIMULATION_TABLE_NAME, 
-                                           sqlite3io.NODE_EVENT_TABLE_NAME,
-                                           sqlite3io.NODE_STATE_TABLE_NAME]]):
+            if all([d in tbls for d in [sqlite3io.SIMULATION_TABLE_NAME, 
+                                       sqlite3io.NODE_EVENT_TABLE_NAME,
+                                       sqlite3io.NODE_STATE_TABLE_NAME]]):
+                # Refuse to mix node state id schemes in one database.
+                version = cur.execute("PRAGMA user_version").fetchone()[0]
+                if version != sqlite3io.STATE_ID_VERSION:
+                    logger.error("Database '{0}' holds node state ids of version {1}, expected version {2}.\n"\
+                                     .format(db_name, version,
+                                             sqlite3io.STATE_ID_VERSION)\
+                                     + " Will not proceed with database output.")
+                    self._dbConnection.close()
+                    self._dbConnection = None
+                    return
+            else:
                 cur.execute("""CREATE TABLE {0} ({1} INTEGER PRIMARY KEY,
                                                {2} TEXT,
                                                {3} BLOB,
@@ -956,6 +1874,8 @@ class Simulation(object):
                             .format(sqlite3io.NODE_STATE_TABLE_NAME,
                                     sqlite3io.NODE_STATE_TABLE_ID_COL,
                                     ",".join(key_types)))
+                cur.execute("PRAGMA user_version = {0}"\
+                                .format(sqlite3io.STATE_ID_VERSION))
             # Create a simulation entry
             cur.execute("""INSERT INTO {0} ({1}, {2}, {3}, {4}, {5}) VALUES (?,?,?,?,?)"""\
                         .format(sqlite3io.SIMULATION_TABLE_NAME,
@@ -975,16 +1895,16 @@ class Simulation(object):
             # Get and set the simulation ID.
             self._db_sim_id = cur.lastrowid
             logger.debug("_db_sim_id = {0}".format(self._db_sim_id))
+            self._dbWriter = sqlite3io.NodeEventWriter(self._dbConnection,
+                                                       self._db_sim_id,
+                                                       self._dbBufferSize)
             # Now populate the state database with the initial graph states
+            stateIndex = self.process.stateIndex
             for nc in self.network.nodes_iter(data=True):
-                ncks = nc[1].keys()
-                cur.execute("""INSERT OR IGNORE INTO {0}({1}, {2}) VALUES ({3})"""\
-                            .format(sqlite3io.NODE_STATE_TABLE_NAME,
-                                    sqlite3io.NODE_STATE_TABLE_ID_COL,
-                                    ",".join(ncks),
-                                    ",".join(["?"]*(1+len(nc[1])))),
-                            [hash(self.process.deduceNodeState(nc))]+
-                            [nc[1][k] for k in ncks])
+                self._dbWriter.addState(stateIndex.digest(stateIndex.intern(
+                            self.process.deduceNodeState(nc))),
+                                        nc[1])
+            self._dbWriter.flush()
             self._dbConnection.commit()
         except sqlite3.OperationalError as sqlerr:
             logger.error("Could not open connection to database '{0}'.\n"\
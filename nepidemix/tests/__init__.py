@@ -0,0 +1,17 @@
+"""
+NepidemiX tests
+===============
+
+Unit tests of the NepidemiX package, written with the standard unittest
+module. Run all tests from the top directory of the distribution with::
+
+   python -m unittest discover -s nepidemix/tests -t .
+
+The simulation tests run small simulations in temporary directories,
+see `nepidemix.tests.common`.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
@@ -0,0 +1,304 @@
+"""
+Test utilities
+==============
+
+Helpers for running small seeded simulations in a temporary directory.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import networkx
+import numpy
+
+from nepidemix import engines
+from nepidemix.process import ScriptedProcess
+from nepidemix.simulation import Simulation
+from nepidemix.utilities import NepidemiXConfigParser
+
+# A scripted SIR process, with infection over edges to infected neighbours.
+SIR_PROCESS = """
+[NodeAttributes]
+state = S,I,R
+
+[NodeRules]
+{state:S} -> {state:I} = NN({state:I}) * beta
+{state:I} -> {state:R} = gamma
+
+[MeanFieldStates]
+{}
+"""
+
+# SIR where infection requires an active edge, and edges switch between
+# active and inactive depending on the state of their end nodes.
+EDGE_PROCESS = """
+[NodeAttributes]
+state = S,I,R
+
+[EdgeAttributes]
+active = y,n
+
+[NodeRules]
+{state:S} -> {state:I} = NN({state:I},{active:y}) * beta
+{state:I} -> {state:R} = gamma
+
+[EdgeRules]
+{active:y} -> {active:n} = delta + rho * NE({state:R})
+{active:n} -> {active:y} = eta * (2 - NE({state:I}))
+
+[MeanFieldStates]
+{}
+"""
+
+# SIR with an additional infection rate proportional to the fraction of
+# infected nodes in the network.
+MF_PROCESS = """
+[NodeAttributes]
+state = S,I,R
+
+[NodeRules]
+{state:S} -> {state:I} = NN({state:I}) * beta + MF({state:I}) * alpha
+{state:I} -> {state:R} = gamma
+
+[MeanFieldStates]
+{}
+"""
+
+
+class RewiringProcess(ScriptedProcess):
+    """
+    Scripted process whose network rule moves edges away from infected
+    nodes: with rate `rewire` a susceptible node drops its edge to an
+    infected neighbour and connects to a random node instead.
+
+    """
+    def __init__(self, **kwargs):
+        super(RewiringProcess, self).__init__(**kwargs)
+        self.runNetworkUpdate = True
+        self.constantTopology = False
+
+    def networkUpdateRule(self, network, dt):
+        nodes = network.nodes()
+        p = self.modelParameters['rewire'] * dt
+        for u, v in network.edges():
+            states = network.node[u]['state'], network.node[v]['state']
+            if sorted(states) != ['I', 'S'] or self.uniform() >= p:
+                continue
+            s = u if states[0] == 'S' else v
+            w = nodes[self.random.randint(len(nodes))]
+            if w != s and not network.has_edge(s, w):
+                network.remove_edge(u, v)
+                network.add_edge(s, w)
+        return network
+
+# Settings running `RewiringProcess`.
+REWIRING_OPTIONS = [('Simulation', 'process_class', 'RewiringProcess'),
+                    ('Simulation', 'process_class_module',
+                     'nepidemix.tests.common'),
+                    ('ProcessParameters', 'rewire', '0.5')]
+
+
+class ChronicProcess(ScriptedProcess):
+    """
+    Scripted process whose overloaded node rule keeps infected nodes
+    infected, whatever the scripted rules say.
+
+    """
+    def nodeUpdateRule(self, node, srcNetwork, dt):
+        if node[1]['state'] == 'I':
+            return node
+        return super(ChronicProcess, self).nodeUpdateRule(node, srcNetwork,
+                                                          dt)
+
+# Settings running `ChronicProcess`.
+CHRONIC_OPTIONS = [('Simulation', 'process_class', 'ChronicProcess'),
+                   ('Simulation', 'process_class_module',
+                    'nepidemix.tests.common')]
+
+
+def indexCaseNetwork(n, m):
+    """
+    Barabasi-Albert network of susceptible nodes, except for node 0 which is
+    infected.
+
+    """
+    network = networkx.barabasi_albert_graph(n, m)
+    for node in network:
+        network.node[node]['state'] = 'S'
+    network.node[0]['state'] = 'I'
+    return network
+
+# Settings running on `indexCaseNetwork` without node initialization.
+INDEX_CASE_OPTIONS = [('Simulation', 'network_func', 'indexCaseNetwork'),
+                      ('Simulation', 'network_func_module',
+                       'nepidemix.tests.common'),
+                      ('Simulation', 'node_init', 'no')]
+
+
+class SimulationTestCase(unittest.TestCase):
+    """
+    Test case running simulations with output to a temporary directory.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'nepidemix_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def settings(self, baseName, options = None,
+                 processDefinition = SIR_PROCESS):
+        """
+        Settings of a seeded SIR simulation on a 300 node Barabasi-Albert
+        network, run for 60 iterations with state counts saved every
+        iteration.
+
+        Parameters
+        ----------
+
+        baseName : str
+           Base name of the output files.
+
+        options : list, optional
+           List of (section, option, value) overriding the defaults.
+
+        processDefinition : str, optional
+           Contents of the process definition file. Default `SIR_PROCESS`.
+
+        Returns
+        -------
+
+        settings : nepidemix.utilities.NepidemiXConfigParser
+           The settings.
+
+        """
+        processFile = os.path.join(self.directory, baseName + '_process.ini')
+        with open(processFile, 'w') as fp:
+            fp.write(processDefinition)
+        settings = NepidemiXConfigParser()
+        defaults = [('Simulation', 'iterations', '60'),
+                    ('Simulation', 'dt', '0.1'),
+                    ('Simulation', 'process_class', 'ScriptedProcess'),
+                    ('Simulation', 'network_func', 'BA_networkx'),
+                    ('Simulation', 'seed', '1'),
+                    ('NetworkParameters', 'n', '300'),
+                    ('NetworkParameters', 'm', '2'),
+                    ('ProcessParameters', 'file', processFile),
+                    ('ProcessParameters', 'beta', '0.3'),
+                    ('ProcessParameters', 'gamma', '0.1'),
+                    ('ProcessParameters', 'alpha', '0.2'),
+                    ('NodeStateDistribution', '{state:S}', '0.9'),
+                    ('NodeStateDistribution', '{state:I}', '0.1'),
+                    ('NodeStateDistribution', '{state:R}', '0'),
+                    ('Output', 'output_dir', self.directory),
+                    ('Output', 'base_name', baseName),
+                    ('Output', 'unique', 'no'),
+                    ('Output', 'save_config', 'no'),
+                    ('Output', 'save_state_count', 'yes'),
+                    ('Output', 'save_state_count_interval', '1'),
+                    ('Output', 'save_network', 'no'),
+                    ('Output', 'print_progress_bar', 'no')]
+        for section, option, value in defaults + list(options or []):
+            if not settings.has_section(section):
+                settings.add_section(section)
+            settings.set(section, option, value)
+        return settings
+
+    def simulate(self, baseName, options = None,
+                 processDefinition = SIR_PROCESS):
+        """
+        Configure, execute and save a simulation with the settings of
+        `settings`.
+
+        Returns
+        -------
+
+        simulation : nepidemix.simulation.Simulation
+           The simulation.
+
+        """
+        simulation = Simulation()
+        simulation.configure(self.settings(baseName, options,
+                                           processDefinition))
+        simulation.execute()
+        simulation.saveData()
+        return simulation
+
+    def simulateEngine(self, baseName, options = None,
+                       processDefinition = SIR_PROCESS):
+        """
+        As `simulate`, but also return the engine object that ran the
+        simulation.
+
+        Returns
+        -------
+
+        simulation : nepidemix.simulation.Simulation
+           The simulation.
+
+        engine : object
+           The engine.
+
+        """
+        simulation = Simulation()
+        simulation.configure(self.settings(baseName, options,
+                                           processDefinition))
+        name = simulation.engineName
+        created = []
+        def create(sim):
+            created.append(engineClass(sim))
+            return created[-1]
+        engineClass = engines.ENGINES[name]
+        engines.ENGINES[name] = create
+        try:
+            simulation.execute()
+        finally:
+            engines.ENGINES[name] = engineClass
+        simulation.saveData()
+        return simulation, created[0]
+
+    def outputFile(self, name):
+        """
+        Full path of output file `name`.
+
+        """
+        return os.path.join(self.directory, name)
+
+    def readFile(self, name):
+        """
+        Contents of output file `name`.
+
+        """
+        with open(self.outputFile(name), 'rb') as fp:
+            return fp.read()
+
+    def finalCounts(self, baseName):
+        """
+        The state counts of the last row of the state count file of
+        `baseName`, keyed by the column headers.
+
+        """
+        with open(self.outputFile(baseName + '_state_count.csv'), 'rb') as fp:
+            rows = [row for row in csv.reader(fp)]
+        return dict(zip(rows[0], [float(v) for v in rows[-1]]))
+
+    def assertSameMean(self, a, b, sigmas = 4.0):
+        """
+        Assert that the samples `a` and `b` have means that do not differ by
+        more than `sigmas` standard errors of the difference.
+
+        """
+        a = numpy.asarray(a, dtype = float)
+        b = numpy.asarray(b, dtype = float)
+        se = numpy.sqrt(a.var(ddof = 1) / len(a) + b.var(ddof = 1) / len(b))
+        self.assertLessEqual(abs(a.mean() - b.mean()), sigmas * se,
+                             "Means {0} and {1} differ by more than {2} standard errors ({3})."\
+                                 .format(a.mean(), b.mean(), sigmas, se))
@@ -0,0 +1,133 @@
+"""
+Tests of simulation checkpoints.
+
+A simulation interrupted after a checkpoint and resumed from it must give the
+same output as an uninterrupted run.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import sqlite3
+import unittest
+
+import networkx
+
+from nepidemix.simulation import Simulation
+from nepidemix.utilities.dbio import sqlite3io
+from nepidemix.tests.common import SimulationTestCase
+from nepidemix.tests.test_earlystop import ABSORBING_OPTIONS
+
+
+class _Interrupt(Exception):
+    pass
+
+
+class CheckpointTest(SimulationTestCase):
+
+    def interrupt(self, options, iteration):
+        """
+        Run the simulation 'resumed' with `options`, raising after
+        `iteration`, and resume it from its checkpoint.
+
+        """
+        simulation = Simulation()
+        simulation.configure(self.settings('resumed', options))
+        endOfIteration = simulation._endOfIteration
+        def interrupted(it):
+            stop = endOfIteration(it)
+            if it == iteration:
+                raise _Interrupt()
+            return stop
+        simulation._endOfIteration = interrupted
+        self.assertRaises(_Interrupt, simulation.execute)
+        # As if the process had died, releasing the database.
+        if simulation._dbConnection != None:
+            simulation._dbConnection.close()
+        resumed = Simulation.resume(self.outputFile('resumed.checkpoint'))
+        resumed.execute()
+        resumed.saveData()
+        return resumed
+
+    def assertResumedEqual(self, options, interval = 10, iteration = 24):
+        options = [('Output', 'checkpoint_interval', str(interval))] + options
+        full = self.simulate('full', options)
+        resumed = self.interrupt(options, iteration)
+        self.assertEqual(self.readFile('full_state_count.csv'),
+                         self.readFile('resumed_state_count.csv'))
+        self.assertEqual(full.stopIteration, resumed.stopIteration)
+        return resumed
+
+    def test_networkx(self):
+        self.assertResumedEqual([('Simulation', 'engine', 'networkx')])
+
+    def test_array(self):
+        self.assertResumedEqual([('Simulation', 'engine', 'array')])
+
+    def test_streamed(self):
+        self.assertResumedEqual([('Simulation', 'engine', 'array'),
+                                 ('Output', 'stream_state_count', 'yes'),
+                                 ('Output', 'stream_flush_interval', '7')])
+
+    def test_stopped(self):
+        # The stationarity test has counted samples at the checkpoint.
+        resumed = self.assertResumedEqual([('Simulation', 'engine', 'array'),
+                                           ('Simulation', 'stop_stationary',
+                                            '3'),
+                                           ('Output', 'stop_output', 'pad'),
+                                           ('Output',
+                                            'save_state_count_interval', '5')]
+                                          + ABSORBING_OPTIONS, 5, 12)
+        self.assertNotEqual(resumed.stopIteration, None)
+
+    def test_networks(self):
+        options = [('Simulation', 'engine', 'array'),
+                   ('Output', 'save_network', 'yes'),
+                   ('Output', 'save_network_interval', '20')]
+        self.assertResumedEqual(options)
+        for number in [0, 20, 40, 60]:
+            name = '_{0:010d}.gpickle.bz2'.format(number)
+            full = networkx.read_gpickle(self.outputFile('full' + name))
+            resumed = networkx.read_gpickle(self.outputFile('resumed' + name))
+            self.assertEqual(sorted(full.nodes(data = True)),
+                             sorted(resumed.nodes(data = True)))
+            self.assertEqual(sorted(full.edges(data = True)),
+                             sorted(resumed.edges(data = True)))
+            self.assertEqual(full.graph, resumed.graph)
+
+    def test_database(self):
+        options = [('Output', 'checkpoint_interval', '10'),
+                   ('Simulation', 'engine', 'array')]
+        self.simulate('full', options + [('Output', 'db_name',
+                                          self.outputFile('full.db'))])
+        self.interrupt(options + [('Output', 'db_name',
+                                   self.outputFile('resumed.db'))], 24)
+        events = "SELECT {0}, {1}, {2}, {3}, {4}, {5} FROM {6} ORDER BY {4}, {5}, {2}"\
+            .format(sqlite3io.NODE_EVENT_TABLE_SRC_STATE_COL,
+                    sqlite3io.NODE_EVENT_TABLE_DST_STATE_COL,
+                    sqlite3io.NODE_EVENT_TABLE_NODE_ID_COL,
+                    sqlite3io.NODE_EVENT_TABLE_SIM_TIME_COL,
+                    sqlite3io.NODE_EVENT_TABLE_MAJOR_IT_COL,
+                    sqlite3io.NODE_EVENT_TABLE_MINOR_IT_COL,
+                    sqlite3io.NODE_EVENT_TABLE_NAME)
+        states = "SELECT * FROM {0} ORDER BY {1}"\
+            .format(sqlite3io.NODE_STATE_TABLE_NAME,
+                    sqlite3io.NODE_STATE_TABLE_ID_COL)
+        simulations = "SELECT COUNT(*) FROM {0}"\
+            .format(sqlite3io.SIMULATION_TABLE_NAME)
+        contents = []
+        for name in ['full.db', 'resumed.db']:
+            connection = sqlite3.connect(self.outputFile(name))
+            try:
+                contents.append([connection.execute(query).fetchall()
+                                 for query in [events, states, simulations]])
+            finally:
+                connection.close()
+        self.assertTrue(len(contents[0][0]) > 0)
+        self.assertEqual(contents[0], contents[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Tests of running cluster projects on the local machine.
+
+Every configuration and repetition of a project must be run once, completed
+jobs must be recorded in the ledger and skipped when the project is run again,
+and failed jobs must be retried.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import os
+import unittest
+
+from nepidemix import cluster
+from nepidemix.cluster import ClusterSimulation, runProject
+from nepidemix.tests.common import SimulationTestCase
+
+# The job function of runProject.
+_runJob = cluster._runJob
+
+
+def _failFirstAttempt(job):
+    """
+    Run `job` as `cluster._runJob`, except that the first attempt of
+    configuration 1, repetition 1 fails.
+
+    """
+    marker = os.path.join(job[2], 'attempted')
+    if job[:2] == (1, 1) and not os.path.exists(marker):
+        open(marker, 'w').close()
+        return job, "RuntimeError: first attempt"
+    return _runJob(job)
+
+
+class RunProjectTest(SimulationTestCase):
+
+    def setUp(self):
+        SimulationTestCase.setUp(self)
+        settings = self.settings('sir', [('Simulation', 'engine', 'array'),
+                                         ('Simulation', 'iterations', '10'),
+                                         ('ProcessParameters', 'beta',
+                                          '0.2, 0.4'),
+                                         ('Output', 'output_dir', '.')])
+        settings.add_section(ClusterSimulation.CFG_SECTION_CLUSTER)
+        settings.set(ClusterSimulation.CFG_SECTION_CLUSTER,
+                     ClusterSimulation.CFG_PARAM_root_dir, self.directory)
+        settings.set(ClusterSimulation.CFG_SECTION_CLUSTER,
+                     ClusterSimulation.CFG_PARAM_project, 'project')
+        settings.set(ClusterSimulation.CFG_SECTION_CLUSTER,
+                     ClusterSimulation.CFG_PARAM_repeats, '2')
+        settings.add_section(ClusterSimulation.CFG_SECTION_PBS)
+        settings.set(ClusterSimulation.CFG_SECTION_PBS,
+                     ClusterSimulation.CFG_PARAM_email, 'nobody@localhost')
+        ClusterSimulation(settings).createSimulationConfigs()
+        self.projectDir = self.outputFile('project')
+
+    def output(self, config, rep):
+        return os.path.join(self.projectDir,
+                            'conf_combination_{0}'.format(config),
+                            'sir_r{0}_state_count.csv'.format(rep))
+
+    def ledger(self):
+        with open(os.path.join(self.projectDir,
+                               ClusterSimulation.ledger_file_name)) as fp:
+            return sorted([tuple([int(f) for f in line.split()])
+                           for line in fp])
+
+    def test_run(self):
+        self.assertEqual(runProject(self.projectDir, processes = 2), [])
+        jobs = [(0, 0), (0, 1), (1, 0), (1, 1)]
+        self.assertEqual(self.ledger(), jobs)
+        for config, rep in jobs:
+            self.assertTrue(os.path.isfile(self.output(config, rep)))
+
+    def test_resume(self):
+        with open(os.path.join(self.projectDir,
+                               ClusterSimulation.ledger_file_name), 'w') as fp:
+            fp.write("0 1\n")
+        self.assertEqual(runProject(self.projectDir, processes = 2), [])
+        self.assertFalse(os.path.exists(self.output(0, 1)))
+        self.assertEqual(self.ledger(), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        # Nothing is left to run.
+        os.remove(self.output(1, 0))
+        self.assertEqual(runProject(self.projectDir, processes = 2), [])
+        self.assertFalse(os.path.exists(self.output(1, 0)))
+
+    def test_retry(self):
+        cluster._runJob = _failFirstAttempt
+        try:
+            self.assertEqual(runProject(self.projectDir, processes = 2,
+                                        retries = 0), [(1, 1)])
+            self.assertEqual(self.ledger(), [(0, 0), (0, 1), (1, 0)])
+            self.assertEqual(runProject(self.projectDir, processes = 2), [])
+            self.assertEqual(self.ledger(), [(0, 0), (0, 1), (1, 0), (1, 1)])
+            os.remove(os.path.join(self.projectDir, 'conf_combination_1',
+                                   'attempted'))
+            os.remove(os.path.join(self.projectDir,
+                                   ClusterSimulation.ledger_file_name))
+            self.assertEqual(runProject(self.projectDir, processes = 2,
+                                        retries = 1), [])
+            self.assertEqual(self.ledger(), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        finally:
+            cluster._runJob = _runJob
+
+
+if __name__ == '__main__':
+    unittest.main()
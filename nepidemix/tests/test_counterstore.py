@@ -0,0 +1,152 @@
+"""
+Tests of the counter store.
+
+Changing counters through a view must give the same counts as the linked
+counters the store was built from, partial counts must be the sums of their
+member leaf counts, and the two buffers must only be made equal by a commit.
+Counters read by position must equal those read by label.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import copy
+import cPickle
+import unittest
+from collections import OrderedDict
+
+import numpy
+
+from nepidemix.utilities import CounterStore, LinkedCounter
+from nepidemix.tests.common import SimulationTestCase, MF_PROCESS
+
+S = frozenset([('state', 'S')])
+I = frozenset([('state', 'I')])
+R = frozenset([('state', 'R')])
+ALL = frozenset()
+
+
+def counters():
+    """
+    Linked counters of an SIR process with I as mean field state, declared
+    as the processes do.
+
+    """
+    total = LinkedCounter(10)
+    infected = LinkedCounter(3)
+    result = OrderedDict()
+    result[ALL] = total
+    result[I.union([('mf', 'I')])] = infected
+    result[S] = LinkedCounter(7, [total])
+    result[I] = LinkedCounter(3, [total, infected])
+    result[R] = LinkedCounter(0, [total])
+    return result
+
+
+def changes(counts):
+    """
+    Apply a sequence of changes to the dictionary like `counts`.
+
+    """
+    for src, dst in [(S, I), (S, I), (I, R), (S, I)]:
+        counts[src] -= 1
+        counts[dst] += 1
+    counts[R] += 2
+    counts[I.union([('mf', 'I')])] -= 1
+
+
+def values(counts):
+    return [(label, int(v)) for label, v in counts.items()]
+
+
+class CounterStoreTest(unittest.TestCase):
+
+    def test_links(self):
+        expected = counters()
+        changes(expected)
+        view = CounterStore(counters()).views[0]
+        changes(view)
+        self.assertEqual(values(view), values(expected))
+        self.assertEqual(view.keys(), expected.keys())
+        self.assertEqual(len(view), len(expected))
+        self.assertTrue(R in view)
+        self.assertEqual(view.get(frozenset([('state', 'X')]), -1), -1)
+
+    def test_membership(self):
+        # Leaves 0 to 4, and partial counters over overlapping leaf sets.
+        members = [[0, 1], [1, 2, 3], [0, 1, 2, 3, 4], [4]]
+        partials = [LinkedCounter(0) for m in members]
+        counts = OrderedDict()
+        for p, c in enumerate(partials):
+            counts[('partial', p)] = c
+        for i in range(5):
+            counts[('leaf', i)] = LinkedCounter(0, [partials[p] for p, m in
+                                                    enumerate(members)
+                                                    if i in m])
+        store = CounterStore(counts)
+        self.assertEqual((store.numLeaves, store.numPartials), (5, 4))
+        view = store.views[0]
+        rng = numpy.random.RandomState(1)
+        for leaves in rng.randint(0, 100, (10, 5)):
+            for i, value in enumerate(leaves):
+                view[('leaf', i)] = value
+            for p, m in enumerate(members):
+                self.assertEqual(view[('partial', p)], leaves[m].sum())
+
+    def test_positions(self):
+        store = CounterStore(counters())
+        view = store.views[0]
+        changes(view)
+        labels = view.keys() + [frozenset([('state', 'X')])]
+        positions = store.positions(labels)
+        self.assertEqual(positions[-1], -1)
+        self.assertEqual(sorted(positions[:-1].tolist()),
+                         range(len(view)))
+        self.assertEqual([view.count(p) for p in positions[:-1]],
+                         [v for label, v in values(view)])
+
+    def test_commit(self):
+        store = CounterStore(counters())
+        first, second = store.views
+        initial = values(second)
+        changes(first)
+        self.assertEqual(values(second), initial)
+        self.assertTrue(store.commit(first) is second)
+        self.assertEqual(values(second), values(first))
+        changed = values(second)
+        second[S] -= 1
+        second[I] += 1
+        self.assertEqual(values(first), changed)
+        self.assertTrue(store.commit(second) is first)
+        self.assertEqual(values(first), values(second))
+
+    def test_pickle(self):
+        view = CounterStore(counters()).views[1]
+        changes(view)
+        expected = OrderedDict(values(view))
+        for restored in [cPickle.loads(cPickle.dumps(view, 2)),
+                         copy.deepcopy(view)]:
+            self.assertEqual(type(restored), OrderedDict)
+            self.assertEqual(values(restored), values(expected))
+
+
+class MeanFieldTest(SimulationTestCase):
+
+    def test_positions(self):
+        simulation = self.simulate('mf', [('Simulation', 'engine',
+                                           'networkx')], MF_PROCESS)
+        process = simulation.process
+        counts = simulation.network.graph['state_count']
+        process._currentMeanField = counts
+        # MF with a constant state reads the store by position.
+        self.assertTrue(process._meanFieldStore is simulation._counterStore)
+        self.assertEqual([process._MFlookup(i)
+                          for i in range(len(process.meanFieldKeys))],
+                         [counts[key] / float(len(simulation.network))
+                          for key in process.meanFieldKeys])
+
+
+if __name__ == '__main__':
+    unittest.main()
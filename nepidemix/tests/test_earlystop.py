@@ -0,0 +1,91 @@
+"""
+Tests of stopping simulations early.
+
+A simulation stopped early and padded must write the same state counts as a
+full run, and a truncated one a prefix of them.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import csv
+import unittest
+
+from nepidemix.tests.common import SimulationTestCase
+
+I_LABEL = str(frozenset([('state', 'I')]))
+
+# Infection dies out well before the last iteration.
+ABSORBING_OPTIONS = [('Simulation', 'dt', '1.0'),
+                     ('ProcessParameters', 'beta', '0.05'),
+                     ('ProcessParameters', 'gamma', '0.8')]
+
+
+class EarlyStopTest(SimulationTestCase):
+
+    def rows(self, baseName):
+        return self.readFile(baseName + '_state_count.csv').splitlines()
+
+    def assertStopped(self, stopOptions, engine, interval = 1):
+        """
+        Run with the stopping conditions `stopOptions` and stop_output
+        truncate and pad, and compare to a full run. Returns the iteration
+        stopped after.
+
+        """
+        options = [('Simulation', 'engine', engine),
+                   ('Output', 'save_state_count_interval', str(interval))] \
+                   + ABSORBING_OPTIONS
+        self.assertEqual(self.simulate('full', options).stopIteration, None)
+        options = options + stopOptions
+        padded = self.simulate('padded', options + [('Output', 'stop_output',
+                                                     'pad')])
+        truncated = self.simulate('truncated', options)
+        self.assertNotEqual(padded.stopIteration, None)
+        self.assertEqual(padded.stopIteration, truncated.stopIteration)
+        self.assertLess(padded.stopIteration, 60)
+        self.assertEqual(self.readFile('full_state_count.csv'),
+                         self.readFile('padded_state_count.csv'))
+        # Header, initial sample and the samples up to the stop, followed by
+        # a final sample if the stop is not on a sample.
+        n = padded.stopIteration / interval + 2
+        rows = self.rows('truncated')
+        self.assertEqual(rows[:n], self.rows('full')[:n])
+        self.assertEqual(len(rows),
+                         n + int(padded.stopIteration % interval != 0))
+        return padded.stopIteration
+
+    def test_absorbed(self):
+        for engine in ['networkx', 'array']:
+            self.assertStopped([('Simulation', 'stop_when_absorbed', 'yes')],
+                               engine)
+            self.assertEqual(self.finalCounts('truncated')[I_LABEL], 0)
+
+    def test_absorbedInterval(self):
+        stops = [self.assertStopped([('Simulation', 'stop_when_absorbed',
+                                      'yes')], 'array', interval)
+                 for interval in [3, 4, 7]]
+        # Stops between samples are covered.
+        self.assertNotEqual([it % i for it, i in zip(stops, [3, 4, 7])],
+                            [0, 0, 0])
+
+    def test_stateZero(self):
+        self.assertStopped([('Simulation', 'stop_state_zero', '{state:I}')],
+                           'array')
+        self.assertEqual(self.finalCounts('truncated')[I_LABEL], 0)
+        with open(self.outputFile('truncated_state_count.csv'), 'rb') as fp:
+            rows = [row for row in csv.reader(fp)]
+        column = rows[0].index(I_LABEL)
+        self.assertNotIn('0', [row[column] for row in rows[1:-1]])
+
+    def test_stationary(self):
+        it = self.assertStopped([('Simulation', 'stop_stationary', '3')],
+                                'array', interval = 5)
+        self.assertEqual(it % 5, 0)
+        self.assertEqual(self.finalCounts('truncated')[I_LABEL], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Tests of the simulation engines.
+
+The engines using compiled rules draw their random numbers in another order
+than the networkx loop, so their results are compared statistically: the
+mean final state counts over a number of seeds must agree with those of the
+networkx loop.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import unittest
+
+from nepidemix.simulation import Simulation
+from nepidemix.tests.common import SimulationTestCase, SIR_PROCESS, \
+    MF_PROCESS, EDGE_PROCESS, REWIRING_OPTIONS, CHRONIC_OPTIONS
+
+R_LABEL = str(frozenset([('state', 'R')]))
+
+# Number of seeded runs per engine.
+NUM_SEEDS = 16
+
+# A larger network and a longer run than the defaults, so that a change of
+# the infection rate by a third is detected.
+SIZE_OPTIONS = [('NetworkParameters', 'n', '600'),
+                ('Simulation', 'iterations', '100')]
+
+
+class EngineAgreementTest(SimulationTestCase):
+
+    # Final sizes of finished runs, keyed by settings, shared by the tests.
+    _finalSizes = {}
+
+    def finalSizes(self, options, processDefinition = SIR_PROCESS,
+                   label = R_LABEL):
+        """
+        Final count of `label` of every seed, for the settings `options`.
+
+        """
+        key = (tuple(options), processDefinition, label)
+        if key in self._finalSizes:
+            return self._finalSizes[key]
+        sizes = []
+        for seed in range(1, NUM_SEEDS + 1):
+            baseName = 'run{0}'.format(seed)
+            opts = SIZE_OPTIONS + [('Simulation', 'seed', str(seed))] + options
+            self.simulate(baseName, opts, processDefinition)
+            sizes.append(self.finalCounts(baseName)[label])
+        self._finalSizes[key] = sizes
+        return sizes
+
+    def test_array(self):
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')])
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine', 'array')]))
+
+    def test_leapFlatRules(self):
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')])
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine', 'array'),
+                                             ('Simulation', 'leap_flat_rules',
+                                              'yes')]))
+
+    def test_parallel(self):
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')])
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine',
+                                              'parallel'),
+                                             ('Simulation', 'workers', '2')]))
+
+    def test_parallelMeanField(self):
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')],
+                                    MF_PROCESS)
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine',
+                                              'parallel'),
+                                             ('Simulation', 'workers', '2')],
+                                            MF_PROCESS))
+
+    def test_parallelClosed(self):
+        simulation, engine = self.simulateEngine('closed',
+                                                 [('Simulation', 'engine',
+                                                   'parallel'),
+                                                  ('Simulation', 'workers',
+                                                   '2')])
+        # No view of the closed shared network is left.
+        self.assertEqual(engine.sharedNetwork.states, None)
+        kernel = engine.kernel
+        for views in [(engine.arrayNetwork, engine.states),
+                      (kernel.arrayNetwork, kernel._rindptr, kernel._rindices,
+                       kernel._states)]:
+            self.assertEqual(views, (None,) * len(views))
+
+    def test_meanField(self):
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')],
+                                    MF_PROCESS)
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine', 'array')],
+                                            MF_PROCESS))
+
+    def test_edgeRules(self):
+        options = [('ProcessParameters', 'delta', '0.05'),
+                   ('ProcessParameters', 'rho', '0.2'),
+                   ('ProcessParameters', 'eta', '0.05'),
+                   ('EdgeStateDistribution', '{active:y}', '0.5'),
+                   ('EdgeStateDistribution', '{active:n}', '0.5')]
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')]
+                                    + options, EDGE_PROCESS)
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine', 'array')]
+                                            + options, EDGE_PROCESS))
+
+    def test_dynamic(self):
+        reference = self.finalSizes([('Simulation', 'engine', 'networkx')]
+                                    + REWIRING_OPTIONS)
+        self.assertSameMean(reference,
+                            self.finalSizes([('Simulation', 'engine',
+                                              'dynamic')] + REWIRING_OPTIONS))
+
+    def test_overloadedRules(self):
+        # The overloaded node rule is not replaced by a compiled kernel.
+        simulation, engine = self.simulateEngine('chronic',
+                                                 [('Simulation', 'engine',
+                                                   'array')]
+                                                 + CHRONIC_OPTIONS)
+        self.assertEqual(engine.kernel, None)
+        self.assertEqual(self.finalCounts('chronic')[R_LABEL], 0)
+
+    def test_reproducible(self):
+        for engine in ['networkx', 'array']:
+            self.simulate('first', [('Simulation', 'engine', engine)])
+            self.simulate('second', [('Simulation', 'engine', engine)])
+            self.assertEqual(self.readFile('first_state_count.csv'),
+                             self.readFile('second_state_count.csv'))
+
+    def test_repetitions(self):
+        # Repetitions configured from one settings object without a seed,
+        # as by nepidemix_runsimulation.
+        settings = self.settings('rep', [('Simulation', 'engine', 'array')])
+        settings.remove_option('Simulation', 'seed')
+        seeds = []
+        outputs = []
+        for r in range(2):
+            simulation = Simulation()
+            simulation.configure(settings)
+            simulation.execute()
+            simulation.saveData()
+            self.assertFalse(settings.has_option('Simulation', 'seed'))
+            seeds.append(settings.getint('Info', 'seed'))
+            self.assertEqual(seeds[-1], simulation.randomStreams.seed)
+            outputs.append(self.readFile('rep_state_count.csv'))
+        self.assertNotEqual(seeds[0], seeds[1])
+        self.assertNotEqual(outputs[0], outputs[1])
+        # The recorded seed repeats the run.
+        self.simulate('repeated', [('Simulation', 'engine', 'array'),
+                                   ('Simulation', 'seed', str(seeds[1]))])
+        self.assertEqual(self.readFile('repeated_state_count.csv'),
+                         outputs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Tests of the ensemble engine.
+
+Replicate 0 is written to the ordinary output, the statistics files must
+summarize the replicate file, and the replicates must agree in distribution
+with separate runs of the array engine.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import csv
+import unittest
+
+import numpy
+
+from nepidemix.engines import EnsembleEngine
+from nepidemix.simulation import Simulation
+from nepidemix.utilities import networkxtra
+from nepidemix.tests.common import SimulationTestCase, INDEX_CASE_OPTIONS
+
+R_LABEL = str(frozenset([('state', 'R')]))
+
+NUM_REPLICATES = 24
+
+ENSEMBLE_OPTIONS = [('Simulation', 'engine', 'ensemble'),
+                    ('Simulation', 'replicates', str(NUM_REPLICATES))]
+
+
+class EnsembleTest(SimulationTestCase):
+
+    def readCsv(self, name):
+        with open(self.outputFile(name), 'rb') as fp:
+            return [row for row in csv.reader(fp)]
+
+    def test_outputs(self):
+        self.simulate('ensemble', ENSEMBLE_OPTIONS)
+        counts = self.readCsv('ensemble_state_count.csv')
+        replicates = self.readCsv('ensemble_state_count_replicates.csv')
+        self.assertEqual(replicates[0], ['Replicate'] + counts[0])
+        self.assertEqual(len(replicates) - 1,
+                         NUM_REPLICATES * (len(counts) - 1))
+        data = numpy.array([[float(v) for v in row[2:]]
+                            for row in replicates[1:]])\
+                            .reshape((NUM_REPLICATES, len(counts) - 1, -1))
+        self.assertEqual(data[0].tolist(),
+                         [[float(v) for v in row[1:]] for row in counts[1:]])
+        for statName, stat in [('mean', data.mean(axis = 0)),
+                               ('var', data.var(axis = 0)),
+                               ('q50', numpy.percentile(data, 50, axis = 0))]:
+            rows = self.readCsv('ensemble_state_count_{0}.csv'\
+                                    .format(statName))
+            self.assertEqual(rows[0], counts[0])
+            numpy.testing.assert_allclose([[float(v) for v in row[1:]]
+                                           for row in rows[1:]], stat)
+
+    def test_agreement(self):
+        self.simulate('ensemble', ENSEMBLE_OPTIONS)
+        rows = self.readCsv('ensemble_state_count_replicates.csv')
+        column = rows[0].index(R_LABEL)
+        last = rows[-1][1]
+        ensemble = [float(row[column]) for row in rows[1:] if row[1] == last]
+        self.assertEqual(len(ensemble), NUM_REPLICATES)
+        separate = []
+        for seed in range(1, NUM_REPLICATES + 1):
+            self.simulate('array', [('Simulation', 'engine', 'array'),
+                                    ('Simulation', 'seed', str(seed))])
+            separate.append(self.finalCounts('array')[R_LABEL])
+        self.assertSameMean(separate, ensemble)
+
+    def initialStates(self, options):
+        """
+        Initial node state ids of the replicates of an ensemble engine, as
+        an array of shape (replicates, nodes), and the state index.
+
+        """
+        simulation = Simulation()
+        simulation.configure(self.settings('initial', ENSEMBLE_OPTIONS
+                                           + options))
+        engine = EnsembleEngine(simulation)
+        return engine.readStates.reshape((NUM_REPLICATES, -1)), \
+            engine.stateIndex
+
+    def test_initialization(self):
+        # Dealt states: every replicate is dealt the configured distribution.
+        states, stateIndex = self.initialStates(
+            [('NodeStateDistribution', '{state:S}', '290'),
+             ('NodeStateDistribution', '{state:I}', '10'),
+             ('NodeStateDistribution', 'deal_exact', 'yes')])
+        infected = stateIndex.intern(frozenset([('state', 'I')]))
+        self.assertEqual((states == infected).sum(axis = 1).tolist(),
+                         [10] * NUM_REPLICATES)
+        self.assertGreater(len(set(tuple(numpy.flatnonzero(row == infected))
+                                   for row in states)), 1)
+        # States placed by the network are kept in every replicate.
+        states, stateIndex = self.initialStates(INDEX_CASE_OPTIONS)
+        infected = stateIndex.intern(frozenset([('state', 'I')]))
+        self.assertEqual((states == infected).sum(axis = 1).tolist(),
+                         [1] * NUM_REPLICATES)
+        self.assertTrue((states == states[0]).all())
+
+    def test_countLabels(self):
+        simulation, engine = self.simulateEngine('ensemble', ENSEMBLE_OPTIONS)
+        labels = simulation.network.graph['state_count'].keys()
+        def expected(labels):
+            states = engine.stateIndex.states
+            return [[sum(engine.stateCounts[r, sid]
+                         for sid in range(engine.stateCounts.shape[1])
+                         if networkxtra.matchDictAttributes(dict(states[sid]),
+                                                            dict(label)))
+                     for label in labels]
+                    for r in range(NUM_REPLICATES)]
+        self.assertEqual(engine._countLabels(labels).tolist(),
+                         expected(labels))
+        # A new state is added to the cached matches.
+        sid = engine.stateIndex.intern(frozenset([('state', 'X')]))
+        engine._countTransitions(numpy.array([1]), engine.readStates[:1],
+                                 numpy.array([sid]))
+        self.assertEqual(engine._countLabels(labels).tolist(),
+                         expected(labels))
+        self.assertEqual(engine._labelMatch.shape, (sid + 1, len(labels)))
+        self.assertEqual(engine._countLabels(labels[1:]).tolist(),
+                         expected(labels[1:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Tests of the Gillespie engine.
+
+The engine simulates the process in continuous time, and dt only sets the
+sampling points. The distribution of the state at a given time must thus not
+depend on dt, also for rules referring to MF, whose rates change with every
+transition.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import unittest
+
+import numpy
+
+from nepidemix.engines.gillespieengine import PropensityTree
+from nepidemix.tests.common import SimulationTestCase, SIR_PROCESS, \
+    MF_PROCESS
+
+R_LABEL = str(frozenset([('state', 'R')]))
+
+# Number of seeded runs per sampling interval.
+NUM_SEEDS = 24
+
+
+class PropensityTreeTest(unittest.TestCase):
+
+    def test_sample(self):
+        weights = numpy.array([0.5, 0.0, 2.0, 1.0, 0.0])
+        tree = PropensityTree(len(weights))
+        tree.update(numpy.arange(len(weights)), weights)
+        self.assertEqual(tree.total(), weights.sum())
+        self.assertEqual([tree.sample(x) for x in [0.0, 0.4, 0.5, 2.4, 2.5,
+                                                   3.4]],
+                         [0, 0, 2, 2, 3, 3])
+        tree.update(numpy.array([0, 3]), numpy.array([0.0, 0.25]))
+        self.assertEqual(tree.total(), 2.25)
+        self.assertEqual([tree.sample(x) for x in [0.0, 1.9, 2.0, 2.2]],
+                         [2, 2, 3, 3])
+
+
+class SamplingIntervalTest(SimulationTestCase):
+
+    def finalSizes(self, dt, iterations, processDefinition, options = []):
+        """
+        Count of R at time dt * iterations of every seed.
+
+        """
+        sizes = []
+        for seed in range(1, NUM_SEEDS + 1):
+            self.simulate('run', [('Simulation', 'engine', 'gillespie'),
+                                  ('Simulation', 'seed', str(seed)),
+                                  ('Simulation', 'dt', dt),
+                                  ('Simulation', 'iterations', iterations)]
+                          + options, processDefinition)
+            sizes.append(self.finalCounts('run')[R_LABEL])
+        return sizes
+
+    def test_neighbours(self):
+        self.assertSameMean(self.finalSizes('0.1', '60', SIR_PROCESS),
+                            self.finalSizes('2.0', '3', SIR_PROCESS))
+
+    def test_meanField(self):
+        # Infection mostly through the mean field.
+        options = [('ProcessParameters', 'beta', '0.05'),
+                   ('ProcessParameters', 'alpha', '1.5')]
+        self.assertSameMean(self.finalSizes('0.1', '60', MF_PROCESS, options),
+                            self.finalSizes('2.0', '3', MF_PROCESS, options))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Tests of the delta encoded network snapshots.
+
+Networks read back from a delta snapshot log must equal those saved as full
+gpickle files.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import unittest
+
+import networkx
+
+from nepidemix.utilities import DeltaSnapshotWriter, DeltaSnapshotReader
+from nepidemix.tests.common import SimulationTestCase
+
+
+class DeltaSnapshotTest(SimulationTestCase):
+
+    def assertNetworkEqual(self, a, b):
+        self.assertEqual(sorted(a.nodes(data = True)),
+                         sorted(b.nodes(data = True)))
+        self.assertEqual(sorted(a.edges(data = True)),
+                         sorted(b.edges(data = True)))
+        self.assertEqual(a.graph, b.graph)
+
+    def test_roundTrip(self):
+        network = networkx.path_graph(5)
+        for n in network.nodes():
+            network.node[n]['state'] = 'S'
+        network.graph['time'] = 0.0
+        writer = DeltaSnapshotWriter(self.outputFile('log.delta'),
+                                     self.outputFile('topology.gpickle'),
+                                     network)
+        saved = {}
+        for number, (node, state) in enumerate([(None, None), (2, 'I'),
+                                                 (3, 'I'), (2, 'R'),
+                                                 (None, None)]):
+            if node != None:
+                network.node[node] = {'state' : state, 'extra' : number}
+            network.graph['time'] = float(number)
+            writer.write(number * 10, network)
+            networkx.write_gpickle(network,
+                                   self.outputFile('{0}.gpickle'.format(number)))
+            saved[number * 10] = self.outputFile('{0}.gpickle'.format(number))
+        writer.close()
+        reader = DeltaSnapshotReader(self.outputFile('log.delta'))
+        self.assertEqual(reader.numbers, [0, 10, 20, 30, 40])
+        read = 0
+        for number, restored in reader:
+            self.assertNetworkEqual(networkx.read_gpickle(saved[number]),
+                                    restored)
+            read += 1
+        self.assertEqual(read, 5)
+        self.assertNetworkEqual(networkx.read_gpickle(saved[20]),
+                                reader.network(20))
+        reader.close()
+
+    def test_simulation(self):
+        options = [('Simulation', 'engine', 'array'),
+                   ('Output', 'save_network', 'yes'),
+                   ('Output', 'save_network_interval', '15')]
+        self.simulate('full', options)
+        self.simulate('delta', options + [('Output', 'save_network_format',
+                                           'delta')])
+        reader = DeltaSnapshotReader(self.outputFile('delta.delta'))
+        self.assertEqual(reader.numbers, [0, 15, 30, 45, 60])
+        for number, restored in reader:
+            self.assertNetworkEqual(networkx.read_gpickle(self.outputFile(
+                        'full_{0:010d}.gpickle.bz2'.format(number))),
+                                    restored)
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
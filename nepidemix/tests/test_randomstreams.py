@@ -0,0 +1,78 @@
+"""
+Tests of the random streams.
+
+The stream of a key must only depend on the seed and the key, and streams of
+different keys or seeds must differ.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import random
+import unittest
+
+import numpy
+
+from nepidemix.exceptions import NepidemiXBaseException
+from nepidemix.utilities import RandomStreams, repetitionSeed
+
+
+def draws(stream):
+    return stream.randint(2**31 - 1, size = 8).tolist()
+
+
+class RandomStreamsTest(unittest.TestCase):
+
+    def test_keys(self):
+        streams = RandomStreams(42)
+        keys = [(), ('network',), ('global',), ('replicate', 0),
+                ('replicate', 1), ('partition', 0, 1), ('partition', 1, 0),
+                ('partition', 1)]
+        sequences = [draws(streams.stream(*key)) for key in keys]
+        for i in range(len(keys)):
+            for j in range(i):
+                self.assertNotEqual(sequences[i], sequences[j])
+        # Drawing from other streams, in another order and from another
+        # object, does not change the stream of a key.
+        other = RandomStreams(42)
+        for key, sequence in reversed(zip(keys, sequences)):
+            draws(other.stream('network'))
+            self.assertEqual(draws(other.stream(*key)), sequence)
+
+    def test_seeds(self):
+        sequences = [draws(RandomStreams(seed).stream('replicate', 3))
+                     for seed in [0, 1, 2**32, 2**32 + 1, 2**40]]
+        for i in range(len(sequences)):
+            for j in range(i):
+                self.assertNotEqual(sequences[i], sequences[j])
+        self.assertRaises(NepidemiXBaseException, RandomStreams, -1)
+
+    def test_drawnSeed(self):
+        numpy.random.seed(5)
+        first = RandomStreams().seed
+        numpy.random.seed(5)
+        self.assertEqual(RandomStreams().seed, first)
+
+    def test_seedGlobal(self):
+        streams = RandomStreams(7)
+        streams.seedGlobal('network')
+        first = (random.random(), numpy.random.random_sample())
+        streams.seedGlobal('network')
+        self.assertEqual((random.random(), numpy.random.random_sample()),
+                         first)
+        streams.seedGlobal('global')
+        self.assertNotEqual((random.random(), numpy.random.random_sample()),
+                            first)
+
+    def test_repetitionSeed(self):
+        self.assertEqual(repetitionSeed(42, 0), 42)
+        seeds = [repetitionSeed(42, r) for r in range(1, 5)]
+        self.assertEqual(len(set(seeds + [42])), 5)
+        self.assertEqual([repetitionSeed(42, r) for r in range(1, 5)], seeds)
+        self.assertNotEqual(repetitionSeed(43, 1), seeds[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
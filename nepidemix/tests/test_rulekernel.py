@@ -0,0 +1,94 @@
+"""
+Tests of the node rule kernel.
+
+The neighbour state table and the active node sets kept up to date by the
+kernel, also when the dynamic engine moves edges, must equal those found from
+scratch from the final network and node states.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import unittest
+
+import networkx
+import numpy
+
+from nepidemix.utilities.arraynetwork import ArrayNetwork
+from nepidemix.tests.common import SimulationTestCase, REWIRING_OPTIONS
+
+
+def neighbourCounts(arrayNetwork, states, numStates):
+    """
+    Number of neighbours in every state, counted for each node.
+
+    """
+    counts = numpy.zeros((len(arrayNetwork), numStates), dtype = int)
+    for i in range(len(arrayNetwork)):
+        for j in arrayNetwork.neighbors(i):
+            counts[i, states[j]] += 1
+    return counts
+
+
+class NeighbourTableTest(SimulationTestCase):
+
+    def test_table(self):
+        simulation, engine = self.simulateEngine('table',
+                                                 [('Simulation', 'engine',
+                                                   'array')])
+        kernel = engine.kernel
+        expected = neighbourCounts(engine.arrayNetwork, engine.readStates,
+                                   len(kernel.stateIndex))
+        # Only the states referred to by NN are counted.
+        sids = numpy.flatnonzero(kernel._colMap >= 0)
+        self.assertEqual(len(sids), kernel.nnTable.shape[1])
+        self.assertEqual(kernel.nnTable[:, kernel._colMap[sids]].tolist(),
+                         expected[:, sids].tolist())
+
+    def test_dynamicTable(self):
+        simulation, engine = self.simulateEngine('dynamic',
+                                                 [('Simulation', 'engine',
+                                                   'dynamic')]
+                                                 + REWIRING_OPTIONS)
+        network = simulation.network
+        arrayNetwork = engine.arrayNetwork
+        nodes = arrayNetwork.nodes
+        for i in range(len(arrayNetwork)):
+            self.assertEqual(sorted(nodes[j] for j in
+                                    arrayNetwork.neighbors(i)),
+                             sorted(network.neighbors(nodes[i])))
+        kernel = engine.kernel
+        expected = neighbourCounts(arrayNetwork, engine.readStates,
+                                   len(kernel.stateIndex))
+        sids = numpy.flatnonzero(kernel._colMap >= 0)
+        self.assertEqual(kernel.nnTable[:, kernel._colMap[sids]].tolist(),
+                         expected[:, sids].tolist())
+
+    def test_activeSets(self):
+        simulation, engine = self.simulateEngine('sets',
+                                                 [('Simulation', 'engine',
+                                                   'array')])
+        kernel = engine.kernel
+        states = engine.readStates
+        for sid in kernel.rules:
+            members = numpy.flatnonzero(states == sid)
+            self.assertEqual(sorted(kernel._members[sid]), members.tolist())
+            # Members with a neighbour in a state referred to by the rules.
+            cols = kernel._refCols[sid]
+            hot = members[kernel.nnTable[members][:, cols].sum(axis = 1) > 0]
+            self.assertEqual(sorted(kernel._hot[sid]), hot.tolist())
+
+    def test_reverseAdjacency(self):
+        graph = networkx.DiGraph([(0, 1), (0, 2), (2, 1), (3, 0), (1, 1)])
+        arrayNetwork = ArrayNetwork(graph)
+        indptr, indices = arrayNetwork.reverseAdjacency()
+        for i, n in enumerate(arrayNetwork.nodes):
+            self.assertEqual(sorted([arrayNetwork.nodes[j] for j in
+                                     indices[indptr[i]:indptr[i+1]]]),
+                             sorted(graph.predecessors(n)))
+
+
+if __name__ == '__main__':
+    unittest.main()
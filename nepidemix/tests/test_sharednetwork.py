@@ -0,0 +1,106 @@
+"""
+Tests of the memory mapped shared network.
+
+A network attached to by file name, or unpickled in another process, must
+hold the topology it was created from and share its node states, and the
+file must be removed when the owner closes it.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import cPickle
+import multiprocessing
+import os
+import unittest
+
+import networkx
+import numpy
+
+from nepidemix.utilities import SharedNetwork, loadSharedNetwork
+from nepidemix.utilities.arraynetwork import ArrayNetwork
+
+
+def _setState(task):
+    """
+    Set the state of node `i` of a shared network in a worker process.
+
+    """
+    shared, i, state = task
+    shared.states[i] = state
+    result = len(shared)
+    shared.close()
+    return result
+
+
+class SharedNetworkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = networkx.barabasi_albert_graph(50, 2, seed = 1)
+        self.graph.add_node('isolated')
+        self.arrayNetwork = ArrayNetwork(self.graph)
+        self.states = numpy.arange(len(self.arrayNetwork), dtype = numpy.int32)
+
+    def assertTopology(self, shared):
+        self.assertEqual(shared.nodes, self.arrayNetwork.nodes)
+        self.assertEqual(shared.indptr.tolist(),
+                         self.arrayNetwork.indptr.tolist())
+        self.assertEqual(shared.indices.tolist(),
+                         self.arrayNetwork.indices.tolist())
+
+    def test_attach(self):
+        with SharedNetwork.create(self.arrayNetwork, self.states) as shared:
+            self.assertTrue(shared.owner)
+            self.assertTopology(shared)
+            attached = SharedNetwork(shared.fileName)
+            self.assertFalse(attached.owner)
+            self.assertTopology(attached)
+            self.assertEqual(attached.states.tolist(), self.states.tolist())
+            attached.states[3] = -1
+            self.assertEqual(shared.states[3], -1)
+            view = attached.arrayNetwork()
+            for i in range(len(view)):
+                self.assertEqual(sorted(view.neighbors(i)),
+                                 sorted(self.arrayNetwork.neighbors(i)))
+            graph = attached.graph()
+            self.assertEqual(sorted(graph.nodes()), sorted(self.graph.nodes()))
+            self.assertEqual(sorted([tuple(sorted(e)) for e in graph.edges()]),
+                             sorted([tuple(sorted(e))
+                                     for e in self.graph.edges()]))
+            attached.close()
+            self.assertTrue(os.path.exists(shared.fileName))
+
+    def test_pickle(self):
+        with SharedNetwork.create(self.arrayNetwork) as shared:
+            data = cPickle.dumps(shared, 2)
+            self.assertTrue(len(data) < 200)
+            restored = cPickle.loads(data)
+            self.assertFalse(restored.owner)
+            self.assertTopology(restored)
+            restored.close()
+            pool = multiprocessing.Pool(2)
+            try:
+                sizes = pool.map(_setState, [(shared, i, i + 10)
+                                             for i in range(4)])
+            finally:
+                pool.terminate()
+                pool.join()
+            self.assertEqual(sizes, [len(self.arrayNetwork)] * 4)
+            self.assertEqual(shared.states[:5].tolist(), [10, 11, 12, 13, 0])
+
+    def test_close(self):
+        shared = SharedNetwork.create(self.arrayNetwork)
+        fileName = shared.fileName
+        graph = loadSharedNetwork(fileName)
+        self.assertEqual(graph.number_of_edges(), self.graph.number_of_edges())
+        shared.close()
+        self.assertFalse(os.path.exists(fileName))
+        self.assertEqual(shared.states, None)
+        # Closing again does nothing.
+        shared.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
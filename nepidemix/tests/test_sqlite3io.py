@@ -0,0 +1,153 @@
+"""
+Tests of the buffered node event writer.
+
+Events must only be written when the buffer is full or flushed, states only
+once, and the database contents must not depend on the buffer size. State ids
+must be content derived, and databases holding other ids must not be appended
+to.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import sqlite3
+import unittest
+
+from nepidemix.utilities.arraynetwork import _digest
+from nepidemix.utilities.dbio import sqlite3io
+from nepidemix.tests.common import SimulationTestCase
+
+
+class NodeEventWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute("CREATE TABLE {0} ({1} INTEGER PRIMARY KEY, state TEXT)"\
+                                    .format(sqlite3io.NODE_STATE_TABLE_NAME,
+                                            sqlite3io.NODE_STATE_TABLE_ID_COL))
+        self.connection.execute("CREATE TABLE {0} ({1}, {2}, {3}, {4}, {5}, {6}, {7})"\
+                                    .format(sqlite3io.NODE_EVENT_TABLE_NAME,
+                                            sqlite3io.NODE_EVENT_TABLE_SRC_STATE_COL,
+                                            sqlite3io.NODE_EVENT_TABLE_DST_STATE_COL,
+                                            sqlite3io.NODE_EVENT_TABLE_NODE_ID_COL,
+                                            sqlite3io.NODE_EVENT_TABLE_SIM_ID_COL,
+                                            sqlite3io.NODE_EVENT_TABLE_SIM_TIME_COL,
+                                            sqlite3io.NODE_EVENT_TABLE_MAJOR_IT_COL,
+                                            sqlite3io.NODE_EVENT_TABLE_MINOR_IT_COL))
+
+    def tearDown(self):
+        self.connection.close()
+
+    def rows(self, table):
+        return self.connection.execute("SELECT * FROM {0}".format(table))\
+            .fetchall()
+
+    def test_buffer(self):
+        writer = sqlite3io.NodeEventWriter(self.connection, 7, bufferSize = 3)
+        writer.addState(1, {'state' : 'S'})
+        writer.addState(2, {'state' : 'I'})
+        writer.addState(1, {'state' : 'S'})
+        writer.addEvent(1, 2, 10, 0.5, 0, 10)
+        writer.addEvent(1, 2, 11, 0.5, 0, 11)
+        self.assertEqual(self.rows(sqlite3io.NODE_STATE_TABLE_NAME), [])
+        self.assertEqual(self.rows(sqlite3io.NODE_EVENT_TABLE_NAME), [])
+        writer.addEvent(2, 1, 10, 1.0, 1, 10)
+        self.assertEqual(sorted(self.rows(sqlite3io.NODE_STATE_TABLE_NAME)),
+                         [(1, 'S'), (2, 'I')])
+        self.assertEqual(len(self.rows(sqlite3io.NODE_EVENT_TABLE_NAME)), 3)
+        writer.addState(2, {'state' : 'I'})
+        writer.addEvent(1, 2, 12, 1.0, 1, 12)
+        writer.flush()
+        self.assertEqual(len(self.rows(sqlite3io.NODE_STATE_TABLE_NAME)), 2)
+        self.assertEqual(self.rows(sqlite3io.NODE_EVENT_TABLE_NAME)[-1],
+                         (1, 2, 12, 7, 1.0, 1, 12))
+
+    def test_restoreSeen(self):
+        writer = sqlite3io.NodeEventWriter(self.connection, 7)
+        writer.addState(1, {'state' : 'S'})
+        writer.addState(2, {'state' : 'I'})
+        writer.flush()
+        seen = writer.seenStates()
+        self.assertEqual(seen, set([1, 2]))
+        writer.addState(3, {'state' : 'R'})
+        self.assertEqual(seen, set([1, 2]))
+        resumed = sqlite3io.NodeEventWriter(self.connection, 7)
+        resumed.restoreSeen(seen)
+        resumed.addState(1, {'state' : 'X'})
+        resumed.addState(4, {'state' : 'E'})
+        resumed.flush()
+        self.assertEqual(sorted(self.rows(sqlite3io.NODE_STATE_TABLE_NAME)),
+                         [(1, 'S'), (2, 'I'), (4, 'E')])
+        self.assertEqual(resumed.seenStates(), set([1, 2, 4]))
+
+
+class DatabaseOutputTest(SimulationTestCase):
+
+    def simulateDatabase(self, baseName, options):
+        options = [('Simulation', 'engine', 'array'),
+                   ('Output', 'db_name', self.outputFile(baseName + '.db'))]\
+                   + options
+        return self.simulate(baseName, options)
+
+    def contents(self, baseName):
+        connection = sqlite3.connect(self.outputFile(baseName + '.db'))
+        try:
+            return [connection.execute("SELECT * FROM {0} ORDER BY {1}"\
+                                           .format(table, order)).fetchall()
+                    for table, order in [(sqlite3io.NODE_STATE_TABLE_NAME,
+                                          sqlite3io.NODE_STATE_TABLE_ID_COL),
+                                         (sqlite3io.NODE_EVENT_TABLE_NAME,
+                                          "rowid")]]
+        finally:
+            connection.close()
+
+    def test_bufferSize(self):
+        self.simulateDatabase('small', [('Output', 'db_buffer_size', '7')])
+        self.simulateDatabase('large', [])
+        small = self.contents('small')
+        self.assertEqual(len(small[0]), 3)
+        self.assertTrue(len(small[1]) > 7)
+        self.assertEqual(small, self.contents('large'))
+
+    def test_pragmas(self):
+        simulation = self.simulateDatabase('wal', [('Output',
+                                                    'db_journal_mode', 'WAL'),
+                                                   ('Output', 'db_synchronous',
+                                                    'OFF')])
+        self.assertEqual(simulation._dbConnection.execute(
+                "PRAGMA synchronous").fetchone()[0], 0)
+        simulation._dbConnection.close()
+        # The WAL journal mode is kept by the database file.
+        connection = sqlite3.connect(self.outputFile('wal.db'))
+        self.assertEqual(connection.execute("PRAGMA journal_mode")\
+                             .fetchone()[0], 'wal')
+        connection.close()
+
+    def test_stateIds(self):
+        self.simulateDatabase('ids', [])
+        self.simulateDatabase('ids', [])
+        connection = sqlite3.connect(self.outputFile('ids.db'))
+        rows = connection.execute("SELECT {0}, state FROM {1}"\
+                                      .format(sqlite3io.NODE_STATE_TABLE_ID_COL,
+                                              sqlite3io.NODE_STATE_TABLE_NAME))\
+                                      .fetchall()
+        self.assertEqual(sorted(rows),
+                         sorted([(_digest(frozenset([('state', str(v))])), v)
+                                 for k, v in rows]))
+        simulations = "SELECT COUNT(*) FROM {0}"\
+            .format(sqlite3io.SIMULATION_TABLE_NAME)
+        self.assertEqual(connection.execute(simulations).fetchone()[0], 2)
+        # A database written with hash() ids.
+        connection.execute("PRAGMA user_version = 0")
+        connection.close()
+        simulation = self.simulateDatabase('ids', [])
+        self.assertEqual(simulation._dbConnection, None)
+        connection = sqlite3.connect(self.outputFile('ids.db'))
+        self.assertEqual(connection.execute(simulations).fetchone()[0], 2)
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
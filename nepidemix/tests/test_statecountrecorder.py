@@ -0,0 +1,109 @@
+"""
+Tests of the state count recorder and stream.
+
+The csv files written from recorded state counts must be identical to those
+written from the lists of count dictionaries used before.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import csv
+import unittest
+
+import numpy
+
+from nepidemix.simulation import Simulation
+from nepidemix.utilities import StateCountRecorder, StateCountStream
+from nepidemix.tests.common import SimulationTestCase
+
+TIME = Simulation.TIME_FIELD_NAME
+
+S = frozenset([('state', 'S')])
+I = frozenset([('state', 'I')])
+R = frozenset([('state', 'R')])
+
+
+def samples():
+    """
+    State count samples of an SIR process, with R first counted in the third
+    sample, and times accumulated as in a simulation.
+
+    """
+    time = 0.0
+    counts = {S : 95, I : 5}
+    result = [(time, dict(counts))]
+    for it in range(1, 40):
+        time += 0.1
+        counts[S] -= 1
+        counts[I] += 1
+        if it >= 2:
+            counts[I] -= 1
+            counts[R] = counts.get(R, 0) + 1
+        result.append((time, dict(counts)))
+    result[-1][1][S] = numpy.int64(result[-1][1][S])
+    return result
+
+
+class StateCountFileTest(SimulationTestCase):
+
+    def writeDictionaries(self, fileName, samples, keys):
+        """
+        Write `samples` the way the simulation did before the recorder: as
+        dictionaries of string counts with the time under `TIME`.
+
+        """
+        rows = []
+        for time, counts in samples:
+            countDict = {TIME : time}
+            countDict.update(dict([(s, str(v)) for s, v in counts.iteritems()]))
+            rows.append(countDict)
+        with open(self.outputFile(fileName), 'wb') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(keys)
+            for row in rows:
+                writer.writerow([row.get(k, 0) for k in keys])
+
+    def test_recorder(self):
+        keys = [TIME] + samples()[-1][1].keys()
+        self.writeDictionaries('old.csv', samples(), keys)
+        recorder = StateCountRecorder(capacity = 4)
+        for time, counts in samples():
+            recorder.record(time, counts)
+        self.assertEqual(len(recorder), 40)
+        with open(self.outputFile('new.csv'), 'wb') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(keys)
+            writer.writerows(recorder.rows(keys[1:]))
+        self.assertEqual(self.readFile('old.csv'), self.readFile('new.csv'))
+
+    def test_stream(self):
+        keys = [TIME] + samples()[-1][1].keys()
+        self.writeDictionaries('old.csv', samples(), keys)
+        stream = StateCountStream(self.outputFile('new.csv'), keys[1:], TIME,
+                                  flushInterval = 3)
+        for time, counts in samples():
+            stream.record(time, counts)
+        stream.close()
+        self.assertEqual(len(stream), 40)
+        self.assertEqual(self.readFile('old.csv'), self.readFile('new.csv'))
+
+    def test_simulation(self):
+        for engine in ['networkx', 'array']:
+            self.simulate('saved', [('Simulation', 'engine', engine),
+                                    ('Output', 'save_state_count_interval',
+                                     '7')])
+            self.simulate('streamed', [('Simulation', 'engine', engine),
+                                       ('Output', 'save_state_count_interval',
+                                        '7'),
+                                       ('Output', 'stream_state_count', 'yes'),
+                                       ('Output', 'stream_flush_interval',
+                                        '2')])
+            self.assertEqual(self.readFile('saved_state_count.csv'),
+                             self.readFile('streamed_state_count.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests of the networkx utility functions.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+import unittest
+
+import networkx
+import numpy
+
+from nepidemix.utilities.networkxtra import attributeValueDeal, \
+    attributeValueDealIndices, attributesChanged
+
+STATES = [({'state' : 'S'}, 0), ({'state' : 'I'}, 0), ({'state' : 'R'}, 0)]
+
+
+def values(amounts):
+    return [(a, v) for (a, _), v in zip(STATES, amounts)]
+
+
+class AttributeValueDealTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = numpy.random.RandomState(3)
+
+    def deal(self, amounts, graphSize, dealExact):
+        network = networkx.path_graph(graphSize)
+        attributeValueDeal(network.nodes_iter(data = True), values(amounts),
+                           graphSize, dealExact, self.random)
+        return [network.node[n].get('state') for n in network.nodes_iter()]
+
+    def test_exactShortPile(self):
+        indices = attributeValueDealIndices(values([3, 4, 0]), 10,
+                                            dealExact = True,
+                                            random = self.random)
+        self.assertEqual(len(indices), 7)
+        self.assertEqual(numpy.bincount(indices).tolist(), [3, 4])
+        dealt = self.deal([3, 4, 0], 10, True)
+        self.assertEqual(dealt[7:], [None] * 3)
+        self.assertEqual(sorted(dealt[:7]), ['I'] * 4 + ['S'] * 3)
+
+    def test_exactFractions(self):
+        indices = attributeValueDealIndices(values([0.2, 0.3, 0.1]), 20,
+                                            dealExact = True,
+                                            random = self.random)
+        self.assertEqual(numpy.bincount(indices).tolist(), [4, 6, 2])
+        dealt = self.deal([0.2, 0.3, 0.1], 20, True)
+        self.assertEqual(dealt[12:], [None] * 8)
+        self.assertEqual(sorted(dealt[:12]), ['I'] * 6 + ['R'] * 2 + ['S'] * 4)
+
+    def test_exactLongPile(self):
+        indices = attributeValueDealIndices(values([8, 8, 8]), 10,
+                                            dealExact = True,
+                                            random = self.random)
+        self.assertEqual(len(indices), 10)
+        self.assertTrue((numpy.bincount(indices, minlength = 3) <= 8).all())
+        self.assertNotIn(None, self.deal([8, 8, 8], 10, True))
+
+    def test_normalized(self):
+        indices = attributeValueDealIndices(values([1, 2, 0]), 10,
+                                            random = self.random)
+        self.assertEqual(numpy.bincount(indices).tolist(), [3, 7])
+        dealt = self.deal([0.05, 0.05, 0.05], 10, False)
+        self.assertNotIn(None, dealt)
+        self.assertEqual(len(dealt), 10)
+
+    def test_seeded(self):
+        first = attributeValueDealIndices(values([0.5, 0.3, 0.2]), 50,
+                                          random = numpy.random.RandomState(7))
+        second = attributeValueDealIndices(values([0.5, 0.3, 0.2]), 50,
+                                           random = numpy.random.RandomState(7))
+        self.assertEqual(first.tolist(), second.tolist())
+
+
+
+class AttributesChangedTest(unittest.TestCase):
+
+    def test_identity(self):
+        stamp = [1.0, 2.0]
+        old = {'state' : 'I', 'timed' : stamp}
+        self.assertFalse(attributesChanged(old, old.copy()))
+        # An equal but re-created value is a change.
+        self.assertTrue(attributesChanged(old, {'state' : 'I',
+                                                'timed' : [1.0, 2.0]}))
+        self.assertTrue(attributesChanged(old, {'state' : 'I'}))
+        self.assertTrue(attributesChanged(old, {'state' : 'I',
+                                                'other' : stamp}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,8 +29,40 @@ from linkedcounter import *
 
 from dbio import *
 
+import arraynetwork
+from arraynetwork import *
+
+import statecountrecorder
+from statecountrecorder import *
+
+import networksnapshot
+from networksnapshot import *
+
+import counterstore
+from counterstore import *
+
+import sharednetwork
+from sharednetwork import *
+
+import randomstreams
+from randomstreams import *
+
+import dynamicnetwork
+from dynamicnetwork import *
+
+import checkpoint
+from checkpoint import *
+
 __all__.append('NetworkGenerator')
 __all__.extend(nepidemixconfigparser.__all__)
 __all__.extend(parameterexpander.__all__)
 __all__.extend(linkedcounter.__all__)
+__all__.extend(arraynetwork.__all__)
+__all__.extend(statecountrecorder.__all__)
+__all__.extend(networksnapshot.__all__)
+__all__.extend(counterstore.__all__)
+__all__.extend(sharednetwork.__all__)
+__all__.extend(randomstreams.__all__)
+__all__.extend(dynamicnetwork.__all__)
+__all__.extend(checkpoint.__all__)
 #__all__.extend(dbio)
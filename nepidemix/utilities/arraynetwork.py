@@ -0,0 +1,251 @@
+"""
+Array network representation
+============================
+
+Compact array representations of a networkx graph and of the states of its
+entities. Used by the array based simulation engines as an alternative to
+iterating over the networkx node and edge dictionaries.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["StateIndex", "ArrayNetwork"]
+
+import hashlib
+import struct
+
+import numpy
+
+
+class StateIndex(object):
+    """
+    Interns hashable entity states to dense integer ids.
+
+    The first state seen is given id 0, the second id 1, and so on. The state
+    belonging to an id is found through the `states` list.
+
+    Examples
+    --------
+
+    If S = StateIndex(), then S.intern('S') == 0, S.intern('I') == 1, and
+    again S.intern('S') == 0 while S.states == ['S', 'I'].
+
+    The dense ids depend on the order the states are seen in. Ids that only
+    depend on the contents of a state, and so agree between simulations, are
+    given by `digest`.
+
+    """
+    def __init__(self):
+        self.states = []
+        self._index = {}
+        self._digests = {}
+
+    def intern(self, state):
+        """
+        Get the id of a state, registering it if it has not been seen before.
+
+        Parameters
+        ----------
+
+        state : hashable
+           The state, as given by a process deduce method.
+
+        Returns
+        -------
+
+        sid : int
+           The integer id of `state`.
+
+        """
+        sid = self._index.get(state)
+        if sid is None:
+            sid = len(self.states)
+            self._index[state] = sid
+            self.states.append(state)
+        return sid
+
+    def index(self, state):
+        """
+        Get the id of an already registered state. Raises KeyError otherwise.
+
+        """
+        return self._index[state]
+
+    def digest(self, sid):
+        """
+        Content derived id of the state with id `sid`.
+
+        The id is a signed 64 bit integer computed from the SHA-1 digest of
+        the sorted (name, value) pairs of an attribute state (or of the
+        representation of other states), so the same state is given the same
+        id in every simulation regardless of the order states are seen in.
+
+        """
+        dig = self._digests.get(sid)
+        if dig is None:
+            dig = _digest(self.states[sid])
+            self._digests[sid] = dig
+        return dig
+
+    def __contains__(self, state):
+        return state in self._index
+
+    def __len__(self):
+        return len(self.states)
+
+
+def _digest(state):
+    """
+    Signed 64 bit integer digest of a state.
+
+    """
+    if isinstance(state, frozenset):
+        # Values such as timed states compare as their plain value.
+        text = repr(sorted([(repr(name), repr(getattr(value, 'value', value)))
+                            for name, value in state]))
+    else:
+        text = repr(state)
+    return struct.unpack('>q', hashlib.sha1(text).digest()[:8])[0]
+
+
+class ArrayNetwork(object):
+    """
+    Topology of a networkx graph as a compressed sparse row (CSR) adjacency.
+
+    Nodes are numbered 0..N-1 in the order given by `graph.nodes()`. The
+    neighbours of node number i are found in indices[indptr[i]:indptr[i+1]].
+    For directed graphs the neighbours are the successors, in agreement with
+    `networkx.Graph.neighbors_iter`.
+
+    Attributes
+    ----------
+
+    nodes : list
+       The networkx node ids in array order.
+
+    nodeIndex : dict
+       Map from networkx node id to array position.
+
+    indptr : numpy.ndarray
+       Row pointers, int64 array of length N+1.
+
+    indices : numpy.ndarray
+       Neighbour positions, int32 array of length indptr[-1].
+
+    directed : bool
+       True if the graph is directed.
+
+    replicates : int
+       Number of disjoint copies of the graph held, see `tile`.
+
+    """
+    def __init__(self, graph):
+        """
+        Build the adjacency from a graph.
+
+        Parameters
+        ----------
+
+        graph : networkx.Graph
+           The graph. Only the topology is read.
+
+        """
+        self.nodes = graph.nodes()
+        self.directed = graph.is_directed()
+        self.replicates = 1
+        self.nodeIndex = dict(zip(self.nodes, xrange(len(self.nodes))))
+        self.indptr = numpy.zeros(len(self.nodes) + 1, dtype=numpy.int64)
+        nbrs = []
+        for i, n in enumerate(self.nodes):
+            nl = [self.nodeIndex[nn] for nn in graph.adj[n]]
+            self.indptr[i+1] = self.indptr[i] + len(nl)
+            nbrs.extend(nl)
+        self.indices = numpy.array(nbrs, dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def degree(self):
+        """
+        Returns
+        -------
+
+        degree : numpy.ndarray
+           The number of neighbours of each node.
+
+        """
+        return numpy.diff(self.indptr)
+
+    def tile(self, replicates):
+        """
+        Disjoint copies of the network.
+
+        Copy r occupies positions r*N..(r+1)*N-1, where N is the number of
+        nodes, so the adjacency is block diagonal. The `nodes` list is
+        repeated, giving the networkx node of every position, while
+        `nodeIndex` maps to the positions of the first copy.
+
+        Parameters
+        ----------
+
+        replicates : int
+           Number of copies.
+
+        Returns
+        -------
+
+        tiled : ArrayNetwork
+           The copies.
+
+        """
+        n = len(self.nodes)
+        nnz = len(self.indices)
+        tiled = ArrayNetwork.__new__(ArrayNetwork)
+        tiled.nodes = self.nodes * replicates
+        tiled.nodeIndex = self.nodeIndex
+        tiled.directed = self.directed
+        tiled.replicates = self.replicates * replicates
+        tiled.indptr = numpy.zeros(n * replicates + 1, dtype=numpy.int64)
+        tiled.indptr[1:] = (self.indptr[1:] + 
+                            nnz * numpy.arange(replicates)[:, numpy.newaxis])\
+                            .ravel()
+        tiled.indices = (self.indices + 
+                         numpy.int32(n) * numpy.arange(replicates,
+                                                       dtype=numpy.int32)\
+                             [:, numpy.newaxis]).ravel()
+        return tiled
+
+    def reverseAdjacency(self):
+        """
+        The CSR adjacency with all edges reversed.
+
+        For each node these are the nodes having it as a neighbour. For
+        undirected graphs this is the adjacency itself.
+
+        Returns
+        -------
+
+        indptr, indices : numpy.ndarray
+           Row pointers and neighbour positions, as the attributes of the same
+           names.
+
+        """
+        if not self.directed:
+            return self.indptr, self.indices
+        rows = numpy.repeat(numpy.arange(len(self.nodes), dtype=numpy.int32),
+                            self.degree())
+        order = numpy.argsort(self.indices, kind='mergesort')
+        indptr = numpy.zeros(len(self.nodes) + 1, dtype=numpy.int64)
+        indptr[1:] = numpy.cumsum(numpy.bincount(self.indices,
+                                                 minlength=len(self.nodes)))
+        return indptr, rows[order]
+
+    def neighbors(self, i):
+        """
+        Array positions of the neighbours of the node at position `i`.
+
+        """
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
@@ -0,0 +1,219 @@
+"""
+Checkpoints
+===========
+
+Writing and reading of simulation checkpoints.
+
+A checkpoint is a dictionary of numpy arrays and plain python values, saved
+to one binary file: the magic string 'NPXCHKPT' followed by the dictionary
+pickled with the highest pickle protocol. Numpy arrays are pickled as raw
+buffers, so writing and reading cost little more than copying the data.
+
+A `CheckpointWriter` writes checkpoints on a background thread, so that the
+simulation only waits for the checkpoint data to be gathered. The file is
+written under a temporary name, synced to disk and then renamed over the
+previous checkpoint, so the checkpoint file always holds a complete
+checkpoint even if the program is terminated while writing.
+
+Node and edge attribute dictionaries are stored compactly with
+`packAttributes`, as one integer per entity indexing a table of the distinct
+attribute dictionaries.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["CheckpointWriter", "loadCheckpoint", "packAttributes",
+           "unpackAttributes"]
+
+import cPickle
+import os
+import threading
+import time
+
+import numpy
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+_MAGIC = 'NPXCHKPT'
+
+# Attribute values compared by value when packing attributes. Other values
+# (such as timed states, equal to their plain value) are stored per entity.
+_PLAIN_TYPES = (str, unicode, int, long, float, bool, type(None))
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints to a file on a background thread.
+
+    At most one checkpoint is being written at a time: `write` waits for the
+    previous checkpoint to be written before starting the next.
+
+    Attributes
+    ----------
+
+    fileName : str
+       The checkpoint file.
+
+    """
+    def __init__(self, fileName):
+        """
+        Parameters
+        ----------
+
+        fileName : str
+           The checkpoint file. Replaced by every checkpoint written.
+
+        """
+        self.fileName = fileName
+        self._thread = None
+        self._error = None
+
+    def write(self, checkpoint):
+        """
+        Start writing a checkpoint.
+
+        Parameters
+        ----------
+
+        checkpoint : dict
+           The checkpoint. Must not be changed until written, i.e. until the
+           next call to `write` or `wait`.
+
+        """
+        self.wait()
+        self._thread = threading.Thread(target = self._write,
+                                        args = (checkpoint,))
+        self._thread.start()
+
+    def wait(self):
+        """
+        Wait for the checkpoint being written, if any.
+
+        Raises NepidemiXBaseException if it could not be written.
+
+        """
+        if self._thread != None:
+            self._thread.join()
+            self._thread = None
+        if self._error != None:
+            err = self._error
+            self._error = None
+            raise NepidemiXBaseException("Could not write checkpoint '{0}': {1}"\
+                                             .format(self.fileName, err))
+
+    def close(self):
+        """
+        Wait for the checkpoint being written, if any.
+
+        """
+        self.wait()
+
+    def _write(self, checkpoint):
+        """
+        Write `checkpoint` to a temporary file and move it in place.
+
+        """
+        startTime = time.time()
+        tmpFileName = self.fileName + '.tmp'
+        try:
+            with open(tmpFileName, 'wb') as fp:
+                fp.write(_MAGIC)
+                cPickle.dump(checkpoint, fp, cPickle.HIGHEST_PROTOCOL)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.rename(tmpFileName, self.fileName)
+        except (IOError, OSError, cPickle.PicklingError) as err:
+            self._error = err
+            return
+        logger.info("Checkpoint written to '{0}' in {1:.3f} s."\
+                        .format(self.fileName, time.time() - startTime))
+
+
+def loadCheckpoint(fileName):
+    """
+    Read a checkpoint written by a `CheckpointWriter`.
+
+    Parameters
+    ----------
+
+    fileName : str
+       The checkpoint file.
+
+    Returns
+    -------
+
+    checkpoint : dict
+       The checkpoint.
+
+    """
+    with open(fileName, 'rb') as fp:
+        if fp.read(len(_MAGIC)) != _MAGIC:
+            raise NepidemiXBaseException("'{0}' is not a checkpoint file."\
+                                             .format(fileName))
+        return cPickle.load(fp)
+
+
+def packAttributes(dicts):
+    """
+    Compact representation of a sequence of attribute dictionaries.
+
+    Dictionaries with the same attributes share one entry in a table of
+    distinct attribute sets. Dictionaries holding values other than strings,
+    numbers and None are stored as they are.
+
+    Parameters
+    ----------
+
+    dicts : iterable
+       The attribute dictionaries.
+
+    Returns
+    -------
+
+    packed : tuple
+       (ids, table, others), where ids is an int32 array with the table index
+       of every dictionary, or -1 for dictionaries found in the dictionary
+       others (keyed by position), and table is the list of distinct
+       attribute sets as tuples of (name, value) pairs.
+
+    """
+    index = {}
+    table = []
+    others = {}
+    ids = []
+    for i, atts in enumerate(dicts):
+        if all([type(v) in _PLAIN_TYPES for v in atts.itervalues()]):
+            key = frozenset(atts.iteritems())
+            aid = index.get(key)
+            if aid == None:
+                aid = len(table)
+                index[key] = aid
+                table.append(tuple(atts.iteritems()))
+            ids.append(aid)
+        else:
+            others[i] = atts.copy()
+            ids.append(-1)
+    return (numpy.array(ids, dtype = numpy.int32), table, others)
+
+
+def unpackAttributes(packed):
+    """
+    Iterate over new attribute dictionaries equal to those packed by
+    `packAttributes`, in order.
+
+    """
+    ids, table, others = packed
+    for i, aid in enumerate(ids.tolist()):
+        if aid < 0:
+            yield others[i].copy()
+        else:
+            yield dict(table[aid])
@@ -0,0 +1,329 @@
+"""
+Counter store
+=============
+
+Double buffered storage of the state counters of a simulation.
+
+The state counts of a network (``network.graph[Simulation.STATE_COUNT_FIELD_NAME]``)
+are built by the processes as an ordered dictionary of `LinkedCounter`
+objects, where a counter of a partial (mean field) state listens to the
+counters of the states it covers. A `CounterStore` compiles such a dictionary
+into arrays: the counts of the leaf states (counters that no other counter
+listens to) are kept in a vector, and the partial state counts are derived
+from it through a sparse (partial state x leaf state) membership matrix.
+Changing a leaf count is thus a single array update, and all partial counts
+are recomputed by one sparse matrix-vector product when next read.
+
+The store holds two buffers, presented as two dictionary like views, so that
+one may be read while the other is written. `commit` copies one buffer to the
+other.
+
+Counters can also be addressed by their position in the count vector of a
+view, the leaf counts followed by the partial counts, found once with
+`CounterStore.positions` and read with `CounterView.count`, or from a copy of
+the vector given by `CounterView.vector`.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["CounterStore", "CounterView"]
+
+from collections import OrderedDict
+from itertools import izip
+
+import numpy
+
+
+class CounterStore(object):
+    """
+    Two buffers of leaf and partial state counters sharing labels and
+    membership.
+
+    Attributes
+    ----------
+
+    labels : list
+       The counter labels, in order.
+
+    views : list
+       The two `CounterView` objects, one per buffer.
+
+    numLeaves : int
+       Number of leaf counters.
+
+    numPartials : int
+       Number of partial counters.
+
+    """
+    def __init__(self, counters):
+        """
+        Parameters
+        ----------
+
+        counters : dict
+           Map from label to counter, either `LinkedCounter` objects or
+           values convertible to int. A counter listed as listener of another
+           is a partial counter, all others are leaf counters. Links to
+           listeners not in `counters`, and listeners of partial counters,
+           are ignored.
+
+        """
+        self.labels = counters.keys()
+        self._index = dict([(label, i) for i, label in enumerate(self.labels)])
+        values = counters.values()
+        position = dict([(id(c), i) for i, c in enumerate(values)])
+        links = [[position[id(l)] for l in getattr(c, 'linkedCounters', [])
+                  if id(l) in position] for c in values]
+        isPartial = numpy.zeros(len(values), dtype = bool)
+        for l in links:
+            isPartial[l] = True
+        # Leaf or partial number of each label.
+        self._leafLabels = numpy.flatnonzero(~isPartial)
+        self._partialLabels = numpy.flatnonzero(isPartial)
+        self.numLeaves = len(self._leafLabels)
+        self.numPartials = len(self._partialLabels)
+        self._leafOf = numpy.empty(len(values), dtype = numpy.int64)
+        self._leafOf.fill(-1)
+        self._leafOf[self._leafLabels] = numpy.arange(self.numLeaves)
+        self._partialOf = numpy.empty(len(values), dtype = numpy.int64)
+        self._partialOf.fill(-1)
+        self._partialOf[self._partialLabels] = numpy.arange(self.numPartials)
+        self._leafOf = self._leafOf.tolist()
+        self._partialOf = self._partialOf.tolist()
+        # Membership matrix in coordinate form, an entry per link from a leaf
+        # to a partial counter.
+        rows = []
+        cols = []
+        for i in self._leafLabels:
+            for p in links[i]:
+                rows.append(self._partialOf[p])
+                cols.append(self._leafOf[i])
+        self._rows = numpy.array(rows, dtype = numpy.int64)
+        self._cols = numpy.array(cols, dtype = numpy.int64)
+
+        initial = numpy.array([int(c) for c in values], dtype = numpy.int64)
+        leaves = initial[self._leafLabels]
+        # Partial counters keep any difference to the sum of their leaves.
+        offsets = initial[self._partialLabels] - self.aggregate(leaves)
+        self.views = [CounterView(self, leaves.copy(), offsets.copy()),
+                      CounterView(self, leaves.copy(), offsets.copy())]
+
+    def positions(self, labels):
+        """
+        Positions of counters in the count vector of the views.
+
+        Parameters
+        ----------
+
+        labels : iterable
+           Counter labels.
+
+        Returns
+        -------
+
+        positions : numpy.ndarray
+           The position of each label, -1 for labels not in the store.
+
+        """
+        positions = []
+        for label in labels:
+            pos = self._index.get(label)
+            if pos is None:
+                positions.append(-1)
+            elif self._leafOf[pos] >= 0:
+                positions.append(self._leafOf[pos])
+            else:
+                positions.append(self.numLeaves + self._partialOf[pos])
+        return numpy.array(positions, dtype = numpy.int64)
+
+    def aggregate(self, leaves):
+        """
+        The sums of the leaf counts `leaves` over the members of each partial
+        counter.
+
+        """
+        return numpy.bincount(self._rows, weights = leaves[self._cols],
+                              minlength = self.numPartials)\
+                              .astype(numpy.int64)
+
+    def commit(self, view):
+        """
+        Make the other buffer equal to `view`.
+
+        Parameters
+        ----------
+
+        view : CounterView
+           One of the views of this store.
+
+        Returns
+        -------
+
+        other : CounterView
+           The other view.
+
+        """
+        other = self.views[1] if view is self.views[0] else self.views[0]
+        numpy.copyto(other.leaves, view.leaves)
+        numpy.copyto(other._offsets, view._offsets)
+        numpy.copyto(other._partials, view._partials)
+        other._stale = view._stale
+        return other
+
+
+class CounterView(object):
+    """
+    Dictionary like view of one buffer of a `CounterStore`.
+
+    Values are ints. Assigning a new value to a leaf label changes the
+    partial counters it belongs to by the same difference, so that
+    ``view[label] += 1`` behaves as for a dictionary of `LinkedCounter`
+    objects. Labels can not be added.
+
+    A view is pickled (and copied) as an ordered dictionary of ints.
+
+    Attributes
+    ----------
+
+    store : CounterStore
+       The store of the view.
+
+    leaves : numpy.ndarray
+       The leaf counts.
+
+    """
+    def __init__(self, store, leaves, offsets):
+        self.store = store
+        self._store = store
+        self._index = store._index
+        self._leafOf = store._leafOf
+        self._partialOf = store._partialOf
+        self.leaves = leaves
+        self._offsets = offsets
+        self._partials = offsets.copy()
+        self._stale = True
+
+    def partials(self):
+        """
+        The partial counts.
+
+        """
+        if self._stale:
+            self._partials[:] = self._store.aggregate(self.leaves)
+            self._partials += self._offsets
+            self._stale = False
+        return self._partials
+
+    def count(self, position):
+        """
+        The count at `position` of the count vector, see
+        `CounterStore.positions`.
+
+        """
+        n = self._store.numLeaves
+        if position < n:
+            return int(self.leaves[position])
+        return int(self.partials()[position - n])
+
+    def vector(self, out = None):
+        """
+        The count vector, the leaf counts followed by the partial counts.
+
+        Parameters
+        ----------
+
+        out : numpy.ndarray, optional
+           Array the counts are written to.
+
+        """
+        if out is None:
+            out = numpy.empty(self._store.numLeaves + self._store.numPartials,
+                              dtype = numpy.int64)
+        n = self._store.numLeaves
+        out[:n] = self.leaves
+        out[n:] = self.partials()
+        return out
+
+    def state(self):
+        """
+        Copies of the leaf counts and the partial counter offsets, to be
+        restored by `setState`.
+
+        """
+        return (self.leaves.copy(), self._offsets.copy())
+
+    def setState(self, leaves, offsets):
+        """
+        Set the counts to a `state` of a view of an equal store.
+
+        """
+        self.leaves[:] = leaves
+        self._offsets[:] = offsets
+        self._stale = True
+
+    def __getitem__(self, label):
+        pos = self._index[label]
+        j = self._leafOf[pos]
+        if j >= 0:
+            return int(self.leaves[j])
+        return int(self.partials()[self._partialOf[pos]])
+
+    def __setitem__(self, label, value):
+        pos = self._index[label]
+        j = self._leafOf[pos]
+        if j >= 0:
+            self.leaves[j] = value
+            self._stale = True
+        else:
+            p = self._partialOf[pos]
+            diff = value - self.partials()[p]
+            self._offsets[p] += diff
+            self._partials[p] += diff
+
+    def __contains__(self, label):
+        return label in self._index
+
+    def has_key(self, label):
+        return label in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._store.labels)
+
+    def get(self, label, default = None):
+        if label not in self._index:
+            return default
+        return self[label]
+
+    def keys(self):
+        return list(self._store.labels)
+
+    def iterkeys(self):
+        return iter(self._store.labels)
+
+    def values(self):
+        store = self._store
+        values = numpy.empty(len(self._index), dtype = numpy.int64)
+        values[store._leafLabels] = self.leaves
+        values[store._partialLabels] = self.partials()
+        return values.tolist()
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return zip(self._store.labels, self.values())
+
+    def iteritems(self):
+        return izip(self._store.labels, self.values())
+
+    def __repr__(self):
+        return "CounterView({0})".format(self.items())
+
+    def __reduce__(self):
+        return (OrderedDict, (self.items(),))
@@ -2,7 +2,8 @@
 sqlite3 IO
 ==========
 
-Utility functions to extract data from NepidemiX sqlite3 output databases.
+Utility functions to extract data from NepidemiX sqlite3 output databases,
+and a buffered writer of node events.
 """
 __author__ =  "Lukas Ahrenberg (lukas@ahrenberg.se)"
 
@@ -35,6 +36,139 @@ SIMULATION_TABLE_CONF_COL =  "configuration"
 SIMULATION_TABLE_TIME_COL = "time_stamp"
 SIMULATION_TABLE_NUM_NODES_COL = "initial_node_count"
 SIMULATION_TABLE_NUM_EDGES_COL = "initial_edge_count"
+# Version of the node state ids, stored as the database user_version. Version
+# 0 databases hold the hash() of the states, version 1 the content derived ids
+# of nepidemix.utilities.StateIndex.digest.
+STATE_ID_VERSION = 1
+
+class NodeEventWriter(object):
+    """
+    Buffered writer of node events to a NepidemiX database.
+
+    Events and node states are collected in memory and written with one
+    executemany per statement when `flush` is called, or when the number of
+    buffered events reaches `bufferSize`. A node state is only queued for
+    insertion the first time its id is seen by the writer.
+
+    The writer does not commit; that is left to the owner of the connection.
+
+    """
+    def __init__(self, db_connection, simulation_id, bufferSize = 10000):
+        """
+        Parameters
+        ----------
+
+        db_connection : sqlite3.connection
+           The database.
+
+        simulation_id : int
+           Id of the simulation the events belong to.
+
+        bufferSize : int, optional
+           Number of events buffered before they are written. Default 10000.
+
+        """
+        self.connection = db_connection
+        self.simulation_id = simulation_id
+        self.bufferSize = bufferSize
+        self._events = []
+        # New states, keyed by the attribute names of the state.
+        self._states = {}
+        self._seenStates = set()
+        self._stateSQL = {}
+        self._eventSQL = """INSERT INTO {0}({1}, {2}, {3}, {4}, {5}, {6}, {7})
+                            VALUES (?, ?, ?, ?, ?, ?, ?)"""\
+                            .format(NODE_EVENT_TABLE_NAME,
+                                    NODE_EVENT_TABLE_SRC_STATE_COL,
+                                    NODE_EVENT_TABLE_DST_STATE_COL,
+                                    NODE_EVENT_TABLE_NODE_ID_COL,
+                                    NODE_EVENT_TABLE_SIM_ID_COL,
+                                    NODE_EVENT_TABLE_SIM_TIME_COL,
+                                    NODE_EVENT_TABLE_MAJOR_IT_COL,
+                                    NODE_EVENT_TABLE_MINOR_IT_COL)
+
+    def addState(self, state_id, attributes):
+        """
+        Queue a node state for insertion, unless already seen.
+
+        Parameters
+        ----------
+
+        state_id : int
+           The state id. Should be derived from the state contents, so that
+           it is the same for the state in all simulations of the database.
+
+        attributes : dict
+           The node attributes of the state.
+
+        """
+        if state_id in self._seenStates:
+            return
+        self._seenStates.add(state_id)
+        keys = tuple(attributes.keys())
+        self._states.setdefault(keys, []).append(
+            [state_id] + [attributes[k] for k in keys])
+
+    def seenStates(self):
+        """
+        The ids of the states seen by the writer.
+
+        Returns
+        -------
+
+        states : set
+           A copy of the set of state ids queued or written so far.
+
+        """
+        return set(self._seenStates)
+
+    def restoreSeen(self, states):
+        """
+        Mark states as already seen, for instance when resuming a simulation
+        whose states were written by an earlier writer.
+
+        Parameters
+        ----------
+
+        states : iterable of int
+           State ids, as returned by `seenStates`.
+
+        """
+        self._seenStates.update(states)
+
+    def addEvent(self, src_state_id, dst_state_id, node_id, simulation_time,
+                 major_iteration, minor_iteration):
+        """
+        Queue a node event.
+
+        """
+        self._events.append((src_state_id, dst_state_id, node_id,
+                             self.simulation_id, simulation_time,
+                             major_iteration, minor_iteration))
+        if len(self._events) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered states and events.
+
+        """
+        cur = self.connection.cursor()
+        for keys, rows in self._states.iteritems():
+            sql = self._stateSQL.get(keys)
+            if sql == None:
+                sql = """INSERT OR IGNORE INTO {0}({1}, {2}) VALUES ({3})"""\
+                    .format(NODE_STATE_TABLE_NAME,
+                            NODE_STATE_TABLE_ID_COL,
+                            ",".join(keys),
+                            ",".join(["?"]*(1+len(keys))))
+                self._stateSQL[keys] = sql
+            cur.executemany(sql, rows)
+        self._states = {}
+        if len(self._events) > 0:
+            cur.executemany(self._eventSQL, self._events)
+            self._events = []
+
 
 def get_flux(db_connection,
              state_A, state_B,
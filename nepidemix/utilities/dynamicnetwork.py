@@ -0,0 +1,369 @@
+"""
+Dynamic network representation
+==============================
+
+A mutable array topology of a networkx graph whose edges change during a
+simulation, and a log of the changes made to the graph.
+
+A `DynamicNetwork` keeps every edge in a slot of the arrays ``source`` and
+``target``. A removed edge frees its slot, and freed slots are reused by the
+edges added later, so the arrays only grow with the largest number of edges
+present at once. The neighbours of each node are kept in a dictionary
+mapping neighbour position to edge slot, making adding and removing an edge
+a constant time operation.
+
+A `TopologyLog` records the edges added to and removed from a networkx graph,
+in order, while the graph is changed through the usual networkx methods
+(``add_edge``, ``remove_edges_from``, ...). Used as a context manager around
+code changing the graph, it gives the change log of one step, which is then
+applied to the dynamic network with `DynamicNetwork.apply`::
+
+   with TopologyLog(graph) as log:
+       process.networkUpdateRule(graph, dt)
+   added, removed = dynamicNetwork.apply(log)
+
+Nodes are numbered as by `nepidemix.utilities.ArrayNetwork`. The node set is
+fixed.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["DynamicNetwork", "TopologyLog"]
+
+import numpy
+import networkx
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+
+class DynamicNetwork(object):
+    """
+    Topology of a networkx graph with edges in reusable slots.
+
+    Attributes
+    ----------
+
+    nodes : list
+       The networkx node ids in array order.
+
+    nodeIndex : dict
+       Map from networkx node id to array position.
+
+    directed : bool
+       True if the graph is directed.
+
+    replicates : int
+       Always 1, as for an `ArrayNetwork` holding one copy of the graph.
+
+    source, target : numpy.ndarray
+       Array positions of the end nodes of the edge in each slot. Only the
+       slots given by `edgeSlots` hold edges.
+
+    alive : numpy.ndarray
+       True for the slots holding an edge.
+
+    """
+    def __init__(self, graph):
+        """
+        Build the topology from a graph.
+
+        Parameters
+        ----------
+
+        graph : networkx.Graph
+           The graph. Only the topology is read.
+
+        """
+        self.nodes = graph.nodes()
+        self.directed = graph.is_directed()
+        self.replicates = 1
+        self.nodeIndex = dict(zip(self.nodes, xrange(len(self.nodes))))
+        # Neighbour position -> edge slot, for every node. The predecessors
+        # are the neighbours for undirected graphs.
+        self._succ = [{} for n in self.nodes]
+        if self.directed:
+            self._pred = [{} for n in self.nodes]
+        else:
+            self._pred = self._succ
+        capacity = max(16, graph.number_of_edges())
+        self.source = numpy.zeros(capacity, dtype = numpy.int64)
+        self.target = numpy.zeros(capacity, dtype = numpy.int64)
+        self.alive = numpy.zeros(capacity, dtype = bool)
+        # Slots used so far, and the freed slots among them.
+        self._numSlots = 0
+        self._free = []
+        nodeIndex = self.nodeIndex
+        for u, v in graph.edges_iter():
+            self.addEdge(nodeIndex[u], nodeIndex[v])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def numberOfEdges(self):
+        """
+        The number of edges.
+
+        """
+        return self._numSlots - len(self._free)
+
+    def edgeSlots(self):
+        """
+        The slots holding an edge, in increasing order.
+
+        """
+        return numpy.flatnonzero(self.alive[:self._numSlots])
+
+    def neighbors(self, i):
+        """
+        Array positions of the neighbours (successors) of the node at
+        position `i`.
+
+        """
+        return numpy.fromiter(self._succ[i].iterkeys(), dtype = numpy.int64,
+                              count = len(self._succ[i]))
+
+    def predecessors(self, i):
+        """
+        Array positions of the nodes having the node at position `i` as
+        neighbour.
+
+        """
+        return numpy.fromiter(self._pred[i].iterkeys(), dtype = numpy.int64,
+                              count = len(self._pred[i]))
+
+    def hasEdge(self, i, j):
+        """
+        True if there is an edge from position `i` to `j`.
+
+        """
+        return j in self._succ[i]
+
+    def addEdge(self, i, j):
+        """
+        Add an edge between the nodes at positions `i` and `j`.
+
+        Returns
+        -------
+
+        slot : int or None
+           The slot of the new edge, or None if the edge already existed.
+
+        """
+        if j in self._succ[i]:
+            return None
+        if len(self._free) > 0:
+            slot = self._free.pop()
+        else:
+            if self._numSlots == len(self.source):
+                self._grow()
+            slot = self._numSlots
+            self._numSlots += 1
+        self.source[slot] = i
+        self.target[slot] = j
+        self.alive[slot] = True
+        self._succ[i][j] = slot
+        self._pred[j][i] = slot
+        return slot
+
+    def removeEdge(self, i, j):
+        """
+        Remove the edge between the nodes at positions `i` and `j`.
+
+        Returns
+        -------
+
+        slot : int or None
+           The freed slot, or None if there was no such edge.
+
+        """
+        slot = self._succ[i].pop(j, None)
+        if slot is None:
+            return None
+        if i != j or self.directed:
+            self._pred[j].pop(i)
+        self.alive[slot] = False
+        self._free.append(slot)
+        return slot
+
+    def apply(self, log):
+        """
+        Apply the changes of a topology log, in order.
+
+        Parameters
+        ----------
+
+        log : TopologyLog
+           The changes.
+
+        Returns
+        -------
+
+        added : numpy.ndarray
+           Array of shape (number of edges added, 2) with the positions of
+           the end nodes of every edge added.
+
+        removed : numpy.ndarray
+           As `added`, for the edges removed.
+
+        """
+        if log.nodesChanged:
+            raise NepidemiXBaseException("Nodes can not be added to or removed from a dynamic network.")
+        nodeIndex = self.nodeIndex
+        added = []
+        removed = []
+        for change, u, v in log.changes:
+            i = nodeIndex[u]
+            j = nodeIndex[v]
+            if change == TopologyLog.ADD:
+                if self.addEdge(i, j) != None:
+                    added.append((i, j))
+            elif self.removeEdge(i, j) != None:
+                removed.append((i, j))
+        return (numpy.array(added, dtype = numpy.int64).reshape((-1, 2)),
+                numpy.array(removed, dtype = numpy.int64).reshape((-1, 2)))
+
+    def _grow(self):
+        """
+        Double the number of slots.
+
+        """
+        capacity = 2 * len(self.source)
+        for name in ['source', 'target', 'alive']:
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, dtype = old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+
+class TopologyLog(object):
+    """
+    Log of the edges added to and removed from a networkx graph.
+
+    Entered as a context manager the log records the changes made to the
+    graph through the networkx methods adding and removing nodes and edges,
+    until exited. Changes made directly to the adjacency dictionaries of the
+    graph are not seen.
+
+    Attributes
+    ----------
+
+    changes : list
+       The (ADD or REMOVE, node, node) edge changes, in order. Adding an
+       existing edge (such as to change its attributes) is not recorded.
+
+    nodesChanged : bool
+       True if nodes were added or removed.
+
+    """
+    ADD = 'add'
+    REMOVE = 'remove'
+
+    def __init__(self, graph):
+        """
+        Parameters
+        ----------
+
+        graph : networkx.Graph or networkx.DiGraph
+           The graph to log.
+
+        """
+        if type(graph) not in _LOGGING_CLASSES:
+            raise NepidemiXBaseException("Can not log topology changes of a {0}."\
+                                             .format(type(graph).__name__))
+        self.graph = graph
+        self.changes = []
+        self.nodesChanged = False
+
+    def __enter__(self):
+        # The graph is given a class logging the changes while in the
+        # context.
+        self.graph.__class__ = _LOGGING_CLASSES[type(self.graph)]
+        self.graph.topologyLog = self
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.graph.__class__ = self.graph.__class__.__bases__[-1]
+        del self.graph.topologyLog
+        return False
+
+
+class _TopologyLogging(object):
+    """
+    Mixin recording the topology changes of a networkx graph in its
+    `topologyLog`.
+
+    """
+    def add_node(self, n, attr_dict = None, **attr):
+        if n not in self.node:
+            self.topologyLog.nodesChanged = True
+        super(_TopologyLogging, self).add_node(n, attr_dict, **attr)
+
+    def add_nodes_from(self, nodes, **attr):
+        for n in nodes:
+            if isinstance(n, tuple) and len(n) == 2 and isinstance(n[1], dict):
+                n, ndict = n
+                natt = attr.copy()
+                natt.update(ndict)
+                self.add_node(n, natt)
+            else:
+                self.add_node(n, attr)
+
+    def remove_node(self, n):
+        if n in self.node:
+            self.topologyLog.nodesChanged = True
+        super(_TopologyLogging, self).remove_node(n)
+
+    def remove_nodes_from(self, nodes):
+        for n in nodes:
+            if n in self.node:
+                self.remove_node(n)
+
+    def add_edge(self, u, v, attr_dict = None, **attr):
+        if u not in self.node or v not in self.node:
+            self.topologyLog.nodesChanged = True
+        elif not self.has_edge(u, v):
+            self.topologyLog.changes.append((TopologyLog.ADD, u, v))
+        super(_TopologyLogging, self).add_edge(u, v, attr_dict, **attr)
+
+    def add_edges_from(self, ebunch, attr_dict = None, **attr):
+        for e in ebunch:
+            eatt = {}
+            if attr_dict != None:
+                eatt.update(attr_dict)
+            eatt.update(attr)
+            if len(e) == 3:
+                u, v, dd = e
+                eatt.update(dd)
+            else:
+                u, v = e
+            self.add_edge(u, v, eatt)
+
+    def remove_edge(self, u, v):
+        super(_TopologyLogging, self).remove_edge(u, v)
+        self.topologyLog.changes.append((TopologyLog.REMOVE, u, v))
+
+    def remove_edges_from(self, ebunch):
+        for e in ebunch:
+            u, v = e[:2]
+            if self.has_edge(u, v):
+                self.remove_edge(u, v)
+
+    def clear(self):
+        self.topologyLog.nodesChanged = True
+        super(_TopologyLogging, self).clear()
+
+
+class _LoggedGraph(_TopologyLogging, networkx.Graph):
+    pass
+
+
+class _LoggedDiGraph(_TopologyLogging, networkx.DiGraph):
+    pass
+
+
+# Map from graph class to its logging version.
+_LOGGING_CLASSES = {networkx.Graph : _LoggedGraph,
+                    networkx.DiGraph : _LoggedDiGraph}
@@ -288,6 +288,55 @@ class NepidemiXConfigParser(object):
         # Add new
         self.sectionDict[section].append((option,value))
 
+    def remove_option(self, section, option):
+        """
+        Remove an option from a section.
+
+        Parameters
+        ----------
+
+        section : str
+           The section.
+
+        option : str
+           The option.
+
+        Returns
+        -------
+
+        existed : bool
+           True if the option existed.
+
+        """
+        if not self.has_option(section, option):
+            return False
+        self.sectionDict[section] = [(opt, val) for opt, val
+                                     in self.sectionDict[section]
+                                     if opt != option]
+        return True
+
+    def remove_section(self, section):
+        """
+        Remove a section and all its options.
+
+        Parameters
+        ----------
+
+        section : str
+           The section.
+
+        Returns
+        -------
+
+        existed : bool
+           True if the section existed.
+
+        """
+        if not self.has_section(section):
+            return False
+        del self.sectionDict[section]
+        return True
+
 
     def get(self, section, option, default=None, add_if_not_existing=True, dtype=str):
         """
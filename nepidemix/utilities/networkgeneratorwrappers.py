@@ -43,6 +43,8 @@ from networkxtra.generators import *
 
 import networkxtra.utils as nwxutils
 
+from sharednetwork import loadSharedNetwork
+
 
 class NetworkGenerator(object):
     """
@@ -126,6 +128,9 @@ fast_gnp_random_graph_networkx = NetworkGenerator(nx.fast_gnp_random_graph,
 
 load_network = NetworkGenerator(nwxutils.loadNetwork, {'file':str}).create
 
+# Topology of a nepidemix.utilities.SharedNetwork file.
+load_shared_network = NetworkGenerator(loadSharedNetwork, {'file':str}).create
+
 connected_watts_strogatz_graph_networkx = NetworkGenerator(nx.connected_watts_strogatz_graph,
                                                   {'n':int, 'k':int, 'p':float}).create
 # NOTE: old version. Kept for backward comp. will be removed in future. Use above instead.
@@ -0,0 +1,281 @@
+"""
+Network snapshots
+=================
+
+Delta encoded network snapshots for processes with constant topology.
+
+Instead of a full copy of the network per saved iteration, the network is
+written once to a topology file (a networkx gpickle), followed by a binary
+log holding, for every saved iteration, the graph data and the nodes whose
+attributes changed since the previous snapshot. Node attribute dictionaries
+are interned, so a change is stored as a pair of integers.
+
+The log file starts with a header::
+
+   magic 'NPXDELTA', uint32 version, uint32 length, pickled header dict
+
+where the header dict holds the topology file name (relative to the log) and
+the list of nodes, giving the node positions used in the records. Every
+record is::
+
+   int64 iteration, uint32 number of changes, uint32 length,
+   pickled (graph data, list of new attribute dictionaries),
+   int32 node positions, int32 attribute dictionary ids
+
+All integers are little endian. The first record lists all nodes.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["DeltaSnapshotWriter", "DeltaSnapshotReader"]
+
+import cPickle
+import os
+import struct
+
+import numpy
+import networkx
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+_MAGIC = 'NPXDELTA'
+_VERSION = 1
+_HEADER = struct.Struct('<II')
+_RECORD = struct.Struct('<qII')
+
+# Attribute values of these types are interned by value.
+_PLAIN_TYPES = frozenset([str, unicode, int, long, float, bool, type(None)])
+
+
+class DeltaSnapshotWriter(object):
+    """
+    Writes delta encoded snapshots of a network with constant topology.
+
+    Attributes
+    ----------
+
+    nodes : list
+       The nodes, in the order of the positions used in the log.
+
+    """
+    def __init__(self, fileName, topologyFileName, network):
+        """
+        Write the topology file and the header of the log.
+
+        Parameters
+        ----------
+
+        fileName : str
+           Log file name. Overwritten if it exists.
+
+        topologyFileName : str
+           Topology file name, bz2 compressed if ending in '.bz2'.
+
+        network : networkx.Graph
+           The network.
+
+        """
+        networkx.readwrite.gpickle.write_gpickle(network, topologyFileName)
+        self.nodes = network.nodes()
+        self._stateIds = numpy.empty(len(self.nodes), dtype=numpy.int32)
+        self._stateIds.fill(-1)
+        self._index = {}
+        self._fp = open(fileName, 'wb')
+        header = cPickle.dumps({'topology':
+                                    os.path.relpath(topologyFileName,
+                                                    os.path.dirname(
+                                                        os.path.abspath(fileName))),
+                                'nodes': self.nodes}, 2)
+        self._fp.write(_MAGIC)
+        self._fp.write(_HEADER.pack(_VERSION, len(header)))
+        self._fp.write(header)
+        self._fp.flush()
+
+    def write(self, number, network):
+        """
+        Append a snapshot of `network` at iteration `number`.
+
+        Parameters
+        ----------
+
+        number : int
+           The iteration.
+
+        network : networkx.Graph
+           The network, having the same nodes as the one given when the writer
+           was created.
+
+        """
+        index = self._index
+        nodeData = network.node
+        newStates = []
+        ids = numpy.empty(len(self.nodes), dtype=numpy.int32)
+        for i, n in enumerate(self.nodes):
+            atts = nodeData[n]
+            key = _stateKey(atts)
+            sid = index.get(key)
+            if sid == None:
+                sid = len(index)
+                index[key] = sid
+                newStates.append(atts)
+            ids[i] = sid
+        changed = numpy.flatnonzero(ids != self._stateIds).astype(numpy.int32)
+        self._stateIds = ids
+        blob = cPickle.dumps((network.graph, newStates), 2)
+        self._fp.write(_RECORD.pack(number, len(changed), len(blob)))
+        self._fp.write(blob)
+        self._fp.write(changed.astype('<i4').tobytes())
+        self._fp.write(ids[changed].astype('<i4').tobytes())
+        self._fp.flush()
+
+    def close(self):
+        """
+        Close the log.
+
+        """
+        if not self._fp.closed:
+            self._fp.close()
+
+
+class DeltaSnapshotReader(object):
+    """
+    Rebuilds networks from a log written by `DeltaSnapshotWriter`.
+
+    Attributes
+    ----------
+
+    numbers : list
+       The saved iterations, in order.
+
+    topology : networkx.Graph
+       The network as given to the writer.
+
+    nodes : list
+       The nodes, in the order of the positions used in the log.
+
+    """
+    def __init__(self, fileName):
+        """
+        Read the header, the topology and the record index of a log.
+
+        Parameters
+        ----------
+
+        fileName : str
+           Log file name.
+
+        """
+        self._fp = open(fileName, 'rb')
+        if self._fp.read(len(_MAGIC)) != _MAGIC:
+            raise NepidemiXBaseException("'{0}' is not a network snapshot log."\
+                                             .format(fileName))
+        version, length = _HEADER.unpack(self._fp.read(_HEADER.size))
+        if version != _VERSION:
+            raise NepidemiXBaseException("Unsupported network snapshot log version {0}."\
+                                             .format(version))
+        header = cPickle.loads(self._fp.read(length))
+        self.nodes = header['nodes']
+        self.topology = networkx.readwrite.gpickle.read_gpickle(
+            os.path.join(os.path.dirname(os.path.abspath(fileName)),
+                         header['topology']))
+        # Index the records.
+        self.numbers = []
+        self._offsets = []
+        while True:
+            offset = self._fp.tell()
+            data = self._fp.read(_RECORD.size)
+            if len(data) < _RECORD.size:
+                break
+            number, numChanged, length = _RECORD.unpack(data)
+            self._fp.seek(length + 8 * numChanged, os.SEEK_CUR)
+            self.numbers.append(number)
+            self._offsets.append(offset)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        """
+        Iterate over (iteration, network) of all snapshots, in order.
+
+        """
+        ids = numpy.empty(len(self.nodes), dtype=numpy.int32)
+        states = []
+        for offset, number in zip(self._offsets, self.numbers):
+            graphData = self._apply(offset, ids, states)
+            yield number, self._build(graphData, ids, states)
+
+    def network(self, number):
+        """
+        The network as saved at iteration `number`.
+
+        """
+        if number not in self.numbers:
+            raise NepidemiXBaseException("No network saved at iteration {0}."\
+                                             .format(number))
+        ids = numpy.empty(len(self.nodes), dtype=numpy.int32)
+        states = []
+        for offset, n in zip(self._offsets, self.numbers):
+            graphData = self._apply(offset, ids, states)
+            if n == number:
+                return self._build(graphData, ids, states)
+
+    def close(self):
+        """
+        Close the log.
+
+        """
+        self._fp.close()
+
+    def _apply(self, offset, ids, states):
+        """
+        Apply the record at `offset` to the node ids and the attribute
+        dictionary list, and return the graph data of the record.
+
+        """
+        self._fp.seek(offset)
+        number, numChanged, length = _RECORD.unpack(
+            self._fp.read(_RECORD.size))
+        graphData, newStates = cPickle.loads(self._fp.read(length))
+        states.extend(newStates)
+        changed = numpy.frombuffer(self._fp.read(4 * numChanged), dtype='<i4')
+        ids[changed] = numpy.frombuffer(self._fp.read(4 * numChanged),
+                                        dtype='<i4')
+        return graphData
+
+    def _build(self, graphData, ids, states):
+        """
+        A copy of the topology with the given node attributes and graph data.
+
+        """
+        network = self.topology.copy()
+        network.graph = graphData
+        nodeData = network.node
+        for n, sid in zip(self.nodes, ids.tolist()):
+            nodeData[n] = states[sid].copy()
+        return network
+
+
+def _stateKey(atts):
+    """
+    Hashable key identifying an attribute dictionary.
+
+    Values of other than plain types (such as timed states, comparing equal to
+    their string value) are told apart by their pickled form.
+
+    """
+    items = atts.items()
+    for k, v in items:
+        if type(v) not in _PLAIN_TYPES:
+            items.sort()
+            return cPickle.dumps(items, 2)
+    return frozenset(items)
@@ -12,15 +12,16 @@ __author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
 __license__ = "Modified BSD License"
 
 __all__ = ["neighbors_data_iter", "attributeCount", "matchSetAttributes", 
-           "matchDictAttributes", "entityCountSet", "entityCountDict", 
-           "entityCount", "attributeValueDeal", "loadNetwork"]
+           "matchDictAttributes", "attributesChanged", "entityCountSet",
+           "entityCountDict", "entityCount", "attributeValueDeal", "attributeValueDealIndices",
+           "loadNetwork"]
 
 import logging
 
 import networkx as nx
 import numpy as np
 
-import random
+import itertools
 
 
 # Set up Logging
@@ -155,6 +156,39 @@ def matchDictAttributes(vdict0, vdict1):
     return True
 
 
+def attributesChanged(vdict0, vdict1):
+    """
+    Check if an updated attribute dictionary differs from the original.
+
+    Values are compared by identity rather than equality, so that a rule
+    replacing a value by an equal object (such as a re-stamped timed state)
+    is still seen as a change.
+
+    Parameters
+    ----------
+
+    vdict0 : dict
+       The original dictionary of key:value pairs.
+
+    vdict1 : dict
+       The updated dictionary.
+
+    Returns
+    -------
+
+    changed : bool
+      True if the dictionaries have different keys or if any value of vdict1
+      is not the same object as the value in vdict0.
+
+    """
+    if len(vdict0) != len(vdict1):
+        return True
+    for k, v in vdict1.iteritems():
+        if k not in vdict0 or vdict0[k] is not v:
+            return True
+    return False
+
+
 def entityCountSet(iterator, attributeSet):
     """
     Count the number of nodes/edges having an attribute dictionary which
@@ -238,7 +272,75 @@ def entityCount(iterator, attributes, matchFunc = matchSetAttributes):
 
         
 
-def attributeValueDeal(iterator, attributeValues, graphSize, dealExact = False):
+def attributeValueDealIndices(attributeValues, graphSize, dealExact = False,
+                              random = None):
+    """
+    Deal values to a number of nodes or edges as an array of value indices.
+
+    The pile of values to deal is built as counts per value and the values
+    are dealt by a single random permutation of the pile, so the time is
+    linear in the graph size.
+
+    Parameters
+    ----------
+
+    attributeValues : list
+       A list of tuples (AttDict, amount), see `attributeValueDeal`.
+
+    graphSize : int
+       The number of nodes or edges that is to be initialized.
+
+    dealExact : bool, optional
+       See `attributeValueDeal`. Default value: False
+
+    random : numpy.random.RandomState, optional
+       Generator used for the deal. Default is the global ``numpy.random``.
+
+    Returns
+    -------
+
+    indices : numpy.ndarray
+       Integer array where element i is the index in `attributeValues` of
+       the value dealt to the i:th node or edge. If `dealExact` is True and
+       the amounts sum to less than `graphSize` the array is shorter, and
+       the remaining nodes or edges are not dealt any value.
+
+    """
+    if random is None:
+        random = np.random
+    amounts = np.array([v for a,v in attributeValues], dtype=float)
+    if len(amounts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    vsum = float(np.sum(amounts))
+    if dealExact == True:
+        # Only if the sum is larger than one AND if there are more than one element
+        # Larger or equal to one.
+        if vsum == 1 and (np.sum(amounts >= 1.0) >= 1) or vsum > 1.0:
+            # Round to closest integer (should already be
+            # integer, but just to be safe).
+            counts = np.round(amounts)
+        else:
+            counts = np.round(amounts*graphSize)
+        counts = counts.astype(np.int64)
+    else:
+        # Go through, and normalize by the sum.
+        if vsum == graphSize:
+            counts = np.round(amounts)
+        else:
+            counts = np.round((amounts*graphSize)/vsum)
+        counts = counts.astype(np.int64)
+        # In case the integer math has lead to some rounding error. Add a
+        # random state, drawn as from the pile itself. Should not skew things.
+        while counts.sum() < graphSize and counts.sum() > 0:
+            counts[random.choice(len(counts),
+                                 p = counts / float(counts.sum()))] += 1
+    # Dealing the pile in random order. Any excess values, left over as the
+    # pile is larger than the graph, are thus removed at random.
+    pile = random.permutation(np.repeat(np.arange(len(counts)), counts))
+    return pile[:graphSize]
+
+def attributeValueDeal(iterator, attributeValues, graphSize, dealExact = False,
+                       random = None):
     """
     Deal values to a specific attribute of all nodes or edges in a graph.
     
@@ -266,52 +368,23 @@ def attributeValueDeal(iterator, attributeValues, graphSize, dealExact = False):
        If set to False: the number of values will be normalized by the graph size.
        Default value: False
 
+    random : numpy.random.RandomState, optional
+       Generator used for the deal. Default is the global ``numpy.random``.
+
+    See Also
+    --------
+
+    attributeValueDealIndices : The deal as an array of value indices.
+
     """
 #    logger.debug("Att vals: {0}".format(attributeValues))
-    if len(attributeValues) > 0:
-        statePile = []
-
-        vsum = float(np.sum([v for a,v in attributeValues]))
-        if dealExact == True:
-            # Only if the sum is larger than one AND if there are more than one element
-            # Larger or equal to one.
-            if vsum == 1 and (np.sum(np.array([v for a,v in attributeValues]) >= 1.0) >= 1)\
-                    or vsum > 1.0:
-                # Go over the states and numbers
-                # Round to closest integer (should already be
-                # integer, but just to be safe).
-                for s,fr in attributeValues:
-                    statePile.extend([s]*int(np.round(fr)))
-            else:
-                for s,fr in attributeValues:
-                    statePile.extend([s]*int(np.round(fr*graphSize)))
-        else:
-            # Go through, and normalize by the sum.
-            if vsum == graphSize:
-                for s,fr in attributeValues:
-                    statePile.extend([s]*int(np.round(fr)))
-            else:
-                for s,fr in attributeValues:
-                    statePile.extend([s]*int(np.round((fr*graphSize)/vsum)))
-            # In case the integer math has lead to some rounding error. Add a random state.
-            # Should not skew things.
-            while len(statePile) > graphSize:
-                statePile.remove(random.choice(statePile))
-            while len(statePile) < graphSize:
-                statePile.append(random.choice(statePile))
-
-#        logger.debug("State pile size: {0}; Gs: {1}".format(len(statePile), graphSize))
-        # Loop over the nodes and assign state.
-        for n in iterator:
-            if len(statePile) > 0:
-                v = random.choice(statePile)
-                # Set values.
-                # Last item in tuple is the nx dictionary.
-                n[-1].update(v)
-                statePile.remove(v)
-               # logger.debug("Set {0}".format(n))
-            else:
-                break
+    pile = attributeValueDealIndices(attributeValues, graphSize, dealExact,
+                                     random)
+    values = [a for a,v in attributeValues]
+    # Loop over the nodes and assign state.
+    for i, n in itertools.izip(pile.tolist(), iterator):
+        # Last item in tuple is the nx dictionary.
+        n[-1].update(values[i])
 
 def loadNetwork(file):
     """
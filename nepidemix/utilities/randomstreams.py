@@ -0,0 +1,155 @@
+"""
+Random streams
+==============
+
+Reproducible, independent random number streams derived from one seed.
+
+A simulation draws random numbers for several purposes: generating the
+network, initializing node and edge states, updating the nodes and, in the
+ensemble and parallel engines, for every replicate and every block of nodes.
+Each purpose is given a stream of its own, identified by a key such as
+``('network',)`` or ``('partition', iteration, block)``. The stream of a key
+only depends on the seed and the key, so a stream can be created in any
+process and in any order, and adding draws to one stream does not change
+the others.
+
+Streams are ``numpy.random.RandomState`` (Mersenne Twister) generators,
+initialized from an array of 32 bit words made up of the seed and the key.
+Keys may hold integers and strings.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["RandomStreams", "repetitionSeed"]
+
+import random
+import zlib
+
+import numpy
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+_MASK = 0xffffffff
+
+
+class RandomStreams(object):
+    """
+    Random number streams derived from a seed.
+
+    Attributes
+    ----------
+
+    seed : int
+       The seed.
+
+    Examples
+    --------
+
+    If R = RandomStreams(42), R.stream('replicate', 3) gives the same
+    sequence of numbers every time, and a different one from
+    R.stream('replicate', 4).
+
+    """
+    def __init__(self, seed = None):
+        """
+        Parameters
+        ----------
+
+        seed : int, optional
+           A non-negative seed. Default is a seed drawn from ``numpy.random``,
+           so that a seeded global generator still gives reproducible runs.
+
+        """
+        if seed == None:
+            seed = numpy.random.randint(2**31 - 1)
+        if seed < 0:
+            raise NepidemiXBaseException("The seed must be non-negative, got {0}."\
+                                             .format(seed))
+        self.seed = int(seed)
+
+    def stream(self, *key):
+        """
+        The random stream of a key.
+
+        Parameters
+        ----------
+
+        key : int or str
+           The key.
+
+        Returns
+        -------
+
+        random : numpy.random.RandomState
+           A new generator, at the start of the stream.
+
+        """
+        return numpy.random.RandomState(self._words(key))
+
+    def seedGlobal(self, *key):
+        """
+        Seed the global generators of the ``random`` and ``numpy.random``
+        modules from the stream of a key.
+
+        Used for code drawing from the global generators, such as the
+        network generators and user defined processes.
+
+        """
+        stream = self.stream(*key)
+        random.seed(int(stream.randint(2**31 - 1)))
+        numpy.random.seed(stream.randint(2**31 - 1, size = 4)\
+                              .astype(numpy.uint32))
+
+    def _words(self, key):
+        """
+        The initialization words of the stream of `key`.
+
+        """
+        words = []
+        seed = self.seed
+        while True:
+            words.append(seed & _MASK)
+            seed >>= 32
+            if seed == 0:
+                break
+        # The number of seed words separates the seed from the key.
+        words.append(len(words))
+        for k in key:
+            if isinstance(k, basestring):
+                words.append(zlib.crc32(k) & _MASK)
+            else:
+                words.append(int(k) & _MASK)
+        return numpy.array(words, dtype = numpy.uint32)
+
+
+def repetitionSeed(seed, repetition):
+    """
+    The seed of a repetition of a simulation configured with `seed`.
+
+    Repetition 0 keeps the seed, the others are given seeds of their own
+    derived from it, so that repetitions of a seeded configuration differ
+    but are reproducible.
+
+    Parameters
+    ----------
+
+    seed : int
+       The seed of the configuration.
+
+    repetition : int
+       The repetition number, from 0.
+
+    Returns
+    -------
+
+    seed : int
+       The seed of the repetition.
+
+    """
+    if repetition == 0:
+        return seed
+    return int(RandomStreams(seed).stream('repetition', repetition)\
+                   .randint(2**31 - 1))
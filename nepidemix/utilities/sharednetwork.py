@@ -0,0 +1,295 @@
+"""
+Shared network
+==============
+
+A network topology and node state array in a memory mapped file, shared
+between processes without copying.
+
+A `SharedNetwork` holds the CSR adjacency of an `ArrayNetwork` (``indptr``
+and ``indices``), an int32 node state array and the list of networkx node
+ids in one file. Any process can attach to the file by name, after which the
+arrays are numpy views of the mapped memory: writes to ``states`` are seen
+by all processes attached to the same file. The file is placed in
+``/dev/shm`` where available, so that it is held in memory.
+
+Pickling a `SharedNetwork` only pickles its file name, and unpickling
+attaches to the file. It can thus be passed to worker processes (for
+instance as an argument of ``multiprocessing.Pool.map``) at a constant cost.
+
+The process creating the file owns it and removes it when closed. Used as a
+context manager the network is closed on exit::
+
+   with SharedNetwork.create(ArrayNetwork(graph)) as shared:
+       pool.map(work, [(shared, i) for i in range(tasks)])
+
+The file starts with a header::
+
+   magic 'NPXSHNET', uint32 version, uint32 directed, int64 number of nodes,
+   int64 number of CSR entries, int64 length of the pickled node list
+
+followed by the arrays ``indptr`` (int64), ``indices`` (int32) and
+``states`` (int32), each starting at a multiple of 8 bytes, and the pickled
+node list. All integers are little endian.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["SharedNetwork", "loadSharedNetwork"]
+
+import cPickle
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy
+import networkx
+
+from nepidemix.exceptions import NepidemiXBaseException
+
+from arraynetwork import ArrayNetwork
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+_MAGIC = 'NPXSHNET'
+_VERSION = 1
+_HEADER = struct.Struct('<IIqqq')
+
+# Directory for shared network files, if present.
+_SHM_DIR = '/dev/shm'
+
+
+class SharedNetwork(object):
+    """
+    Network topology and node states in a shared memory mapped file.
+
+    Attributes
+    ----------
+
+    fileName : str
+       The file.
+
+    owner : bool
+       True if this object created the file, and removes it when closed.
+
+    nodes : list
+       The networkx node ids in array order.
+
+    directed : bool
+       True if the network is directed.
+
+    indptr : numpy.ndarray
+       Row pointers, int64 array of length N+1, as `ArrayNetwork.indptr`.
+
+    indices : numpy.ndarray
+       Neighbour positions, int32 array, as `ArrayNetwork.indices`.
+
+    states : numpy.ndarray
+       Node state ids, int32 array of length N. Initially zero.
+
+    """
+    def __init__(self, fileName):
+        """
+        Attach to an existing file.
+
+        Parameters
+        ----------
+
+        fileName : str
+           File created by `create`.
+
+        """
+        self.fileName = fileName
+        self.owner = False
+        with open(fileName, 'r+b') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0)
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            self._map.close()
+            raise NepidemiXBaseException("'{0}' is not a shared network file."\
+                                             .format(fileName))
+        version, directed, numNodes, nnz, nodesLength = _HEADER.unpack_from(
+            self._map, len(_MAGIC))
+        if version != _VERSION:
+            self._map.close()
+            raise NepidemiXBaseException("Unsupported shared network file version {0}."\
+                                             .format(version))
+        self.directed = bool(directed)
+        layout = _layout(numNodes, nnz)
+        self.indptr = self._view(layout[0], numpy.int64, numNodes + 1)
+        self.indices = self._view(layout[1], numpy.int32, nnz)
+        self.states = self._view(layout[2], numpy.int32, numNodes)
+        self.nodes = cPickle.loads(self._map[layout[3]:layout[3] + nodesLength])
+
+    @classmethod
+    def create(cls, arrayNetwork, states = None, fileName = None):
+        """
+        Write a network to a new file and attach to it.
+
+        Parameters
+        ----------
+
+        arrayNetwork : ArrayNetwork
+           The topology.
+
+        states : numpy.ndarray, optional
+           Initial node state ids. Default all zero.
+
+        fileName : str, optional
+           The file. Overwritten if it exists. Default is a new temporary
+           file.
+
+        Returns
+        -------
+
+        shared : SharedNetwork
+           The network, owning the file.
+
+        """
+        if fileName == None:
+            fd, fileName = tempfile.mkstemp(prefix = 'nepidemix_',
+                                            suffix = '.shnet',
+                                            dir = _SHM_DIR \
+                                                if os.path.isdir(_SHM_DIR) \
+                                                else None)
+            os.close(fd)
+        numNodes = len(arrayNetwork)
+        nnz = len(arrayNetwork.indices)
+        nodesBlob = cPickle.dumps(arrayNetwork.nodes, 2)
+        layout = _layout(numNodes, nnz)
+        with open(fileName, 'wb') as fp:
+            fp.write(_MAGIC)
+            fp.write(_HEADER.pack(_VERSION, int(arrayNetwork.directed),
+                                  numNodes, nnz, len(nodesBlob)))
+            fp.seek(layout[3])
+            fp.write(nodesBlob)
+        try:
+            shared = cls(fileName)
+        except:
+            os.remove(fileName)
+            raise
+        shared.owner = True
+        shared.indptr[:] = arrayNetwork.indptr
+        shared.indices[:] = arrayNetwork.indices
+        if states is not None:
+            shared.states[:] = states
+        logger.info("Shared network of {0} nodes in '{1}'."\
+                        .format(numNodes, fileName))
+        return shared
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    def __reduce__(self):
+        return (SharedNetwork, (self.fileName,))
+
+    def arrayNetwork(self):
+        """
+        The topology as an `ArrayNetwork` whose arrays are views of the
+        shared memory.
+
+        """
+        network = ArrayNetwork.__new__(ArrayNetwork)
+        network.nodes = self.nodes
+        network.directed = self.directed
+        network.replicates = 1
+        network.nodeIndex = dict(zip(self.nodes, xrange(len(self.nodes))))
+        network.indptr = self.indptr
+        network.indices = self.indices
+        return network
+
+    def graph(self):
+        """
+        A networkx graph with the shared topology, without attributes.
+
+        """
+        if self.directed:
+            graph = networkx.DiGraph()
+        else:
+            graph = networkx.Graph()
+        nodes = self.nodes
+        graph.add_nodes_from(nodes)
+        rows = numpy.repeat(numpy.arange(len(nodes)), numpy.diff(self.indptr))
+        graph.add_edges_from([(nodes[i], nodes[j]) for i, j in
+                              zip(rows.tolist(), self.indices.tolist())])
+        return graph
+
+    def close(self):
+        """
+        Detach from the file, and remove it if owned.
+
+        Arrays taken from this object must not be used after closing.
+
+        """
+        if self._map is None:
+            return
+        self.indptr = self.indices = self.states = None
+        self._map.close()
+        self._map = None
+        if self.owner and os.path.exists(self.fileName):
+            os.remove(self.fileName)
+
+    def _view(self, offset, dtype, count):
+        """
+        A numpy array of `count` elements of `dtype` at byte `offset` of the
+        mapped file.
+
+        """
+        return numpy.frombuffer(self._map, dtype = numpy.dtype(dtype)\
+                                    .newbyteorder('<'),
+                                count = count, offset = offset)
+
+
+def loadSharedNetwork(file):
+    """
+    Create a networkx graph from the topology in a shared network file.
+
+    Parameters
+    ----------
+
+    file : str
+       File created by `SharedNetwork.create`.
+
+    Returns
+    -------
+
+    G : networkx.Graph
+       The graph, without attributes.
+
+    """
+    shared = SharedNetwork(file)
+    try:
+        return shared.graph()
+    finally:
+        shared.close()
+
+
+def _layout(numNodes, nnz):
+    """
+    Byte offsets of indptr, indices, states and the node list.
+
+    """
+    offsets = []
+    pos = _align(len(_MAGIC) + _HEADER.size)
+    for size in [8 * (numNodes + 1), 4 * nnz, 4 * numNodes]:
+        offsets.append(pos)
+        pos = _align(pos + size)
+    offsets.append(pos)
+    return offsets
+
+
+def _align(pos):
+    return (pos + 7) & ~7
@@ -0,0 +1,311 @@
+"""
+State count recorder
+====================
+
+Columnar in-memory storage of sampled state counts, and streaming of sampled
+state counts to file.
+
+"""
+
+__author__ = "Lukas Ahrenberg <lukas@ahrenberg.se>"
+
+__license__ = "Modified BSD License"
+
+__all__ = ["StateCountRecorder", "StateCountStream"]
+
+import csv
+import os
+
+import numpy
+
+# Logging
+import logging
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+
+class StateCountRecorder(object):
+    """
+    Records samples of a state count dictionary over time.
+
+    Counts are stored as integers in a preallocated array with one row per
+    sample and one column per state label, and the sample times in a
+    separate vector. Both grow geometrically when full. A label first seen
+    in a later sample gets a new column, counted as zero in earlier samples.
+
+    Attributes
+    ----------
+
+    labels : list
+       The state labels, in the order of the count columns.
+
+    """
+    def __init__(self, capacity = 1024):
+        """
+        Parameters
+        ----------
+
+        capacity : int, optional
+           Number of samples to allocate room for initially. Default 1024.
+
+        """
+        self.labels = []
+        self._index = {}
+        self._size = 0
+        self._times = numpy.zeros(max(capacity, 1))
+        self._counts = numpy.zeros((len(self._times), 0), dtype = numpy.int64)
+
+    def __len__(self):
+        return self._size
+
+    def record(self, time, countDict):
+        """
+        Add a sample.
+
+        Parameters
+        ----------
+
+        time : float
+           The sample time.
+
+        countDict : dict
+           Map from state label to count. Values must be convertible to int.
+
+        """
+        if self._size == len(self._times):
+            self._grow(2 * len(self._times), self._counts.shape[1])
+        for label in countDict:
+            if label not in self._index:
+                self._index[label] = len(self.labels)
+                self.labels.append(label)
+        if len(self.labels) > self._counts.shape[1]:
+            self._grow(len(self._times), 2 * len(self.labels))
+        row = self._counts[self._size]
+        index = self._index
+        for label, value in countDict.iteritems():
+            row[index[label]] = int(value)
+        self._times[self._size] = time
+        self._size += 1
+
+    def data(self, labels = None):
+        """
+        The recorded samples.
+
+        Parameters
+        ----------
+
+        labels : list, optional
+           Labels of the columns to return, in order. Labels never recorded
+           give zero columns. Default is all labels, in the order of
+           `labels`.
+
+        Returns
+        -------
+
+        times : numpy.ndarray
+           Sample times.
+
+        counts : numpy.ndarray
+           Array of shape (number of samples, number of labels).
+
+        """
+        times = self._times[:self._size]
+        counts = self._counts[:self._size, :len(self.labels)]
+        if labels == None:
+            return times, counts
+        data = numpy.zeros((self._size, len(labels)), dtype = numpy.int64)
+        for i, label in enumerate(labels):
+            j = self._index.get(label)
+            if j != None:
+                data[:, i] = counts[:, j]
+        return times, data
+
+    def rows(self, labels):
+        """
+        Iterate over the samples as lists of the time followed by the counts
+        of `labels`, as written to csv files.
+
+        """
+        times, counts = self.data(labels)
+        for t, c in zip(times.tolist(), counts.tolist()):
+            yield [t] + c
+
+    def saveNPZ(self, fileName, labels = None):
+        """
+        Save the samples to a numpy .npz file.
+
+        The file holds the arrays 'times', 'counts' and 'labels', the last
+        being the string representation of each label.
+
+        Parameters
+        ----------
+
+        fileName : str
+           Output file name.
+
+        labels : list, optional
+           As for `data`.
+
+        """
+        if labels == None:
+            labels = self.labels
+        times, counts = self.data(labels)
+        numpy.savez(fileName, times = times, counts = counts,
+                    labels = numpy.array([str(l) for l in labels]))
+
+    def checkpoint(self):
+        """
+        The samples recorded so far, to be restored by `restore`.
+
+        Returns
+        -------
+
+        state : dict
+           Copies of the labels, the sample times and the counts.
+
+        """
+        return {'labels' : list(self.labels),
+                'times' : self._times[:self._size].copy(),
+                'counts' : self._counts[:self._size, :len(self.labels)].copy()}
+
+    def restore(self, state):
+        """
+        Replace the samples by those of a `checkpoint`.
+
+        """
+        self.labels = list(state['labels'])
+        self._index = dict(zip(self.labels, range(len(self.labels))))
+        self._size = 0
+        self._grow(max(len(self._times), len(state['times'])),
+                   len(self.labels))
+        self._size = len(state['times'])
+        self._times[:self._size] = state['times']
+        self._counts[:self._size] = state['counts']
+
+    def _grow(self, numSamples, numLabels):
+        """
+        Reallocate to room for `numSamples` samples and `numLabels` labels.
+
+        """
+        times = numpy.zeros(numSamples)
+        times[:self._size] = self._times[:self._size]
+        counts = numpy.zeros((numSamples, numLabels), dtype = numpy.int64)
+        counts[:self._size, :self._counts.shape[1]] = \
+            self._counts[:self._size]
+        self._times = times
+        self._counts = counts
+
+
+class StateCountStream(object):
+    """
+    Writes samples of a state count dictionary to a csv file as they are
+    recorded.
+
+    The file has the same format as the one written from a
+    `StateCountRecorder`: a header row of the time label followed by the
+    state labels, and one row per sample. Only the rows not yet flushed are
+    held in memory, so memory use does not depend on the number of samples,
+    and the rows written so far remain if the program is terminated.
+
+    The columns are fixed when the stream is created. Labels first seen in a
+    later sample are not written.
+
+    Attributes
+    ----------
+
+    labels : list
+       The state labels, in the order of the count columns.
+
+    """
+    def __init__(self, fileName, labels, timeLabel, flushInterval = 100,
+                 checkpoint = None):
+        """
+        Parameters
+        ----------
+
+        fileName : str
+           Output csv file name. Overwritten if it exists, unless
+           `checkpoint` is given.
+
+        labels : list
+           The state labels.
+
+        timeLabel : str
+           Header of the time column.
+
+        flushInterval : int, optional
+           Number of samples between flushes of the file. Default 100.
+
+        checkpoint : dict, optional
+           If given, a `checkpoint` of a stream to the same file to be
+           continued. Rows written after the checkpoint are discarded.
+
+        """
+        self.labels = list(labels)
+        self.flushInterval = max(flushInterval, 1)
+        self._warned = False
+        if checkpoint != None:
+            self._size = checkpoint['size']
+            self._fp = open(fileName, 'r+b')
+            self._fp.truncate(checkpoint['position'])
+            self._fp.seek(0, os.SEEK_END)
+            self._writer = csv.writer(self._fp)
+            return
+        self._size = 0
+        self._fp = open(fileName, 'wb')
+        self._writer = csv.writer(self._fp)
+        self._writer.writerow([timeLabel] + self.labels)
+        self._fp.flush()
+
+    def __len__(self):
+        return self._size
+
+    def record(self, time, countDict):
+        """
+        Write a sample.
+
+        Parameters
+        ----------
+
+        time : float
+           The sample time.
+
+        countDict : dict
+           Map from state label to count. Values must be convertible to int.
+
+        """
+        if not self._warned and len(countDict) > len(self.labels) \
+                and any([label not in self.labels for label in countDict]):
+            logger.warning("New state labels can not be added to a streamed state count file, and are not written.")
+            self._warned = True
+        self._writer.writerow([time] + [int(countDict.get(label, 0))
+                                        for label in self.labels])
+        self._size += 1
+        if self._size % self.flushInterval == 0:
+            self._fp.flush()
+
+    def checkpoint(self):
+        """
+        Write the rows recorded so far to disk.
+
+        Returns
+        -------
+
+        state : dict
+           The number of samples and the file position, from which a stream
+           can be continued (see `__init__`).
+
+        """
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        return {'size' : self._size, 'position' : self._fp.tell()}
+
+    def close(self):
+        """
+        Flush and close the file.
+
+        """
+        if not self._fp.closed:
+            self._fp.flush()
+            self._fp.close()
@@ -38,10 +38,12 @@ is_released = False
 
 # The packages we provide.
 packages=['nepidemix', 
+          'nepidemix.engines',
           'nepidemix.utilities',
           'nepidemix.utilities.dbio',
           'nepidemix.utilities.networkxtra',
-          'nepidemix.utilities.networkxtra.generators']
+          'nepidemix.utilities.networkxtra.generators',
+          'nepidemix.tests']
 
 
 
@@ -49,7 +51,8 @@ packages=['nepidemix',
 required_packages = ['networkx (>= 1.4)']
 
 # Program scripts
-scripts = ['scripts/nepidemix_runsimulation', 'scripts/nepidemix_initclustersim']
+scripts = ['scripts/nepidemix_runsimulation', 'scripts/nepidemix_initclustersim',
+           'scripts/nepidemix_runlocal']
 
 
 def globitall(dir, globtype = '*'):